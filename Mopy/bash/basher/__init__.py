@@ -813,6 +813,8 @@ def _get(self, mod): return partial(self.data_store.table.getItem, mod)
         'Status'    : lambda self, a: self.data_store[a].getStatus(),
         'Mod Status': lambda self, a: self.data_store[a].txt_status(),
         'CRC'       : lambda self, a: self.data_store[a].cached_mod_crc(),
+        u'Overrides': lambda self, a: self.data_store.conflict_index.\
+            count_overrides(a),
     }
     _extra_sortings = [_ModsUIList._sortEsmsFirst,
                        _ModsUIList._activeModsFirst]
@@ -832,8 +834,33 @@ def _get(self, mod): return partial(self.data_store.table.getItem, mod)
                                        self.data_store[p].header else u'-'),
         ('CRC',        lambda self, p: self.data_store[p].crc_string()),
         ('Mod Status', lambda self, p: self.data_store[p].txt_status()),
+        (u'Overrides', lambda self, p: self._overrides_string(p)),
     ])
 
+    def _overrides_string(self, mod_name):
+        conflict_index = self.data_store.conflict_index
+        # Placeholder until the index is synced, see sync_conflict_index
+        if not conflict_index.is_synced: return u'...'
+        override_count = conflict_index.count_overrides(mod_name)
+        return u'' if override_count is None else u'%d' % override_count
+
+    def sync_conflict_index(self, index_plugins=True):
+        """Bring the index behind the Overrides column up to date if the
+        column is shown. If plugins need (re)indexing, that only happens if
+        index_plugins is True, behind a progress dialog - until they get
+        indexed, the column shows a placeholder instead."""
+        conflict_index = self.data_store.conflict_index
+        if u'Overrides' not in self.cols or conflict_index.is_synced: return
+        if not conflict_index.plugins_to_index():
+            conflict_index.sync() # just the load order changed, quick
+        elif index_plugins:
+            try:
+                with balt.Progress(_(u'Indexing Plugins...'),
+                                   u'\n' + u' ' * 60, abort=True) as progress:
+                    conflict_index.sync(progress)
+            except CancelError:
+                pass
+
     #-- Drag and Drop-----------------------------------------------------
     def _dropIndexes(self, indexes, newIndex): # will mess with plugins cache !
         """Drop contiguous indexes on newIndex and return True if LO changed"""
@@ -968,6 +995,9 @@ def set_item_format(self, mod_name, item_format):
 
     def RefreshUI(self, **kwargs):
         """Refresh UI for modList - always specify refreshSaves explicitly."""
+        # Only redo the override counts if the load order changed - indexing
+        # plugins is left to BashFrame.RefreshData
+        self.sync_conflict_index(index_plugins=False)
         super(ModList, self).RefreshUI(**kwargs)
         if kwargs.pop('refreshSaves', False):
             Link.Frame.saveListRefresh(focus_list=False)
@@ -3989,6 +4019,8 @@ def RefreshData(self, evt_active=True, booting=False):
         #--Check savegames directory...
         if not booting and bosh.saveInfos.refresh():
             popSaves = 'ALL'
+        #--Index plugins that changed or got activated, if needed
+        BashFrame.modList.sync_conflict_index()
         #--Repopulate, focus will be set in ShowPanel
         if popMods:
             BashFrame.modList.RefreshUI(refreshSaves=True, # True just in case
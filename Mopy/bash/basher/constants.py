@@ -254,6 +254,7 @@
         'Name': _(u'Name'),
         'Num': _(u'MI'),
         'Order': _(u'Order'),
+        u'Overrides': _(u'Overrides'),
         'Package': _(u'Package'),
         'PlayTime':_(u'Hours'),
         'Player': _(u'Player'),
@@ -358,6 +359,7 @@
         'Size':75,
         'CRC':60,
         'Mod Status':50,
+        u'Overrides':60,
         },
     'bash.mods.renames': {},
     'bash.mods.scanDirty': True,
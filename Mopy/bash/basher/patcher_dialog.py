@@ -38,8 +38,10 @@
     LayoutOptions, OkButton, OpenButton, RevertButton, RevertToSavedButton, \
     SaveAsButton, SelectAllButton, Stretch, VLayout, DialogWindow, \
     CheckListBox, HorizontalLine
+from ..brec import close_zlib_pool
+from ..mod_files import InternedLongFids
 from ..patcher import configIsCBash, exportConfig, list_patches_dir
-from ..patcher.patch_files import PatchFile
+from ..patcher.patch_files import PatchFile, PatchManifest
 
 # Final lists of gui patcher classes instances, initialized in
 # gui_patchers.InitPatchers() based on game. These must be copied as needed.
@@ -158,7 +160,7 @@ def ShowPatcher(self,patcher):
     def PatchExecute(self): # TODO(ut): needs more work to reduce P/C differences to an absolute minimum
         """Do the patch."""
         self.accept_modal()
-        patchFile = progress = None
+        progress = None
         try:
             patch_name = self.patchInfo.name
             patch_size = self.patchInfo.size
@@ -166,59 +168,24 @@ def PatchExecute(self): # TODO(ut): needs more work to reduce P/C differences to
             timer1 = time.clock()
             #--Save configs
             self._saveConfig(patch_name)
-            #--Do it
-            log = bolt.LogFile(StringIO.StringIO())
-            patchFile = PatchFile(self.patchInfo)
-            enabled_patchers = [p.get_patcher_instance(patchFile) for p in
-                                self._gui_patchers if p.isEnabled] ##: what happens if empty
-            patchFile.init_patchers_data(enabled_patchers, SubProgress(progress, 0, 0.1)) #try to speed this up!
-            patchFile.initFactories(SubProgress(progress,0.1,0.2)) #no speeding needed/really possible (less than 1/4 second even with large LO)
-            patchFile.scanLoadMods(SubProgress(progress,0.2,0.8)) #try to speed this up!
-            patchFile.buildPatch(log,SubProgress(progress,0.8,0.9))#no speeding needed/really possible (less than 1/4 second even with large LO)
-            if len(patchFile.tes4.masters) > 255:
-                balt.showError(self,
-                    _(u'The resulting Bashed Patch contains too many '
-                      u'masters (>255). You can try to disable some '
-                      u'patchers, create a second Bashed Patch and '
-                      u'rebuild that one with only the patchers you '
-                      u'disabled in this one active.'))
-                return # Abort, we'll just blow up on saving it
-            #--Save
-            progress.setCancel(False, patch_name.s+u'\n'+_(u'Saving...'))
-            progress(0.9)
-            self._save_pbash(patchFile, patch_name)
+            #--Skip the build if nothing it depends on changed since the
+            # last one - the patch on disk is then still up to date
+            build_manifest = PatchManifest(self.patchInfo)
+            readme = bosh.modInfos.table.getItem(patch_name, 'doc')
+            up_to_date = (readme is not None and readme.exists() and
+                          build_manifest.matches_last_build())
+            if not up_to_date:
+                log = self._build_patch(patch_name, progress)
+                if log is None: return # Aborted
             #--Done
             progress.Destroy(); progress = None
-            timer2 = time.clock()
-            #--Readme and log
-            log.setHeader(None)
-            log(u'{{CSS:wtxt_sand_small.css}}')
-            logValue = log.out.getvalue()
-            log.out.close()
-            timerString = unicode(timedelta(seconds=round(timer2 - timer1, 3))).rstrip(u'0')
-            logValue = re.sub(u'TIMEPLACEHOLDER', timerString, logValue, 1)
-            readme = bosh.modInfos.store_dir.join(u'Docs', patch_name.sroot + u'.txt')
-            docsDir = bass.settings.get('balt.WryeLog.cssDir', GPath(u''))
-            tempReadmeDir = Path.tempDir().join(u'Docs')
-            tempReadme = tempReadmeDir.join(patch_name.sroot+u'.txt')
-            #--Write log/readme to temp dir first
-            with tempReadme.open('w',encoding='utf-8-sig') as file:
-                file.write(logValue)
-            #--Convert log/readmeto wtxt
-            bolt.WryeText.genHtml(tempReadme,None,docsDir)
-            #--Try moving temp log/readme to Docs dir
-            try:
-                env.shellMove(tempReadmeDir, bass.dirs[u'mods'],
-                              parent=self._native_widget)
-            except (CancelError,SkipError):
-                # User didn't allow UAC, move to My Games directory instead
-                env.shellMove([tempReadme, tempReadme.root + u'.html'],
-                              bass.dirs[u'saveBase'], parent=self)
-                readme = bass.dirs[u'saveBase'].join(readme.tail)
-            #finally:
-            #    tempReadmeDir.head.rmtree(safety=tempReadmeDir.head.stail)
-            readme = readme.root + u'.html'
-            bosh.modInfos.table.setItem(patch_name, 'doc', readme)
+            if up_to_date:
+                Link.Frame.set_status_info(
+                    _(u'%s is already up to date.') % patch_name.s)
+            else:
+                timer2 = time.clock()
+                readme = self._write_readme(patch_name, log, timer2 - timer1)
+                build_manifest.save()
             balt.playSound(self.parent, bass.inisettings['SoundSuccess'].s)
             balt.WryeLog(self.parent, readme, patch_name.s,
                          log_icons=Resources.bashBlue)
@@ -271,6 +238,69 @@ def PatchExecute(self): # TODO(ut): needs more work to reduce P/C differences to
             raise
         finally:
             if progress: progress.Destroy()
+            close_zlib_pool()
+
+    def _build_patch(self, patch_name, progress):
+        """Build the patch with the enabled patchers and save it. Returns the
+        log of the build, or None if it had to be aborted."""
+        #--Do it
+        log = bolt.LogFile(StringIO.StringIO())
+        patchFile = PatchFile(self.patchInfo)
+        enabled_patchers = [p.get_patcher_instance(patchFile) for p in
+                            self._gui_patchers if p.isEnabled] ##: what happens if empty
+        # All plugins reference the same base records, share their long fids
+        with InternedLongFids():
+            patchFile.init_patchers_data(enabled_patchers, SubProgress(progress, 0, 0.1)) #try to speed this up!
+            patchFile.initFactories(SubProgress(progress,0.1,0.2)) #no speeding needed/really possible (less than 1/4 second even with large LO)
+            patchFile.scanLoadMods(SubProgress(progress,0.2,0.8)) #try to speed this up!
+            patchFile.buildPatch(log,SubProgress(progress,0.8,0.9))#no speeding needed/really possible (less than 1/4 second even with large LO)
+        if len(patchFile.tes4.masters) > 255:
+            balt.showError(self,
+                _(u'The resulting Bashed Patch contains too many '
+                  u'masters (>255). You can try to disable some '
+                  u'patchers, create a second Bashed Patch and '
+                  u'rebuild that one with only the patchers you '
+                  u'disabled in this one active.'))
+            return None # Abort, we'll just blow up on saving it
+        #--Save
+        progress.setCancel(False, patch_name.s+u'\n'+_(u'Saving...'))
+        progress(0.9)
+        self._save_pbash(patchFile, patch_name)
+        return log
+
+    def _write_readme(self, patch_name, log, build_time):
+        """Write the log of a build to the patch's readme and return the
+        path to the html version of the readme."""
+        #--Readme and log
+        log.setHeader(None)
+        log(u'{{CSS:wtxt_sand_small.css}}')
+        logValue = log.out.getvalue()
+        log.out.close()
+        timerString = unicode(timedelta(seconds=round(build_time, 3))).rstrip(u'0')
+        logValue = re.sub(u'TIMEPLACEHOLDER', timerString, logValue, 1)
+        readme = bosh.modInfos.store_dir.join(u'Docs', patch_name.sroot + u'.txt')
+        docsDir = bass.settings.get('balt.WryeLog.cssDir', GPath(u''))
+        tempReadmeDir = Path.tempDir().join(u'Docs')
+        tempReadme = tempReadmeDir.join(patch_name.sroot+u'.txt')
+        #--Write log/readme to temp dir first
+        with tempReadme.open('w',encoding='utf-8-sig') as file:
+            file.write(logValue)
+        #--Convert log/readmeto wtxt
+        bolt.WryeText.genHtml(tempReadme,None,docsDir)
+        #--Try moving temp log/readme to Docs dir
+        try:
+            env.shellMove(tempReadmeDir, bass.dirs[u'mods'],
+                          parent=self._native_widget)
+        except (CancelError,SkipError):
+            # User didn't allow UAC, move to My Games directory instead
+            env.shellMove([tempReadme, tempReadme.root + u'.html'],
+                          bass.dirs[u'saveBase'], parent=self)
+            readme = bass.dirs[u'saveBase'].join(readme.tail)
+        #finally:
+        #    tempReadmeDir.head.rmtree(safety=tempReadmeDir.head.stail)
+        readme = readme.root + u'.html'
+        bosh.modInfos.table.setItem(patch_name, 'doc', readme)
+        return readme
 
     def _save_pbash(self, patchFile, patch_name):
         while True:
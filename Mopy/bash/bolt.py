@@ -380,6 +380,24 @@ def __missing__(self, attr_name):
 
 attrgetter_cache = _AttrGettersCache()
 
+# cache getters returning the values of several attributes at once
+class _AttrsGettersCache(dict):
+    """Maps tuples of attribute names to functions returning a tuple of the
+    values of those attributes. Lets callers fetch and compare all the
+    attributes they are interested in with a single call."""
+    def __missing__(self, attr_names):
+        if not attr_names:
+            getter = lambda _obj: ()
+        elif len(attr_names) == 1:
+            # attrgetter only returns a tuple when given several names
+            single_getter = attrgetter(attr_names[0])
+            getter = lambda obj: (single_getter(obj),)
+        else:
+            getter = attrgetter(*attr_names)
+        return self.setdefault(attr_names, getter)
+
+attrs_getter_cache = _AttrsGettersCache()
+
 # noinspection PyDefaultArgument
 def setattr_deep(obj, attr, value, __attrgetters=attrgetter_cache,
         __split_cache={}):
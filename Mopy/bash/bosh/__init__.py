@@ -41,7 +41,8 @@
 from functools import wraps, partial
 from itertools import imap
 #--Local
-from ._mergeability import isPBashMergeable, is_esl_capable
+from ._mergeability import isPBashMergeable, esl_capable_from_stats, \
+    scan_new_records
 from .mods_metadata import ConfigHelpers
 from .. import bass, bolt, balt, bush, env, load_order, archives, \
     initialization
@@ -49,14 +50,15 @@
 from ..archives import readExts
 from ..bass import dirs, inisettings, tooldirs
 from ..bolt import GPath, DataDict, deprint, sio, Path, decode, AFile, \
-    GPath_no_norm
+    GPath_no_norm, SubProgress
 from ..brec import ModReader, RecordHeader
 from ..exception import AbstractError, ArgumentError, BoltError, BSAError, \
     CancelError, FileError, ModError, PluginsFullError, SaveFileError, \
     SaveHeaderError, SkipError, StateError
 from ..ini_files import IniFile, OBSEIniFile, DefaultIniFile, GameIni, \
     get_ini_type_and_encoding
-from ..mod_files import ModFile, ModHeaderReader
+from ..mod_files import ConflictIndex, ModFile, ModHeaderReader, \
+    ModRecordIndex
 
 # Singletons, Constants -------------------------------------------------------
 reOblivion = re.compile(
@@ -1792,6 +1794,8 @@ def _modinfos_cache_wrapper(self, *args, **kwargs):
             active_changed = active != old_active
             active_set_changed = active_changed and (
                 set(active) != set(old_active))
+            if lo_changed or active_changed:
+                self.conflict_index.invalidate()
             if active_changed:
                 self._refresh_mod_inis() # before _refreshMissingStrings !
                 self._refreshBadNames()
@@ -1857,6 +1861,8 @@ def __init__(self):
         # used in RefreshData
         self.selectedBad = set()
         self.selectedExtra = []
+        # Which active plugins override which records
+        self.conflict_index = ConflictIndex(self)
         load_order.initialize_load_order_handle(self)
         # Load order caches to manipulate, then call our save methods - avoid !
         self._active_wip = []
@@ -2041,7 +2047,13 @@ def refresh(self, refresh_infos=True, booting=False, _modTimesChange=False):
         # Scan the data dir, getting info on added, deleted and modified files
         if refresh_infos:
             change = FileInfos.refresh(self, booting=booting)
-            if change: _added, _updated, deleted = change
+            if change:
+                _added, _updated, deleted = change
+                # Plugins that changed on disk need to be reindexed
+                self.conflict_index.invalidate(_updated | deleted)
+            if booting or deleted:
+                # Drop cached indices of deleted or renamed plugins
+                ModRecordIndex.prune_cache(self)
             hasChanged = bool(change)
         # If refresh_infos is False and mods are added _do_ manually refresh
         _modTimesChange = _modTimesChange and not load_order.using_txt_file()
@@ -2168,8 +2180,20 @@ def rescanMergeable(self, names, prog=None, return_results=False):
 
     def _rescanMergeable(self, names, progress, return_results):
         reasons = None if not return_results else []
+        # The plugins that have to be checked - the others can't be merged
+        # or ESL-flagged whatever they contain
+        candidates = {n for n in names if not (
+            n.cs in bush.game.bethDataFiles or self[n].is_esl() or
+            not bush.game.Esp.canBash)}
         if bush.game.check_esl:
-            is_mergeable = is_esl_capable
+            # Scan the record indices of all candidates in one batch, the
+            # loop below then only has to look at the results
+            progress.setFull(2)
+            new_rec_stats = scan_new_records(
+                [self[n] for n in names if n in candidates],
+                SubProgress(progress, 0))
+            is_mergeable = partial(esl_capable_from_stats, new_rec_stats)
+            progress = SubProgress(progress, 1)
         else:
             is_mergeable = isPBashMergeable
         mod_mergeInfo = self.table.getColumn('mergeInfo')
@@ -2178,23 +2202,21 @@ def _rescanMergeable(self, names, progress, return_results):
         for i,fileName in enumerate(names):
             progress(i,fileName.s)
             fileInfo = self[fileName]
-            cs_name = fileName.cs
-            if cs_name in bush.game.bethDataFiles:
-                if return_results: reasons.append(_(u'Is Bethesda Plugin.'))
-                canMerge = False
-            elif fileInfo.is_esl():
-                # Do not mark esls as esl capable
-                if return_results: reasons.append(_(u'Already ESL-flagged.'))
-                canMerge = False
-            elif not bush.game.Esp.canBash:
-                canMerge = False
-            else:
+            if fileName in candidates:
                 try:
                     canMerge = is_mergeable(fileInfo, self, reasons)
                 except Exception as e:
                     # deprint (_(u"Error scanning mod %s (%s)") % (fileName, e))
                     # canMerge = False #presume non-mergeable.
                     raise
+            else:
+                if return_results:
+                    if fileName.cs in bush.game.bethDataFiles:
+                        reasons.append(_(u'Is Bethesda Plugin.'))
+                    elif fileInfo.is_esl():
+                        # Do not mark esls as esl capable
+                        reasons.append(_(u'Already ESL-flagged.'))
+                canMerge = False
             if fileName in self.mergeable and u'NoMerge' in fileInfo.getBashTags():
                 tagged_no_merge.add(fileName)
                 if return_results: reasons.append(_(u'Technically mergeable '
@@ -3300,6 +3322,7 @@ def initDefaultSettings():
     inisettings['SoundError'] = GPath(u'')
     inisettings['EnableSplashScreen'] = True
     inisettings['PromptActivateBashedPatch'] = True
+    inisettings['SaveBashedPatchStats'] = False
     inisettings['WarnTooManyFiles'] = True
     inisettings['SkippedBashInstallersDirs'] = u''
 
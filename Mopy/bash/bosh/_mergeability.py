@@ -24,7 +24,7 @@
 import os
 from .. import bush
 from ..exception import ModError
-from ..mod_files import LoadFactory, ModHeaderReader, ModFile
+from ..mod_files import LoadFactory, ModFile, ModRecordIndex
 
 def _is_mergeable_no_load(modInfo, reasons):
     verbose = reasons is not None
@@ -121,6 +121,47 @@ def _dependent(modInfo, minfos):
                  mname not in minfos.mergeable]
     return dependent
 
+def _new_record_stats(modInfo):
+    """Return a tuple of the number of new records in the specified mod and
+    the highest object index among them (0 if there are none)."""
+    return ModRecordIndex.for_mod(
+        modInfo, save_cache=True).headers.new_record_stats(
+        len(modInfo.header.masters))
+
+def scan_new_records(mod_infos, progress):
+    """Scan the record indices of all the specified mods in one go, for use
+    with esl_capable_from_stats.
+
+    :param mod_infos: The ModInfo instances of the mods to scan.
+    :param progress: A Progress instance to report progress to.
+    :return: A dict mapping each mod's name to a tuple of the number of new
+             records in it and the highest object index among them - or to
+             the ModError raised while scanning it."""
+    progress.setFull(max(len(mod_infos), 1))
+    rec_stats = {}
+    for i, modInfo in enumerate(mod_infos):
+        progress(i, modInfo.name.s)
+        try:
+            rec_stats[modInfo.name] = _new_record_stats(modInfo)
+        except ModError as e:
+            rec_stats[modInfo.name] = e
+    return rec_stats
+
+def esl_capable_from_stats(rec_stats, modInfo, _minfos, reasons):
+    """Variant of is_esl_capable that uses the results of an earlier call to
+    scan_new_records instead of scanning the mod itself. rec_stats must
+    contain modInfo's name."""
+    verbose = reasons is not None
+    mod_stats = rec_stats[modInfo.name]
+    if isinstance(mod_stats, ModError):
+        if not verbose: return False
+        reasons.append(u'%s.' % mod_stats)
+    # Check for new FormIDs greater then 0xFFF
+    elif mod_stats[1] > 0xFFF:
+        if not verbose: return False
+        reasons.append(_(u'New FormIDs greater than 0xFFF.'))
+    return False if reasons else True
+
 def is_esl_capable(modInfo, _minfos, reasons):
     """Determines whether or not the specified mod can be converted to a light
     plugin. Optionally also returns the reasons it can't be converted.
@@ -132,24 +173,9 @@ def is_esl_capable(modInfo, _minfos, reasons):
                     why this mod can't be ESL flagged, or None if only the
                     return value of this method is of interest.
     :return: True if the specified mod could be flagged as ESL."""
-    verbose = reasons is not None
-    record_headers = {}
     try:
-        record_headers = ModHeaderReader.read_mod_headers(modInfo)
+        mod_stats = _new_record_stats(modInfo)
     except ModError as e:
-        if not verbose: return False
-        reasons.append(u'%s.' % e)
-    # Check for new FormIDs greater then 0xFFF
-    num_masters = len(modInfo.header.masters)
-    has_new_recs = False
-    for _rec_type, rec_headers in record_headers.iteritems():
-        for header in rec_headers:
-            if header.fid >> 24 >= num_masters:
-                if (header.fid & 0xFFFFFF) > 0xFFF:
-                    has_new_recs = True
-                    break
-        if has_new_recs:
-            if not verbose: return False
-            reasons.append(_(u'New FormIDs greater than 0xFFF.'))
-            break
-    return False if reasons else True
+        mod_stats = e
+    return esl_capable_from_stats({modInfo.name: mod_stats}, modInfo,
+                                  _minfos, reasons)
@@ -24,13 +24,15 @@
 import os
 import struct
 from functools import partial
+from operator import itemgetter
 
 from ._mergeability import is_esl_capable
 from .loot_parser import libloot_version, LOOTParser
 from .. import balt, bolt, bush, bass, load_order
 from ..bolt import GPath, deprint, sio, struct_pack, struct_unpack
-from ..brec import ModReader, MreRecord, RecordHeader
+from ..brec import MmapModReader, ModReader, MreRecord, RecordHeader
 from ..exception import BoltError, CancelError, ModError
+from ..mod_files import ModRecordIndex
 
 lootDb = None # type: LOOTParser
 
@@ -423,106 +425,98 @@ def scan_Many(modInfos, what=DEFAULT, progress=bolt.Progress(),
                 #--File stream
                 path = modInfo.getPath()
                 #--Scan
-                parentType = None
-                parentFid = None
-                parentParentFid = None
+                udr_sigs = {
+                    'ACRE',               #--Oblivion only
+                    'ACHR','REFR',        #--Both
+                    'NAVM','PHZD','PGRE', #--Skyrim only
+                }
                 # Location (Interior = #, Exteror = (X,Y)
-                with ModReader(modInfo.name,path.open('rb')) as ins:
+                with MmapModReader(modInfo.name,path.open('rb')) as ins:
                     try:
-                        insAtEnd = ins.atEnd
+                        rec_index = ModRecordIndex.for_mod(
+                            modInfo, save_cache=True)
                         insTell = ins.tell
-                        insUnpackRecHeader = ins.unpackRecHeader
+                        insSeek = ins.seek
                         insUnpackSubHeader = ins.unpackSubHeader
                         insRead = ins.read
                         ins_unpack = partial(ins.unpack, __unpacker)
                         headerSize = RecordHeader.rec_header_size
-                        while not insAtEnd():
-                            subprogress(insTell())
-                            header = insUnpackRecHeader()
-                            rtype,hsize = header.recType,header.size
-                            #(type,size,flags,fid,uint2) = ins.unpackRecHeader()
-                            if rtype == 'GRUP':
-                                groupType = header.groupType
-                                if groupType == 0 and header.label not in {'CELL','WRLD'}:
-                                    # Skip Tops except for WRLD and CELL groups
-                                    insRead(hsize-headerSize)
-                                elif detailed:
-                                    if groupType == 1:
-                                        # World Children
-                                        parentParentFid = header.label
-                                        parentType = 1 # Exterior Cell
-                                        parentFid = None
-                                    elif groupType == 2:
-                                        # Interior Cell Block
-                                        parentType = 0 # Interior Cell
-                                        parentParentFid = parentFid = None
-                                    elif groupType in {6,8,9,10}:
-                                        # Cell Children, Cell Persistent Children,
-                                        # Cell Temporary Children, Cell VWD Children
-                                        parentFid = header.label
-                                    else: # 3,4,5,7 - Topic Children
-                                        pass
-                            else:
-                                if doUDR and header.flags1 & 0x20 and rtype in (
-                                    'ACRE',               #--Oblivion only
-                                    'ACHR','REFR',        #--Both
-                                    'NAVM','PHZD','PGRE', #--Skyrim only
-                                    ):
-                                    if not detailed:
-                                        udr[header.fid] = ModCleaner.UdrInfo(header.fid)
-                                    else:
-                                        fid = header.fid
-                                        udr[fid] = ModCleaner.UdrInfo(fid,rtype,parentFid,u'',parentType,parentParentFid,u'',None)
-                                        parents_to_scan.setdefault(parentFid,set())
-                                        parents_to_scan[parentFid].add(fid)
-                                        if parentParentFid:
-                                            parents_to_scan.setdefault(parentParentFid,set())
-                                            parents_to_scan[parentParentFid].add(fid)
-                                if doFog and rtype == 'CELL':
-                                    nextRecord = insTell() + hsize
-                                    while insTell() < nextRecord:
-                                        (nextType,nextSize) = insUnpackSubHeader()
-                                        if nextType != 'XCLL':
-                                            insRead(nextSize)
-                                        else:
-                                            color,near,far,rotXY,rotZ,fade,clip = ins_unpack(nextSize,'CELL.XCLL')
-                                            if not (near or far or clip):
-                                                fog.add(header.fid)
+                        for header_args, rec_pos, grup_path in \
+                                rec_index.iter_records():
+                            # Only interested in CELL and WRLD contents
+                            if not grup_path or grup_path[0][1] not in {
+                                    'CELL','WRLD'}:
+                                continue
+                            subprogress(rec_pos)
+                            rtype,hsize,flags1,fid = header_args[:4]
+                            if doUDR and flags1 & 0x20 and rtype in udr_sigs:
+                                if not detailed:
+                                    udr[fid] = ModCleaner.UdrInfo(fid)
                                 else:
-                                    insRead(hsize)
+                                    parentType = None
+                                    parentFid = None
+                                    parentParentFid = None
+                                    for groupType, label in grup_path:
+                                        if groupType == 1:
+                                            # World Children
+                                            parentParentFid = label
+                                            parentType = 1 # Exterior Cell
+                                            parentFid = None
+                                        elif groupType == 2:
+                                            # Interior Cell Block
+                                            parentType = 0 # Interior Cell
+                                            parentParentFid = parentFid = None
+                                        elif groupType in {6,8,9,10}:
+                                            # Cell Children, Cell Persistent Children,
+                                            # Cell Temporary Children, Cell VWD Children
+                                            parentFid = label
+                                    udr[fid] = ModCleaner.UdrInfo(fid,rtype,parentFid,u'',parentType,parentParentFid,u'',None)
+                                    parents_to_scan.setdefault(parentFid,set())
+                                    parents_to_scan[parentFid].add(fid)
+                                    if parentParentFid:
+                                        parents_to_scan.setdefault(parentParentFid,set())
+                                        parents_to_scan[parentParentFid].add(fid)
+                            if doFog and rtype == 'CELL':
+                                insSeek(rec_pos + headerSize)
+                                nextRecord = insTell() + hsize
+                                while insTell() < nextRecord:
+                                    (nextType,nextSize) = insUnpackSubHeader()
+                                    if nextType != 'XCLL':
+                                        insRead(nextSize)
+                                    else:
+                                        color,near,far,rotXY,rotZ,fade,clip = ins_unpack(nextSize,'CELL.XCLL')
+                                        if not (near or far or clip):
+                                            fog.add(fid)
                         if parents_to_scan:
-                            # Detailed info - need to re-scan for CELL and WRLD infomation
-                            ins.seek(0)
+                            # Detailed info - need to read the CELL and WRLD
+                            # records, seek straight to them
                             baseSize = modInfo.size
-                            while not insAtEnd():
-                                subprogress(baseSize+insTell())
-                                header = insUnpackRecHeader()
-                                rtype,hsize = header.recType,header.size
-                                if rtype == 'GRUP':
-                                    if header.groupType == 0 and header.label not in {'CELL','WRLD'}:
-                                        insRead(hsize-headerSize)
-                                else:
-                                    fid = header.fid
-                                    if fid in parents_to_scan:
-                                        record = MreRecord(header,ins,True)
-                                        record.loadSubrecords()
-                                        eid = u''
-                                        for subrec in record.subrecords:
-                                            if subrec.subType == 'EDID':
-                                                eid = bolt.decode(subrec.data)
-                                            elif subrec.subType == 'XCLC':
-                                                pos = struct_unpack(
-                                                    '=2i', subrec.data[:8])
-                                        for udrFid in parents_to_scan[fid]:
-                                            if rtype == 'CELL':
-                                                udr[udrFid].parentEid = eid
-                                                if udr[udrFid].parentType == 1:
-                                                    # Exterior Cell, calculate position
-                                                    udr[udrFid].pos = pos
-                                            elif rtype == 'WRLD':
-                                                udr[udrFid].parentParentEid = eid
-                                    else:
-                                        insRead(hsize)
+                            parent_positions = rec_index.find_records(
+                                parents_to_scan)
+                            for fid, rec_pos in sorted(
+                                    parent_positions.iteritems(),
+                                    key=itemgetter(1)):
+                                subprogress(baseSize+rec_pos)
+                                insSeek(rec_pos)
+                                header = ins.unpackRecHeader()
+                                rtype = header.recType
+                                record = MreRecord(header,ins,True)
+                                record.loadSubrecords()
+                                eid = u''
+                                for subrec in record.subrecords:
+                                    if subrec.subType == 'EDID':
+                                        eid = bolt.decode(subrec.data)
+                                    elif subrec.subType == 'XCLC':
+                                        pos = struct_unpack(
+                                            '=2i', subrec.data[:8])
+                                for udrFid in parents_to_scan[fid]:
+                                    if rtype == 'CELL':
+                                        udr[udrFid].parentEid = eid
+                                        if udr[udrFid].parentType == 1:
+                                            # Exterior Cell, calculate position
+                                            udr[udrFid].pos = pos
+                                    elif rtype == 'WRLD':
+                                        udr[udrFid].parentParentEid = eid
                     except CancelError:
                         raise
                     except:
@@ -24,6 +24,8 @@
 higher-level building blocks can be found in common_subrecords.py."""
 
 from __future__ import division, print_function
+import keyword
+import re
 import struct
 
 from .utils_constants import FID, null1, _make_hashable, FixedString
@@ -125,6 +127,14 @@ def loadData(self, record, ins, sub_type, size_, readId):
         """Reads data from ins into record attribute."""
         record.__setattr__(self.attr, ins.read(size_, readId))
 
+    def get_fast_loader(self):
+        """Return a callable taking the same arguments as loadData, which
+        MelSet.loadData will call for each subrecord that this element is
+        the loader of. By default, that's just loadData itself - elements
+        that can precompile a faster version of it (see MelStruct) override
+        this."""
+        return self.loadData
+
     def dumpData(self,record,out):
         """Dumps data from record to outstream."""
         value = record.__getattribute__(self.attr)
@@ -596,6 +606,39 @@ def loadData(self, record, ins, sub_type, size_, readId):
             if action: value = action(value)
             setter(attr, value)
 
+    # Matches the attribute names we can assign to in generated code
+    _plain_attr = re.compile(u'^[A-Za-z_][A-Za-z0-9_]*$')
+
+    def get_fast_loader(self):
+        """Compile a version of loadData specialized for this struct: the
+        unpacked values are assigned straight to the record's attributes,
+        without the zip over attrs and actions or the per-attribute
+        __setattr__ calls. Falls back to loadData for subclasses that
+        override it and for structs whose values don't map one-to-one to
+        attributes with plain names."""
+        if (type(self).loadData.__func__ is not MelStruct.loadData.__func__
+                or any(not self._plain_attr.match(a) or keyword.iskeyword(a)
+                       for a in self.attrs)):
+            return self.loadData
+        num_values = len(self._unpacker(
+            null1 * struct.calcsize(self.struct_format)))
+        if num_values != len(self.attrs) or not num_values:
+            return self.loadData
+        loader_globals = {u'_unpacker': self._unpacker}
+        loader_lines = [
+            u'def _fast_loader(record, ins, sub_type, size_, readId):',
+            u'    (%s,) = ins.unpack(_unpacker, size_, readId)' % u', '.join(
+                u'v%u' % i for i in xrange(num_values))]
+        for i, (attr, action) in enumerate(zip(self.attrs, self.actions)):
+            if action:
+                loader_globals[u'_action%u' % i] = action
+                loader_lines.append(u'    record.%s = _action%u(v%u)' % (
+                    attr, i, i))
+            else:
+                loader_lines.append(u'    record.%s = v%u' % (attr, i))
+        exec(u'\n'.join(loader_lines), loader_globals)
+        return loader_globals[u'_fast_loader']
+
     def dumpData(self,record,out):
         values = []
         valuesAppend = values.append
@@ -233,6 +233,30 @@ class MreLand(MelRecord):
     __slots__ = melSet.getSlotsUsed()
 
 #------------------------------------------------------------------------------
+def _count_entry_keys(entries, entry_key):
+    """Returns a dict mapping the key of each of the specified leveled list
+    entries (as returned by entry_key, e.g. (listId, level, count)) to the
+    number of entries with that key."""
+    key_counts = {}
+    get_count = key_counts.get
+    for entry in entries:
+        e_key = entry_key(entry)
+        key_counts[e_key] = get_count(e_key, 0) + 1
+    return key_counts
+
+def _index_entries(entry_index, list_fid, entries, entry_key, delta):
+    """Adds delta to the counts of the keys of the specified entries of the
+    list with FormID list_fid in entry_index - see
+    MreLeveledListBase.mergeWith."""
+    get_count = entry_index.get
+    for entry in entries:
+        e_key = (list_fid, entry_key(entry))
+        new_count = get_count(e_key, 0) + delta
+        if new_count:
+            entry_index[e_key] = new_count
+        else:
+            del entry_index[e_key]
+
 class MreLeveledListBase(MelRecord):
     """Base type for leveled item/creature/npc/spells.
        it requires the base class to use the following:
@@ -274,12 +298,25 @@ def mergeFilter(self,modSet):
         if not self.longFids: raise StateError(u'Fids not in long format')
         self.entries = [entry for entry in self.entries if entry.listId[0] in modSet]
 
-    def mergeWith(self,other,otherMod):
+    def index_entries(self, entry_index, delta=1):
+        """Adds (delta=1) or removes (delta=-1) our entries to or from the
+        specified entry index - see mergeWith."""
+        _index_entries(entry_index, self.fid, self.entries,
+                       attrgetter(*self.__class__.entry_copy_attrs), delta)
+
+    def mergeWith(self, other, otherMod, entry_index=None):
         """Merges newLevl settings and entries with self.
         Requires that self.items, other.de_records and other.re_records be
-        defined."""
+        defined. entry_index maps (list FormID, entry key), where the entry
+        key is the tuple of an entry's entry_copy_attrs, to the number of
+        entries with that key in the list - see index_entries. If given, it
+        must already contain all our entries and is kept up to date as they
+        change. If None, an index of our entries is built for this merge."""
         if not self.longFids or not other.longFids:
             raise exception.StateError(u'Fids not in long format')
+        if entry_index is None:
+            entry_index = {}
+            self.index_entries(entry_index)
         #--Relevel or not?
         if other.re_records:
             for attr in self.__class__.top_copy_attrs:
@@ -291,20 +328,29 @@ def mergeWith(self,other,otherMod):
                 if otherAttr is not None:
                     self.__setattr__(attr, otherAttr)
             self.flags |= other.flags
+        entry_key = attrgetter(*self.__class__.entry_copy_attrs)
+        list_fid = self.fid
         #--Remove items based on other.removes
         if other.de_records or other.re_records:
             removeItems = self.items & (other.de_records | other.re_records)
-            self.entries = [entry for entry in self.entries if entry.listId not in removeItems]
+            if removeItems:
+                kept_entries, removed_entries = [], []
+                for entry in self.entries:
+                    if entry.listId in removeItems:
+                        removed_entries.append(entry)
+                    else:
+                        kept_entries.append(entry)
+                _index_entries(entry_index, list_fid, removed_entries,
+                               entry_key, -1)
+                self.entries = kept_entries
             self.items = (self.items | other.de_records) - other.re_records
-        hasOldItems = bool(self.items)
         #--Add new items from other
-        newItems = set()
-        entriesAppend = self.entries.append
-        newItemsAdd = newItems.add
-        for entry in other.entries:
-            if entry.listId not in self.items:
-                entriesAppend(entry)
-                newItemsAdd(entry.listId)
+        my_items = self.items
+        new_entries = [entry for entry in other.entries
+                       if entry.listId not in my_items]
+        newItems = {entry.listId for entry in new_entries}
+        self.entries.extend(new_entries)
+        _index_entries(entry_index, list_fid, new_entries, entry_key, 1)
         # Check if merging exceeded the counter's limit and, if so, truncate it
         # and warn. Note that pre-Skyrim games do not have this limitation.
         from .. import bush
@@ -316,11 +362,12 @@ def mergeWith(self,other,otherMod):
                          u'caused it to exceed %u entries. Truncating back '
                          u'to %u, you will have to fix this manually!' %
                          (otherMod.s, self, max_lvl_size, max_lvl_size))
+            _index_entries(entry_index, list_fid,
+                           self.entries[max_lvl_size:], entry_key, -1)
             self.entries = self.entries[:max_lvl_size]
-        entry_copy_attrs_key = attrgetter(*self.__class__.entry_copy_attrs)
         if newItems:
             self.items |= newItems
-            self.entries.sort(key=entry_copy_attrs_key)
+            self.entries.sort(key=entry_key)
         #--Is merged list different from other? (And thus written to patch.)
         if ((len(self.entries) != len(other.entries)) or
                 (self.flags != other.flags)):
@@ -334,24 +381,15 @@ def mergeWith(self,other,otherMod):
                     self.mergeOverLast = True
                     break
             else:
-                # Then, check the sort-attributes, same story
-                otherlist = other.entries
-                otherlist.sort(key=entry_copy_attrs_key)
-                for selfEntry,otherEntry in zip(self.entries,otherlist):
-                    my_val = selfEntry.__getattribute__
-                    other_val = otherEntry.__getattribute__
-                    for attr in self.__class__.entry_copy_attrs:
-                        if my_val(attr) != other_val(attr):
-                            break
-                    else:
-                        # attributes are identical, try next entry
-                        continue
-                    # attributes differ, no need to look at more entries
-                    self.mergeOverLast = True
-                    break
-                else:
-                    # Neither one had different attributes
-                    self.mergeOverLast = False
+                # Then, check the sort-attributes of the entries - the lists
+                # have as many entries, so they are the same if they have the
+                # same number of entries for each key, regardless of the
+                # order the entries are in
+                get_count = entry_index.get
+                self.mergeOverLast = any(
+                    get_count((list_fid, e_key), 0) != key_count for
+                    e_key, key_count in _count_entry_keys(
+                        other.entries, entry_key).iteritems())
         if self.mergeOverLast:
             self.mergeSources.append(otherMod)
         else:
@@ -24,13 +24,21 @@
 files."""
 
 from __future__ import division, print_function
+import atexit
+import mmap
 import os
 import struct
+import sys
+import zlib
+from array import array
+from itertools import compress
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 # no local imports beyond this, imported everywhere in brec
 from .utils_constants import _int_unpacker, group_types, null1, strFid
 from .. import bolt, exception
-from ..bolt import decode, encode, struct_pack, struct_unpack
+from ..bolt import decode, encode, sio, struct_pack, struct_unpack
 
 #------------------------------------------------------------------------------
 # Headers ---------------------------------------------------------------------
@@ -47,10 +55,14 @@ class RecordHeader(object):
     rec_pack_format_str = u''.join(rec_pack_format)
     # precompiled unpacker for record headers
     header_unpack = struct.Struct(rec_pack_format_str).unpack
+    # same, but unpacking from a buffer at an offset - see MmapModReader
+    header_unpack_from = struct.Struct(rec_pack_format_str).unpack_from
     # Format used by sub-record headers. Morrowind uses a different one.
     sub_header_fmt = u'=4sH'
     # precompiled unpacker for sub-record headers
     sub_header_unpack = struct.Struct(sub_header_fmt).unpack
+    # same, but unpacking from a buffer at an offset - see MmapModReader
+    sub_header_unpack_from = struct.Struct(sub_header_fmt).unpack_from
     # Size of sub-record headers. Morrowind has a different one.
     sub_header_size = 6
     # http://en.uesp.net/wiki/Tes5Mod:Mod_File_Format#Groups
@@ -176,6 +188,10 @@ def unpack_header(ins, __rh=RecordHeader):
     """Header factory."""
     # args = header_sig, size, uint0, uint1, uint2[, uint3]
     args = ins.unpack(__rh.header_unpack, __rh.rec_header_size, 'REC_HEADER') # PY3: header_sig, *args = ...
+    return header_from_args(ins, args)
+
+def header_from_args(ins, args, __rh=RecordHeader):
+    """Create the right kind of header from the unpacked header fields."""
     #--Bad type?
     header_sig = args[0]
     if header_sig not in __rh.valid_header_sigs:
@@ -196,6 +212,137 @@ def unpack_header(ins, __rh=RecordHeader):
                                      u'Bad Top GRUP type: %r' % str0)
     return GrupHeader(*args[1:])
 
+class RecordHeaderTable(object):
+    """Compact, column-wise storage for the headers of many records: one
+    array per header field instead of one RecHeader instance per record.
+    Signatures are stored as their uint32 codes (see sig_code). Fields that
+    the game's header format lacks (e.g. the extra field for Oblivion) are
+    stored as 0. GRUP headers are not meant to be stored in here."""
+    __slots__ = (u'sigs', u'sizes', u'flags1s', u'fids', u'flags2s',
+                 u'extras', u'offsets')
+    _sig_struct = struct.Struct(u'=I')
+    # Offset of the most significant byte of the uint32s in our arrays
+    _mod_index_offset = 3 if sys.byteorder == u'little' else 0
+
+    def __init__(self):
+        # array() wants a native str for the typecode in py2 - PY3: drop str
+        for col_attr in self.__slots__:
+            setattr(self, col_attr, array(str(u'I')))
+
+    @classmethod
+    def sig_code(cls, rec_sig, __cache={}):
+        """Return the uint32 code used to store the specified signature."""
+        try:
+            return __cache[rec_sig]
+        except KeyError:
+            return __cache.setdefault(rec_sig,
+                                      cls._sig_struct.unpack(rec_sig)[0])
+
+    @classmethod
+    def code_sig(cls, rec_code):
+        """Inverse of sig_code."""
+        return cls._sig_struct.pack(rec_code)
+
+    def append(self, header_args, rec_offset):
+        """Add a record header, given as the fields unpacked via
+        RecordHeader.header_unpack, and the offset of the header in the
+        plugin."""
+        self.sigs.append(self.sig_code(header_args[0]))
+        self.offsets.append(rec_offset)
+        num_args = len(header_args)
+        for col_index, col_attr in enumerate(
+                (u'sizes', u'flags1s', u'fids', u'flags2s', u'extras'), 1):
+            getattr(self, col_attr).append(
+                header_args[col_index] if col_index < num_args else 0)
+
+    def __len__(self): return len(self.sigs)
+
+    def iter_header_args(self):
+        """Yield the header fields of every record, in the order RecHeader
+        takes them."""
+        code_sig = self.code_sig
+        for rec_code, size, flags1, fid, flags2, extra in zip(
+                self.sigs, self.sizes, self.flags1s, self.fids, self.flags2s,
+                self.extras):
+            yield code_sig(rec_code), size, flags1, fid, flags2, extra
+
+    def new_record_stats(self, num_masters):
+        """Return the number of records whose FormID's mod index is not one
+        of the plugin's num_masters masters, i.e. of records new in the
+        plugin, and the highest object index (the lower 24 bits of the
+        FormID) among them - 0 if there are none. Works on the raw bytes of
+        the FormID column, so no Python code runs per record unless some
+        FormIDs have out of range mod indices."""
+        fids = self.fids
+        num_masters = min(num_masters, 256)
+        # The mod index is the most significant byte of each FormID
+        mod_indices = fids.tostring()[ # PY3: tobytes
+                      self._mod_index_offset::fids.itemsize]
+        new_selectors = bytearray(mod_indices.translate(
+            b'\x00' * num_masters + b'\x01' * (256 - num_masters)))
+        num_new = new_selectors.count(b'\x01')
+        if not num_new: return 0, 0
+        if mod_indices.count(chr(num_masters)) == num_new:
+            # All new records use the plugin's own mod index
+            return num_new, max(compress(fids, new_selectors)) - (
+                    num_masters << 24)
+        return num_new, max(fid & 0xFFFFFF for fid
+                            in compress(fids, new_selectors))
+
+    def __getstate__(self):
+        # Pickling arrays directly would turn them into lists of ints
+        return tuple(getattr(self, col_attr).tostring() # PY3: tobytes
+                     for col_attr in self.__slots__)
+
+    def __setstate__(self, state):
+        self.__init__()
+        for col_attr, col_bytes in zip(self.__slots__, state):
+            getattr(self, col_attr).fromstring(col_bytes) # PY3: frombytes
+
+#------------------------------------------------------------------------------
+# Parallel zlib ---------------------------------------------------------------
+# zlib releases the GIL while (de)compressing, so a pool of threads gets us
+# real parallelism for batches of compressed records
+_zlib_pool = None
+# Below this many payloads, handing them to the pool is not worth it
+_min_zlib_batch = 4
+
+def zlib_map(zlib_func, payloads):
+    """Apply zlib_func to each of the specified payloads, returning the
+    results in order. Batches that are large enough are processed by a
+    thread pool."""
+    global _zlib_pool
+    if len(payloads) < _min_zlib_batch:
+        return map(zlib_func, payloads)
+    if _zlib_pool is None:
+        _zlib_pool = ThreadPool(max(cpu_count(), 2))
+    return _zlib_pool.map(zlib_func, payloads)
+
+def close_zlib_pool():
+    """Shut down the thread pool used by zlib_map, if it was started. The
+    next zlib_map call needing it will start a new one."""
+    global _zlib_pool
+    if _zlib_pool is not None:
+        _zlib_pool.close()
+        _zlib_pool.join()
+        _zlib_pool = None
+atexit.register(close_zlib_pool)
+
+def _decompress_record_data(rec_data, __unpacker=_int_unpacker):
+    """Decompress the data of a compressed record (uint32 decompressed size
+    followed by the zlib stream). Returns None if the data is corrupt, so
+    that the record reports the error itself when it is loaded."""
+    try:
+        decomp = zlib.decompress(rec_data[4:])
+    except zlib.error:
+        return None
+    return decomp if len(decomp) == __unpacker(rec_data[:4])[0] else None
+
+def compress_record_data(rec_data):
+    """Compress the packed data of a record, prefixing it with the size of
+    the uncompressed data as the game expects."""
+    return struct_pack(u'=I', len(rec_data)) + zlib.compress(rec_data, 6)
+
 #------------------------------------------------------------------------------
 # Low-level reading/writing ---------------------------------------------------
 class ModReader(object):
@@ -213,6 +360,17 @@ def __init__(self,inName,ins):
         ins.seek(curPos)
         self.strings = {}
         self.hasStrings = False
+        # If True, MelRecords loaded from this reader defer decoding their
+        # data until first accessed - see MelRecord.ensure_loaded
+        self.lazy_unpack = False
+        # Signatures of the compressed records to decompress ahead in batches
+        # - see MmapModReader.get_decompressed
+        self.batch_decompress_sigs = frozenset()
+        # Record signature -> long fids of the only records of that type to
+        # load, plus the mapper used to get those from the headers' short
+        # fids - see ModFile.load
+        self.load_fids = {}
+        self.long_fid_mapper = None
 
     # with statement
     def __enter__(self): return self
@@ -222,6 +380,12 @@ def setStringTable(self, table):
         self.hasStrings = bool(table)
         self.strings = table or {} # table may be None
 
+    def get_decompressed(self, data_pos):
+        """Return the decompressed data of the compressed record whose data
+        starts at data_pos if it has already been decompressed, otherwise
+        None. This reader never decompresses ahead."""
+        return None
+
     #--I/O Stream -----------------------------------------
     def seek(self,offset,whence=os.SEEK_SET,recType='----'):
         """File seek."""
@@ -268,7 +432,7 @@ def readLString(self, size, recType='----', __unpacker=_int_unpacker):
         zero-terminated string."""
         if self.hasStrings:
             if size != 4:
-                endPos = self.ins.tell() + size
+                endPos = self.tell() + size
                 raise exception.ModReadError(self.inName, recType, endPos, self.size)
             id_, = self.unpack(__unpacker, 4, recType)
             if id_ == 0: return u''
@@ -331,6 +495,163 @@ def unpackSubHeader(self, recType='----', expType=None, expSize=0,
                                          (expSize,), size)
         return rec_type,size
 
+class MmapModReader(ModReader):
+    """ModReader that memory-maps the underlying file instead of going through
+    read/seek/tell calls on it. Reads become slices of the mapped buffer and
+    the record/subrecord headers are unpacked in place."""
+
+    # Maximum total size of the compressed records to decompress in one batch
+    _max_batch_size = 16 << 20
+
+    def __init__(self, inName, ins):
+        super(MmapModReader, self).__init__(inName, ins)
+        self._pos = ins.tell()
+        try:
+            self._buffer = mmap.mmap(ins.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # cannot mmap an empty file
+            self._buffer = b''
+        # Maps data positions to decompressed data, see get_decompressed
+        self._decompressed = {}
+
+    def get_decompressed(self, data_pos):
+        """Decompress the compressed record whose data starts at data_pos
+        and the ones following it in the same group that will be loaded too
+        in a batch, in parallel, and return the data of the first one. The
+        rest is kept until requested. Only records with one of the
+        batch_decompress_sigs are decompressed, if there are none this does
+        nothing. Returns None if the data was not decompressed."""
+        decompress_sigs = self.batch_decompress_sigs
+        if not decompress_sigs: return None
+        try:
+            return self._decompressed.pop(data_pos)
+        except KeyError:
+            # A new batch - anything left of the previous one was skipped
+            self._decompressed.clear()
+        # Walk the headers from here on, collecting compressed records
+        header_size = RecordHeader.rec_header_size
+        header_unpack_from = RecordHeader.header_unpack_from
+        buffer_ = self._buffer
+        file_size = self.size
+        load_fids = self.load_fids
+        to_long = self.long_fid_mapper
+        data_positions, payloads = [], []
+        batch_size = 0
+        pos = data_pos - header_size
+        while pos + header_size <= file_size and (
+                batch_size < self._max_batch_size):
+            header_args = header_unpack_from(buffer_, pos)
+            # Stop at the end of this group - whether the records in the next
+            # one get loaded is up to the group loading them
+            if header_args[0] == b'GRUP': break
+            rec_header = RecHeader(*header_args)
+            rec_sig = rec_header.recType
+            next_pos = pos + header_size + rec_header.size
+            if rec_header.flags1 & 0x00040000 and ( # compressed
+                    rec_sig in decompress_sigs) and (
+                    rec_sig not in load_fids or
+                    to_long(rec_header.fid) in load_fids[rec_sig]):
+                data_positions.append(pos + header_size)
+                payloads.append(buffer_[pos + header_size:next_pos])
+                batch_size += rec_header.size
+            pos = next_pos
+        self._decompressed.update(zip(data_positions, zlib_map(
+            _decompress_record_data, payloads)))
+        return self._decompressed.pop(data_pos, None)
+
+    def __exit__(self, exc_type, exc_value, exc_traceback): self.close()
+
+    #--I/O Stream -----------------------------------------
+    def seek(self,offset,whence=os.SEEK_SET,recType='----'):
+        """File seek."""
+        if whence == os.SEEK_CUR:
+            newPos = self._pos + offset
+        elif whence == os.SEEK_END:
+            newPos = self.size + offset
+        else:
+            newPos = offset
+        if newPos < 0 or newPos > self.size:
+            raise exception.ModReadError(self.inName, recType, newPos, self.size)
+        self._pos = newPos
+
+    def tell(self):
+        """File tell."""
+        return self._pos
+
+    def close(self):
+        """Close the mapping and the file."""
+        if self._buffer:
+            self._buffer.close()
+        self._buffer = b''
+        self._decompressed.clear()
+        self.ins.close()
+
+    def atEnd(self,endPos=-1,recType='----'):
+        """Return True if current read position is at EOF."""
+        filePos = self._pos
+        if endPos == -1:
+            return filePos == self.size
+        elif filePos > endPos:
+            raise exception.ModError(self.inName, u'Exceeded limit of: ' + recType)
+        else:
+            return filePos == endPos
+
+    #--Read/Unpack ----------------------------------------
+    def read(self,size,recType='----'):
+        """Read from file."""
+        pos = self._pos
+        endPos = pos + size
+        if endPos > self.size:
+            raise exception.ModSizeError(self.inName, recType, (endPos,),
+                                         self.size)
+        self._pos = endPos
+        return self._buffer[pos:endPos]
+
+    def unpack(self, struct_unpacker, size, recType='----'):
+        """Read size bytes from the file and unpack according to format of
+        struct_unpacker."""
+        pos = self._pos
+        endPos = pos + size
+        if endPos > self.size:
+            raise exception.ModReadError(self.inName, recType, endPos, self.size)
+        self._pos = endPos
+        return struct_unpacker(self._buffer[pos:endPos])
+
+    def unpackRecHeader(self, __rh=RecordHeader):
+        pos = self._pos
+        endPos = pos + __rh.rec_header_size
+        if endPos > self.size:
+            raise exception.ModReadError(self.inName, 'REC_HEADER', endPos,
+                                         self.size)
+        args = __rh.header_unpack_from(self._buffer, pos)
+        self._pos = endPos
+        return header_from_args(self, args)
+
+    def unpackSubHeader(self, recType='----', expType=None, expSize=0,
+                         __rh=RecordHeader):
+        """Unpack a subrecord header. Optionally checks for match with expected
+        type and size."""
+        pos = self._pos
+        endPos = pos + __rh.sub_header_size
+        if endPos > self.size:
+            raise exception.ModReadError(self.inName, recType + '.SUB_HEAD',
+                                         endPos, self.size)
+        rec_type, size = __rh.sub_header_unpack_from(self._buffer, pos)
+        self._pos = endPos
+        #--Extended storage? Rare, let the generic code deal with it
+        if rec_type == 'XXXX':
+            self._pos = pos
+            return super(MmapModReader, self).unpackSubHeader(
+                recType, expType, expSize)
+        #--Match expected name?
+        if expType and expType != rec_type:
+            raise exception.ModError(self.inName, u'%s: Expected %s subrecord, but '
+                           u'found %s instead.' % (recType, expType, rec_type))
+        #--Match expected size?
+        if expSize and expSize != size:
+            raise exception.ModSizeError(self.inName, recType + '.' + rec_type,
+                                         (expSize,), size)
+        return rec_type,size
+
 #------------------------------------------------------------------------------
 class ModWriter(object):
     """Wrapper around a TES4 output stream.  Adds utility functions."""
@@ -348,6 +669,39 @@ def seek(self,offset,whence=os.SEEK_SET): return self.out.seek(offset,whence)
     def getvalue(self): return self.out.getvalue()
     def close(self): self.out.close()
 
+    #--Streaming -------------------------------------------
+    def start_group(self, group_header):
+        """Write the specified GRUP header with a placeholder size and return
+        its position, to be passed to end_group once all of the GRUP's
+        contents have been written."""
+        group_pos = self.out.tell()
+        self.out.write(group_header.pack_head())
+        return group_pos
+
+    def end_group(self, group_pos):
+        """Back-patch the size of the GRUP whose header was written at
+        group_pos by start_group, now that all its contents have been
+        written. Returns the size of the GRUP, including its header."""
+        end_pos = self.out.tell()
+        group_size = end_pos - group_pos
+        self.out.seek(group_pos + 4)
+        self.out.write(struct_pack(u'=I', group_size))
+        self.out.seek(end_pos)
+        return group_size
+
+    def scratch_writer(self):
+        """Return an empty in-memory ModWriter, for packing data that has to
+        be measured before it can be written to this writer (see
+        MreRecord.stream_dump). The same one is reused for every call, so
+        its contents are only valid until the next call."""
+        try:
+            scratch = self._scratch
+        except AttributeError:
+            scratch = self._scratch = ModWriter(sio())
+        scratch.out.seek(0)
+        scratch.out.truncate()
+        return scratch
+
     #--Additional functions -------------------------------
     def pack(self, *args):
         self.out.write(struct_pack(*args))
@@ -29,11 +29,32 @@
 from itertools import chain
 from operator import itemgetter, attrgetter
 # Wrye Bash imports
-from .mod_io import GrupHeader, ModReader, RecordHeader, TopGrupHeader
+from .mod_io import GrupHeader, ModReader, RecordHeader, TopGrupHeader, \
+    compress_record_data, zlib_map
 from .utils_constants import group_types
 from ..bolt import GPath, sio
 from ..exception import AbstractError, ModError, ModFidMismatchError
 
+# Number of records _stream_dump_records packs before compressing the ones
+# that need it in parallel
+_dump_batch_size = 256
+
+def _stream_dump_records(out, records):
+    """Stream dumps the specified records to out, in order (see
+    MreRecord.stream_dump). Changed compressed records are packed in batches
+    and compressed in parallel."""
+    for batch_start in xrange(0, len(records), _dump_batch_size):
+        batch = records[batch_start:batch_start + _dump_batch_size]
+        to_compress = [r for r in batch if r.changed and r.flags1.compressed]
+        compressed = {}
+        if to_compress:
+            scratch_writer = out.scratch_writer
+            compressed = dict(zip(map(id, to_compress), zlib_map(
+                compress_record_data,
+                [r.pack_data(scratch_writer()) for r in to_compress])))
+        for record in batch:
+            record.stream_dump(out, compressed.get(id(record)))
+
 class MobBase(object):
     """Group of records and/or subgroups. This basic implementation does not
     support unpacking, but can report its number of records and be written."""
@@ -200,6 +221,9 @@ class MobObjects(MobBase):
     def __init__(self, header, loadFactory, ins=None, do_unpack=False):
         self.records = []
         self.id_records = {}
+        # fid -> index of the record in self.records, kept in sync with
+        # id_records so that setRecord can replace records in O(1)
+        self._id_indices = {}
         from .. import bosh
         self._null_fid = (bosh.modInfos.masterName, 0)
         super(MobObjects, self).__init__(header, loadFactory, ins, do_unpack)
@@ -215,12 +239,18 @@ def load_rec_group(self, ins, endPos):
         insAtEnd = ins.atEnd
         insRecHeader = ins.unpackRecHeader
         recordsAppend = self.records.append
+        # Skip the records we were not asked for based on their header alone
+        load_fids = ins.load_fids.get(expType)
+        to_long = ins.long_fid_mapper
         while not insAtEnd(endPos,errLabel):
             #--Get record info and handle it
             header = insRecHeader()
             if header.recType != expType:
                 raise ModError(ins.inName,u'Unexpected %s record in %s group.'
                                % (header.recType, expType))
+            if load_fids is not None and to_long(header.fid) not in load_fids:
+                ins.seek(header.size, 1, expType)
+                continue
             recordsAppend(recClass(header, ins, True))
         self.setChanged()
 
@@ -251,11 +281,11 @@ def dump(self,out):
                                     self.stamp).pack_head())
             out.write(self.data)
         else:
-            size = self.getSize()
-            if size == RecordHeader.rec_header_size: return
-            out.write(TopGrupHeader(size,self.label,0,self.stamp).pack_head())
-            for record in self.records:
-                record.dump(out)
+            if not self.records: return
+            group_pos = out.start_group(
+                TopGrupHeader(0, self.label, 0, self.stamp))
+            _stream_dump_records(out, self.records)
+            out.end_group(group_pos)
 
     def updateMasters(self, masterset_add):
         """Updates set of master names according to masters actually used."""
@@ -269,12 +299,17 @@ def convertFids(self,mapper,toLong):
         for record in self.records:
             record.convertFids(mapper,toLong)
         self.id_records.clear()
+        self._id_indices.clear()
 
     def indexRecords(self):
         """Indexes records by fid."""
         self.id_records.clear()
-        for record in self.records:
-            self.id_records[record.fid] = record
+        self._id_indices.clear()
+        id_records = self.id_records
+        id_indices = self._id_indices
+        for i, record in enumerate(self.records):
+            id_records[record.fid] = record
+            id_indices[record.fid] = i
 
     def getRecord(self,fid,default=None):
         """Gets record with corresponding id.
@@ -293,13 +328,20 @@ def setRecord(self,record):
             if record_id == self._null_fid:
                 record_id = record.eid
         self_id_recs = self.id_records
+        self_id_indices = self._id_indices
         # This check fails fairly often, so do this instead of try/except
         if record_id in self_id_recs:
-            ##: Building a fid -> index mapping in indexRecords could make this
-            # O(1) instead of O(n) - see if that's worth it (memory!)
-            self_recs[self_recs.index(
-                self_id_recs[record_id])] = record
+            rec_index = self_id_indices.get(record_id, -1)
+            old_record = self_id_recs[record_id]
+            if not (0 <= rec_index < len(self_recs) and
+                    self_recs[rec_index] is old_record):
+                # self.records was edited directly, find the record the slow
+                # way
+                rec_index = self_recs.index(old_record)
+                self_id_indices[record_id] = rec_index
+            self_recs[rec_index] = record
         else:
+            self_id_indices[record_id] = len(self_recs)
             self_recs.append(record)
         self_id_recs[record_id] = record
 
@@ -320,6 +362,7 @@ def keepRecords(self, p_keep_ids):
             record.isKeyedByEid and self._null_fid[0],
             0) and record.eid in p_keep_ids) or record.fid in p_keep_ids]
         self.id_records.clear()
+        self._id_indices.clear()
         self.setChanged()
 
     def updateRecords(self, srcBlock, mergeIds):
@@ -435,8 +478,7 @@ def dump(self, out):
         # Update TIFC if needed (i.e. Skyrim+)
         if hasattr(self.dial, u'info_count'):
             self.dial.info_count = len(self.records)
-        self.dial.getSize()
-        self.dial.dump(out)
+        self.dial.stream_dump(out)
         if not self.changed:
             out.write(self.header.pack_head())
             out.write(self.data)
@@ -444,15 +486,14 @@ def dump(self, out):
             if not self.records: return
             # Sort our INFOs by PNAM just before writing them out
             self.records = self._sort_by_pnam()
-            # Now we're ready to dump out the headers and each INFO child
-            hsize = RecordHeader.rec_header_size
-            infos_size = hsize + sum(hsize + i.getSize() for i in self.records)
+            if self.id_records: self.indexRecords()
+            # Now we're ready to dump out the headers and each INFO child.
             # Write out a GRUP header (needed in order to know the number of
             # bytes to read for all the INFOs), then dump all the INFOs
-            out.write(GrupHeader(infos_size, self.dial.fid, 7, self.stamp,
-                self.stamp2).pack_head())
-            for info in self.records:
-                info.dump(out)
+            group_pos = out.start_group(GrupHeader(0, self.dial.fid, 7,
+                self.stamp, self.stamp2))
+            _stream_dump_records(out, self.records)
+            out.end_group(group_pos)
 
     def get_all_signatures(self):
         return {self.dial.recType} | {i.recType for i in self.records}
@@ -471,6 +512,7 @@ def keepRecords(self, p_keep_ids):
         if self.dial.fid not in p_keep_ids:
             self.dial = None # will drop us from MobDials
         self.id_records.clear()
+        self._id_indices.clear()
         self.setChanged()
 
     def merge_records(self, block, loadSet, mergeIds, iiSkipMerge, doFilter):
@@ -657,12 +699,15 @@ def dump(self, out):
             out.write(self.header.pack_head())
             out.write(self.data)
         else:
-            dial_size = self.getSize()
-            if dial_size == RecordHeader.rec_header_size: return
-            out.write(TopGrupHeader(dial_size, self.label, 0,
-                self.stamp).pack_head())
+            if not self.dialogues: return
+            group_pos = out.start_group(
+                TopGrupHeader(0, self.label, 0, self.stamp))
             for dialogue in self.dialogues:
+                # dump used to size the group via getSize first, which gives
+                # the DIAL children groups our stamp - keep writing that
+                dialogue.stamp = self.stamp
                 dialogue.dump(out)
+            out.end_group(group_pos)
 
     def convertFids(self, mapper, toLong):
         for dialogue in self.dialogues:
@@ -898,31 +943,29 @@ def getBsb(self):
 
     def dump(self,out):
         """Dumps group header and then records."""
-        self.cell.getSize()
-        self.cell.dump(out)
-        childrenSize = self.getChildrenSize()
-        if not childrenSize: return
-        self._write_group_header(out, childrenSize, 6)
+        self.cell.stream_dump(out)
+        has_temp = self.temp_refs or self.pgrd or self.land
+        if not (self.persistent_refs or has_temp or self.distant_refs):
+            return
+        children_pos = self._start_group(out, 6)
         if self.persistent_refs:
-            self._write_group_header(out, self.getPersistentSize(), 8)
-            for record in self.persistent_refs:
-                record.dump(out)
-        if self.temp_refs or self.pgrd or self.land:
-            self._write_group_header(out, self.getTempSize(), 9)
-            if self.pgrd:
-                self.pgrd.dump(out)
-            if self.land:
-                self.land.dump(out)
-            for record in self.temp_refs:
-                record.dump(out)
+            group_pos = self._start_group(out, 8)
+            _stream_dump_records(out, self.persistent_refs)
+            out.end_group(group_pos)
+        if has_temp:
+            group_pos = self._start_group(out, 9)
+            _stream_dump_records(out, [r for r in (self.pgrd, self.land) if r]
+                                + self.temp_refs)
+            out.end_group(group_pos)
         if self.distant_refs:
-            self._write_group_header(out, self.getDistantSize(), 10)
-            for record in self.distant_refs:
-                record.dump(out)
+            group_pos = self._start_group(out, 10)
+            _stream_dump_records(out, self.distant_refs)
+            out.end_group(group_pos)
+        out.end_group(children_pos)
 
-    def _write_group_header(self, out, group_size, group_type):
-        out.write(GrupHeader(group_size, self.cell.fid, group_type,
-                             self.stamp).pack_head()) # FIXME was TESIV only - self.extra??
+    def _start_group(self, out, group_type):
+        return out.start_group(GrupHeader(0, self.cell.fid, group_type,
+                                          self.stamp)) # FIXME was TESIV only - self.extra??
 
     #--Fid manipulation, record filtering ----------------------------------
     def convertFids(self,mapper,toLong):
@@ -1129,48 +1172,39 @@ def getUsedSubblocks(self):
         """Returns a set of block/sub-blocks that exist in this group."""
         return {x.getBsb() for x in self.cellBlocks}
 
-    def getBsbSizes(self):
-        """Returns the total size of the block, but also returns a
-        dictionary containing the sizes of the individual block,subblocks."""
+    def _sorted_bsb_cell_blocks(self):
+        """Returns a list of (bsb, cell block) tuples, sorted in the order the
+        cell blocks have to be written in."""
         bsbCellBlocks = [(x.getBsb(),x) for x in self.cellBlocks]
         bsbCellBlocks.sort(key = lambda y: y[1].cell.fid)
         bsbCellBlocks.sort(key = itemgetter(0))
-        bsb_size = {}
-        hsize = RecordHeader.rec_header_size
-        totalSize = hsize
-        bsb_setDefault = bsb_size.setdefault
-        for bsb,cellBlock in bsbCellBlocks:
-            cellBlockSize = cellBlock.getSize()
-            totalSize += cellBlockSize
-            bsb0 = (bsb[0],None) #--Block group
-            bsb_setDefault(bsb0,hsize)
-            if bsb_setDefault(bsb, hsize) == hsize:
-                bsb_size[bsb0] += hsize
-            bsb_size[bsb] += cellBlockSize
-            bsb_size[bsb0] += cellBlockSize
-        totalSize += hsize * len(bsb_size)
-        return totalSize,bsb_size,bsbCellBlocks
-
-    def dumpBlocks(self,out,bsbCellBlocks,bsb_size,blockGroupType,
-                   subBlockGroupType):
+        return bsbCellBlocks
+
+    def dumpBlocks(self, out, blockGroupType, subBlockGroupType):
         """Dumps the cell blocks and their block and sub-block groups to
-        out."""
+        out. The sizes of the block and sub-block groups are back-patched
+        once their contents have been written."""
         curBlock = None
         curSubblock = None
+        block_pos = subblock_pos = None
         stamp = self.stamp
-        outWrite = out.write
-        for bsb,cellBlock in bsbCellBlocks:
+        for bsb,cellBlock in self._sorted_bsb_cell_blocks():
             (block,subblock) = bsb
-            bsb0 = (block,None)
             if block != curBlock:
-                curBlock,curSubblock = bsb0
-                outWrite(GrupHeader(bsb_size[bsb0], block, blockGroupType, ##: Here come the tuples - specialized GrupHeader subclass?
-                                    stamp).pack_head())
+                if subblock_pos is not None: out.end_group(subblock_pos)
+                if block_pos is not None: out.end_group(block_pos)
+                curBlock,curSubblock = block,None
+                subblock_pos = None
+                block_pos = out.start_group(GrupHeader(0, block, ##: Here come the tuples - specialized GrupHeader subclass?
+                    blockGroupType, stamp))
             if subblock != curSubblock:
+                if subblock_pos is not None: out.end_group(subblock_pos)
                 curSubblock = subblock
-                outWrite(GrupHeader(bsb_size[bsb], subblock, subBlockGroupType, ##: Here come the tuples - specialized GrupHeader subclass?
-                                    stamp).pack_head())
+                subblock_pos = out.start_group(GrupHeader(0, subblock, ##: Here come the tuples - specialized GrupHeader subclass?
+                    subBlockGroupType, stamp))
             cellBlock.dump(out)
+        if subblock_pos is not None: out.end_group(subblock_pos)
+        if block_pos is not None: out.end_group(block_pos)
 
     def getNumRecords(self,includeGroups=True):
         """Returns number of records, including self and all children."""
@@ -1350,10 +1384,9 @@ def dump(self,out):
             out.write(self.header.pack_head())
             out.write(self.data)
         elif self.cellBlocks:
-            (totalSize, bsb_size, blocks) = self.getBsbSizes()
-            self.header.size = totalSize
-            out.write(self.header.pack_head())
-            self.dumpBlocks(out,blocks,bsb_size,2,3)
+            group_pos = out.start_group(self.header)
+            self.dumpBlocks(out,2,3)
+            self.header.size = out.end_group(group_pos)
 
 #------------------------------------------------------------------------------
 class MobWorld(MobCells):
@@ -1480,29 +1513,22 @@ def getNumRecords(self,includeGroups=True):
     def dump(self,out):
         """Dumps group header and then records.  Returns the total size of
         the world block."""
-        hsize = RecordHeader.rec_header_size
-        worldSize = self.world.getSize() + hsize
-        self.world.dump(out)
+        worldSize = self.world.stream_dump(out)
         if not self.changed:
             out.write(self.header.pack_head())
             out.write(self.data)
             return self.size + worldSize
         elif self.cellBlocks or self.road or self.worldCellBlock:
-            (totalSize, bsb_size, blocks) = self.getBsbSizes()
-            if self.road:
-                totalSize += self.road.getSize() + hsize
-            if self.worldCellBlock:
-                totalSize += self.worldCellBlock.getSize()
-            self.header.size = totalSize
             self.header.label = self.world.fid
             self.header.groupType = 1
-            out.write(self.header.pack_head())
+            group_pos = out.start_group(self.header)
             if self.road:
-                self.road.dump(out)
+                self.road.stream_dump(out)
             if self.worldCellBlock:
                 self.worldCellBlock.dump(out)
-            self.dumpBlocks(out,blocks,bsb_size,4,5)
-            return totalSize + worldSize
+            self.dumpBlocks(out,4,5)
+            self.header.size = out.end_group(group_pos)
+            return self.header.size + worldSize
         else:
             return worldSize
 
@@ -1719,14 +1745,11 @@ def dump(self,out):
             out.write(self.data)
         else:
             if not self.worldBlocks: return
-            worldHeaderPos = out.tell()
-            header = TopGrupHeader(0, self.label, 0, self.stamp)
-            out.write(header.pack_head())
-            totalSize = RecordHeader.rec_header_size + sum(
-                x.dump(out) for x in self.worldBlocks)
-            out.seek(worldHeaderPos + 4)
-            out.pack(u'I', totalSize)
-            out.seek(worldHeaderPos + totalSize)
+            group_pos = out.start_group(
+                TopGrupHeader(0, self.label, 0, self.stamp))
+            for world_block in self.worldBlocks:
+                world_block.dump(out)
+            out.end_group(group_pos)
 
     def getNumRecords(self,includeGroups=True):
         """Returns number of records, including self and all children."""
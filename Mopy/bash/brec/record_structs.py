@@ -27,10 +27,11 @@
 import copy
 import zlib
 
-from .mod_io import ModReader, ModWriter
+from .mod_io import ModReader, ModWriter, RecordHeader, \
+    compress_record_data
 from .utils_constants import strFid, _int_unpacker
 from .. import bolt, exception
-from ..bolt import decode, sio, struct_pack
+from ..bolt import decode, sio
 
 #------------------------------------------------------------------------------
 # Mod Element Sets ------------------------------------------------------------
@@ -51,6 +52,16 @@ def __init__(self,*elements):
                 raise SyntaxError(u"Invalid signature '%s': Signatures must "
                                   u'be bytestrings and 4 bytes in '
                                   u'length.' % sig_candidate)
+        # Built on the first load, see _build_decoders
+        self._decoders = None
+
+    def _build_decoders(self):
+        """Precompile the loadData function for each subrecord type, see
+        MelBase.get_fast_loader. Reset _decoders to None whenever loaders
+        change."""
+        self._decoders = {sub_type: loader.get_fast_loader()
+                          for sub_type, loader in self.loaders.iteritems()}
+        return self._decoders
 
     def getSlotsUsed(self):
         """This function returns all of the attributes used in record instances
@@ -80,6 +91,15 @@ def check_duplicate_attrs(self, curr_rec_sig):
 
     def initRecord(self, record, header, ins, do_unpack):
         """Initialize record, setting its attributes based on its elements."""
+        if do_unpack is True and ins and ins.lazy_unpack:
+            # Only read the raw data for now, MelRecord.ensure_loaded will
+            # set the defaults and decode it on first access
+            record.__class__ = _lazy_record_class(record.__class__)
+            record._pending_unpack = (
+                ins.strings if ins.hasStrings else None, None)
+            MreRecord.__init__(record, header, ins, False)
+            return
+        record._pending_unpack = None
         for element in self.elements:
             element.setDefault(record)
         MreRecord.__init__(record, header, ins, do_unpack)
@@ -92,7 +112,8 @@ def getDefault(self,attr):
     def loadData(self,record,ins,endPos):
         """Loads data from input stream. Called by load()."""
         rec_type = record.recType
-        loaders = self.loaders
+        decoders = self._decoders
+        if decoders is None: decoders = self._build_decoders()
         # Load each subrecord
         ins_at_end = ins.atEnd
         load_sub_header = ins.unpackSubHeader
@@ -100,8 +121,8 @@ def loadData(self,record,ins,endPos):
         while not ins_at_end(endPos, rec_type):
             sub_type, sub_size = load_sub_header(rec_type)
             try:
-                loaders[sub_type].loadData(record, ins, sub_type, sub_size,
-                                           read_id_prefix + sub_type)
+                decoders[sub_type](record, ins, sub_type, sub_size,
+                                   read_id_prefix + sub_type)
             except KeyError:
                 # Wrap this error to make it more understandable
                 self._handle_load_error(
@@ -181,6 +202,7 @@ def with_distributor(self, distributor_config):
         self.elements += (distributor,)
         distributor.getLoaders(self.loaders)
         distributor.set_mel_set(self)
+        self._decoders = None
         return self
 
 #------------------------------------------------------------------------------
@@ -330,7 +352,7 @@ class MreRecord(object):
         # MultiBound
         (31,'multiBound'), # {0x80000000}
         ))
-    __slots__ = ['header','recType','fid','flags1','size','flags2','changed','subrecords','data','inName','longFids',]
+    __slots__ = ['header','recType','fid','flags1','size','flags2','changed','subrecords','data','inName','longFids','_raw_masters',]
     #--Set at end of class data definitions.
     type_class = None
     simpleTypes = None
@@ -345,6 +367,11 @@ def __init__(self, header, ins=None, do_unpack=False):
         self.flags2 = header.flags2
         self.longFids = False #--False: Short (numeric); True: Long (espname,objectindex)
         self.changed = False
+        # The masters of the mapper that converted our fids to long while we
+        # were loaded lazily and not decoded yet, if our raw data was up to
+        # date then and nothing but setChanged calls happened since - see
+        # MelRecord.convertFids
+        self._raw_masters = None
         self.subrecords = None
         self.data = ''
         self.inName = ins and ins.inName
@@ -372,6 +399,7 @@ def getTypeCopy(self,mapper=None):
             myCopy.convertFids(mapper,True)
         myCopy.changed = True
         myCopy.data = None
+        myCopy._raw_masters = None
         return myCopy
 
     def mergeFilter(self,modSet):
@@ -407,9 +435,14 @@ def load(self, ins=None, do_unpack=False):
         #--Buffered analysis (subclasses only)
         else:
             if ins:
+                data_pos = ins.tell()
                 self.data = ins.read(self.size,type)
             if not self.__class__ == MreRecord:
-                with self.getReader() as reader:
+                # The reader may have decompressed our data already
+                decomp = (ins and self.flags1.compressed and
+                          ins.get_decompressed(data_pos))
+                with (ModReader(self.inName, sio(decomp)) if decomp
+                      else self.getReader()) as reader:
                     # Check This
                     if ins and ins.hasStrings: reader.setStringTable(ins.strings)
                     self.loadData(reader,reader.size)
@@ -453,12 +486,14 @@ def updateMasters(self, masterset_add):
     def setChanged(self,value=True):
         """Sets changed attribute to value. [Default = True.]"""
         self.changed = value
+        self._raw_masters = None
 
     def setData(self,data):
         """Sets data and size."""
         self.data = data
         self.size = len(data)
         self.changed = False
+        self._raw_masters = None
 
     def getSize(self):
         """Return size of self.data, after, if necessary, packing it."""
@@ -471,9 +506,7 @@ def getSize(self):
             self.dumpData(out)
             self.data = out.getvalue()
         if self.flags1.compressed:
-            dataLen = len(self.data)
-            comp = zlib.compress(self.data,6)
-            self.data = struct_pack('=I', dataLen) + comp
+            self.data = compress_record_data(self.data)
         self.size = len(self.data)
         self.setChanged(False)
         return self.size
@@ -500,6 +533,41 @@ def dump(self,out):
         out.write(self.header.pack_head())
         if self.size > 0: out.write(self.data)
 
+    def stream_dump(self, out, packed_data=None):
+        """Writes the record to out, like calling getSize and then dump. A
+        changed record is packed into the scratch buffer of out, so it is
+        serialized exactly once, and the packed data becomes its data - the
+        record is not changed anymore afterwards. Returns the number of bytes
+        written, including the header.
+
+        :param packed_data: If specified, the result of pack_data for this
+            record, already compressed if the record is compressed."""
+        if packed_data is None:
+            if not self.changed:
+                self.dump(out)
+                return RecordHeader.rec_header_size + self.size
+            packed_data = self.pack_data(out.scratch_writer())
+            if self.flags1.compressed:
+                packed_data = compress_record_data(packed_data)
+        #--Update the header so it 'packs' correctly
+        rec_header = self.header
+        rec_header.size = len(packed_data)
+        rec_header.flags1 = self.flags1
+        rec_header.fid = self.fid
+        out.write(rec_header.pack_head())
+        out.write(packed_data)
+        self.setData(packed_data)
+        return RecordHeader.rec_header_size + rec_header.size
+
+    def pack_data(self, scratch):
+        """Packs the record's current state into the (empty) scratch writer
+        and returns the packed data, uncompressed."""
+        if self.longFids: raise exception.StateError(
+            u'Packing Error: %s %s: Fids in long format.'
+            % (self.recType,self.fid))
+        self.dumpData(scratch)
+        return scratch.getvalue()
+
     def getReader(self):
         """Returns a ModReader wrapped around (decompressed) self.data."""
         return ModReader(self.inName,sio(self.getDecompressed()))
@@ -547,11 +615,61 @@ class MelRecord(MreRecord):
     # If set to False, skip the check for duplicate attributes for this
     # subrecord. See MelSet.check_duplicate_attrs for more information.
     _has_duplicate_attrs = False
-    __slots__ = []
+    # None, or a tuple of (string table, long fid mapper) if this record was
+    # loaded lazily and has not been decoded yet - see ensure_loaded
+    __slots__ = [u'_pending_unpack']
 
     def __init__(self, header, ins=None, do_unpack=False):
         self.__class__.melSet.initRecord(self, header, ins, do_unpack)
 
+    def ensure_loaded(self):
+        """Decode the raw data of this record if it was loaded lazily (see
+        ModFile.load), applying any fid conversion that was deferred until
+        then. Called automatically when one of the record's subrecord
+        attributes is first read or written."""
+        real_class = _lazy_real_classes.get(self.__class__)
+        if real_class is None: return
+        self.__class__ = real_class
+        # May be unset if we are a copy of a pending record being filled in
+        pending = getattr(self, u'_pending_unpack', None)
+        self._pending_unpack = None
+        if pending is None: return
+        string_table, long_mapper = pending
+        mel_set = self.__class__.melSet
+        for element in mel_set.elements:
+            element.setDefault(self)
+        with self.getReader() as reader:
+            reader.setStringTable(string_table)
+            self.loadData(reader, reader.size)
+        if long_mapper:
+            for element in mel_set.formElements:
+                element.mapFids(self, long_mapper, True)
+
+    def getTypeCopy(self,mapper=None):
+        """Returns a type class copy of self, optionally mapping fids to long.
+        If we were loaded lazily and have not been decoded yet, the copy
+        shares our raw data and is itself only decoded once one of its
+        subrecord attributes is first accessed - so copies that pass through
+        untouched (e.g. records the Bashed Patch trims in the end) are never
+        decoded at all."""
+        pending = self._pending_unpack
+        if pending is None:
+            self.ensure_loaded()
+            return super(MelRecord, self).getTypeCopy(mapper)
+        my_class = self.__class__
+        my_copy = my_class.__new__(my_class)
+        for attr in MreRecord.__slots__:
+            setattr(my_copy, attr, getattr(self, attr))
+        my_copy.header = copy.copy(self.header)
+        my_copy.flags1 = self.flags1()
+        my_copy._pending_unpack = pending
+        if mapper and not my_copy.longFids:
+            my_copy.convertFids(mapper, True)
+        # Keep the shared raw data around, the copy decodes from it
+        my_copy.changed = True
+        my_copy._raw_masters = None
+        return my_copy
+
     @classmethod
     def validate_record_syntax(cls):
         """Performs validations on this record's definition."""
@@ -570,17 +688,94 @@ def loadData(self,ins,endPos):
 
     def dumpData(self,out):
         """Dumps state into out. Called by getSize()."""
+        self.ensure_loaded()
         self.__class__.melSet.dumpData(self,out)
 
     def mapFids(self,mapper,save):
         """Applies mapper to fids of sub-elements. Will replace fid with mapped value if save == True."""
+        self.ensure_loaded()
         self.__class__.melSet.mapFids(self,mapper,save)
 
     def convertFids(self,mapper,toLong):
         """Converts fids between formats according to mapper.
         toLong should be True if converting to long format or False if converting to short format."""
+        pending = self._pending_unpack
+        if (pending is not None and toLong and not self.longFids
+                and pending[1] is None):
+            # Not decoded yet - convert the subrecord fids when we are
+            raw_valid = not self.changed
+            self.fid = mapper(self.fid)
+            self._pending_unpack = (pending[0], mapper)
+            self.longFids = True
+            self.setChanged()
+            if raw_valid:
+                self._raw_masters = getattr(mapper, u'fid_masters', None)
+            return
+        if (pending is not None and not toLong and self.longFids and
+                pending[1] is not None and self._raw_masters is not None and
+                self._raw_masters == getattr(mapper, u'fid_masters', None)):
+            # Never decoded, so never edited, and back to the masters we were
+            # converted from - unless our own fid does not survive the round
+            # trip (e.g. a HITME), drop the deferred conversion and write the
+            # raw data out as is
+            short_fid = mapper(self.fid)
+            if short_fid == self.header.fid:
+                self.fid = short_fid
+                self._pending_unpack = (pending[0], None)
+                self.longFids = False
+                self.setChanged(False)
+                return
+        self.ensure_loaded()
         self.__class__.melSet.convertFids(self,mapper,toLong)
 
     def updateMasters(self, masterset_add):
         """Updates set of master names according to masters actually used."""
+        self.ensure_loaded()
         self.__class__.melSet.updateMasters(self, masterset_add)
+
+#------------------------------------------------------------------------------
+# Lazily loaded records -------------------------------------------------------
+# Maps each pending record class to the record class it stands in for
+_lazy_real_classes = {}
+_lazy_pending_classes = {}
+
+class _PendingAttr(object):
+    """Descriptor standing in for a subrecord attribute on the class of
+    pending records (see _lazy_record_class). Decodes the record, which
+    switches it back to its real class, then passes the access on."""
+    __slots__ = (u'_attr',)
+
+    def __init__(self, attr): self._attr = attr
+
+    def __get__(self, record, owner):
+        if record is None: return self
+        record.ensure_loaded()
+        return getattr(record, self._attr)
+
+    def __set__(self, record, value):
+        record.ensure_loaded()
+        setattr(record, self._attr, value)
+
+    def __delete__(self, record):
+        record.ensure_loaded()
+        delattr(record, self._attr)
+
+def _lazy_record_class(rec_class):
+    """Return the class used for records of rec_class that were loaded
+    lazily and not decoded yet. It has the same layout as rec_class, so
+    records can be switched back to it, but reading or writing any of the
+    subrecord attributes first decodes the record - see
+    MelRecord.ensure_loaded. Only the subrecord attributes are overridden,
+    accessing the others (fid, flags1, etc.) costs the same as for a decoded
+    record."""
+    try:
+        return _lazy_pending_classes[rec_class]
+    except KeyError:
+        pass
+    class_dict = {attr: _PendingAttr(attr)
+                  for attr in rec_class.melSet.getSlotsUsed()}
+    class_dict.update({u'__slots__': (), u'__module__': rec_class.__module__})
+    pending_class = type(rec_class.__name__, (rec_class,), class_dict)
+    _lazy_pending_classes[rec_class] = pending_class
+    _lazy_real_classes[pending_class] = rec_class
+    return pending_class
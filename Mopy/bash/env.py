@@ -29,8 +29,8 @@
 import re as _re
 import shutil as _shutil
 import stat
-from ctypes import byref, c_wchar_p, c_void_p, POINTER, Structure, windll, \
-    wintypes
+from ctypes import byref, c_size_t, c_wchar_p, c_void_p, POINTER, sizeof, \
+    Structure, windll, wintypes
 from uuid import UUID
 
 from .bolt import GPath, deprint, Path, decode, struct_unpack
@@ -772,6 +772,42 @@ def getJava():
         java = win.join(u'syswow64', u'javaw.exe')
     return java
 
+# http://msdn.microsoft.com/en-us/library/windows/desktop/ms684877.aspx
+class _ProcessMemoryCounters(Structure):
+    _fields_ = [
+        ("cb", wintypes.DWORD),
+        ("PageFaultCount", wintypes.DWORD),
+        ("PeakWorkingSetSize", c_size_t),
+        ("WorkingSetSize", c_size_t),
+        ("QuotaPeakPagedPoolUsage", c_size_t),
+        ("QuotaPagedPoolUsage", c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", c_size_t),
+        ("QuotaNonPagedPoolUsage", c_size_t),
+        ("PagefileUsage", c_size_t),
+        ("PeakPagefileUsage", c_size_t),
+    ]
+
+_GetCurrentProcess = windll.kernel32.GetCurrentProcess
+_GetCurrentProcess.restype = wintypes.HANDLE
+_GetCurrentProcess.argtypes = []
+
+# http://msdn.microsoft.com/en-us/library/windows/desktop/ms683219.aspx
+_GetProcessMemoryInfo = windll.psapi.GetProcessMemoryInfo
+_GetProcessMemoryInfo.restype = wintypes.BOOL
+_GetProcessMemoryInfo.argtypes = [
+    wintypes.HANDLE, POINTER(_ProcessMemoryCounters), wintypes.DWORD
+]
+
+def get_peak_memory_usage():
+    """Return the peak working set size of the Bash process in bytes, or None
+    if it could not be determined."""
+    mem_counters = _ProcessMemoryCounters()
+    mem_counters.cb = sizeof(mem_counters)
+    if _GetProcessMemoryInfo(_GetCurrentProcess(), byref(mem_counters),
+                             mem_counters.cb):
+        return mem_counters.PeakWorkingSetSize
+    return None
+
 # TODO(inf) Maybe move to windows.py? Circular dependency though...
 # All code starting from the 'BEGIN MIT-LICENSED PART' comment and until the
 # 'END MIT-LICENSED PART' comment is based on
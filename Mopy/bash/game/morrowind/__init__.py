@@ -120,9 +120,13 @@ def init(cls):
         header_type.rec_pack_format_str = u''.join(header_type.rec_pack_format)
         header_type.header_unpack = struct.Struct(
             header_type.rec_pack_format_str).unpack
+        header_type.header_unpack_from = struct.Struct(
+            header_type.rec_pack_format_str).unpack_from
         header_type.sub_header_fmt = u'=4sI'
         header_type.sub_header_unpack = struct.Struct(
             header_type.sub_header_fmt).unpack
+        header_type.sub_header_unpack_from = struct.Struct(
+            header_type.sub_header_fmt).unpack_from
         header_type.sub_header_size = 8
         header_type.top_grup_sigs = [
             b'GMST', b'GLOB', b'CLAS', b'FACT', b'RACE', b'SOUN', b'SKIL',
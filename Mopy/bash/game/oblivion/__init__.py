@@ -271,6 +271,8 @@ def init(cls):
         header_type.rec_pack_format_str = u''.join(header_type.rec_pack_format)
         header_type.header_unpack = struct.Struct(
             header_type.rec_pack_format_str).unpack
+        header_type.header_unpack_from = struct.Struct(
+            header_type.rec_pack_format_str).unpack_from
         header_type.pack_formats = {0: u'=4sI4s2I'}
         header_type.pack_formats.update(
             {x: u'=4s4I' for x in {1, 6, 7, 8, 9, 10}})
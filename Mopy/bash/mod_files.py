@@ -23,14 +23,18 @@
 """This module houses the entry point for reading and writing plugin files
 through PBash (LoadFactory + ModFile) as well as some related classes."""
 
+import cPickle as pickle  # PY3
 import re
 import struct
-from collections import defaultdict
+from array import array
+from collections import Counter, defaultdict
+from itertools import islice
 
-from . import bolt, bush, env, load_order
+from . import bass, bolt, bush, env, load_order
 from .bolt import deprint, GPath, SubProgress
-from .brec import MreRecord, ModReader, ModWriter, RecordHeader, RecHeader, \
-    TopGrupHeader, MobBase, MobDials, MobICells, MobObjects, MobWorlds
+from .brec import MreRecord, MmapModReader, ModWriter, RecordHeader, \
+    RecHeader, RecordHeaderTable, TopGrupHeader, header_from_args, MobBase, \
+    MobDials, MobICells, MobObjects, MobWorlds
 from .exception import ArgumentError, MasterMapError, ModError, StateError
 
 class MasterSet(set):
@@ -46,6 +50,65 @@ def getOrdered(self):
         """Returns masters in proper load order."""
         return load_order.get_ordered(self)
 
+class InternedLongFids(object):
+    """Context manager - while in its block, the long mappers of all plugins
+    (see ModFile.getLongMapper) share one table of long fids, so that equal
+    long fids from different plugins are the same tuple. A large load
+    references the same base records from every plugin, so this keeps each
+    of those long fids in memory once and lets dict and set lookups of them
+    succeed on identity, without comparing the master paths. The table is
+    dropped when the outermost block exits - lazily loaded records keep it
+    alive until they have been decoded."""
+    # The table of the currently active block, None outside of one
+    _active_table = None
+
+    def __init__(self):
+        self._is_outermost = False
+
+    def __enter__(self):
+        if InternedLongFids._active_table is None:
+            InternedLongFids._active_table = {}
+            self._is_outermost = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self._is_outermost:
+            InternedLongFids._active_table = None
+            self._is_outermost = False
+
+class _FidTranslator(dict):
+    """Translation table between short and long fids, used as the mapper
+    returned by ModFile.getLongMapper and getShortMapper. Calling it maps a
+    fid - each distinct fid is only translated once, repeats (the same base
+    records get referenced over and over) are plain dict lookups that don't
+    run any Python code. This also means that equal long fids share a single
+    tuple."""
+    __slots__ = (u'_translate', u'fid_masters')
+
+    def __init__(self, translate, fid_masters):
+        """Create a new translator.
+
+        :param translate: Function translating a single fid.
+        :param fid_masters: The masters (including the plugin itself) the
+            translation is based on. Lets records tell whether a later
+            conversion back is the inverse of this one - see
+            MelRecord.convertFids."""
+        super(_FidTranslator, self).__init__()
+        self._translate = translate
+        self.fid_masters = fid_masters
+        self[None] = None
+
+    def __missing__(self, fid):
+        translated = self[fid] = self._translate(fid)
+        return translated
+
+    def clear(self):
+        """Forget all translated fids. None keeps mapping to None."""
+        super(_FidTranslator, self).clear()
+        self[None] = None
+
+    __call__ = dict.__getitem__
+
 class MasterMap(object):
     """Serves as a map between two sets of masters."""
     def __init__(self,inMasters,outMasters):
@@ -186,12 +249,20 @@ def __getattr__(self, topType, __rh=RecordHeader):
             raise ArgumentError(u'Invalid top group type: '+topType)
 
     def load(self, do_unpack=False, progress=None, loadStrings=True,
-             catch_errors=True):
-        """Load file."""
+             catch_errors=True, lazy_unpack=False, load_fids=None):
+        """Load file. If lazy_unpack is True, records of the unpacked groups
+        keep their raw data and are only decoded the first time one of their
+        attributes is accessed - see MelRecord.ensure_loaded.
+
+        load_fids may map record signatures to collections of long fids - the
+        records of those types whose fid is not in there are skipped without
+        being decoded. Only top groups holding a single record type (i.e. not
+        CELL, WRLD and DIAL) are filtered. A ModFile loaded like this is
+        incomplete and must not be saved."""
         from . import bosh
         progress = progress or bolt.Progress()
         progress.setFull(1.0)
-        with ModReader(self.fileInfo.name,self.fileInfo.getPath().open(
+        with MmapModReader(self.fileInfo.name,self.fileInfo.getPath().open(
                 u'rb')) as ins:
             insRecHeader = ins.unpackRecHeader
             # Main header of the mod file - generally has 'TES4' signature
@@ -212,6 +283,16 @@ def load(self, do_unpack=False, progress=None, loadStrings=True,
             else:
                 ins.setStringTable(None)
                 subProgress = progress
+            ins.lazy_unpack = lazy_unpack
+            if load_fids:
+                ins.load_fids = load_fids
+                ins.long_fid_mapper = self.getLongMapper()
+            if do_unpack and not lazy_unpack:
+                # Decompress the records we'll decode in parallel batches
+                ins.batch_decompress_sigs = frozenset(
+                    rec_sig for rec_sig, rec_class in
+                    self.loadFactory.type_class.iteritems()
+                    if rec_class is not MreRecord)
             #--Raw data read
             subProgress.setFull(ins.size)
             insAtEnd = ins.atEnd
@@ -314,11 +395,16 @@ def getLongMapper(self):
         masters = self.tes4.masters+[self.fileInfo.name]
         maxMaster = len(masters)-1
         def mapper(fid):
-            if fid is None: return None
             if type(fid) is tuple: return fid
             mod,object = int(fid >> 24),int(fid & 0xFFFFFF)
             return masters[min(mod, maxMaster)], object # clamp HITMEs
-        return mapper
+        long_fids = InternedLongFids._active_table
+        if long_fids is None:
+            return _FidTranslator(mapper, tuple(masters))
+        def interning_mapper(fid, __intern=long_fids.setdefault):
+            long_fid = mapper(fid)
+            return __intern(long_fid, long_fid)
+        return _FidTranslator(interning_mapper, tuple(masters))
 
     def getShortMapper(self):
         """Returns a mapping function to map long fids to short fids."""
@@ -336,11 +422,10 @@ def _master_index(m_name, _obj_id):
             def _master_index(m_name, obj_id):
                 return indices[m_name] if obj_id >= 0x800 else 0
         def mapper(fid):
-            if fid is None: return None
             if isinstance(fid, (int, long)): return fid # PY3: just int
             modName, object_id = fid
             return (_master_index(modName, object_id) << 24) | object_id
-        return mapper
+        return _FidTranslator(mapper, tuple(masters))
 
     def _convert_fids(self, to_long):
         """Convert fids to the specified format - long FormIDs if to_long is
@@ -348,6 +433,9 @@ def _convert_fids(self, to_long):
         mapper = self.getLongMapper() if to_long else self.getShortMapper()
         for target_top in self.tops.itervalues():
             target_top.convertFids(mapper, to_long)
+        # Lazily loaded records keep the mapper until they are decoded, don't
+        # keep every fid we translated alive along with it
+        mapper.clear()
         self.longFids = to_long
 
     def getMastersUsed(self):
@@ -419,6 +507,285 @@ def getMgefName(self):
     def __repr__(self):
         return u'ModFile<%s>' % self.fileInfo.name.s
 
+class ModRecordIndex(object):
+    """Index of every record in a plugin: its header fields, the offset of
+    its header in the file and the path of GRUPs containing it. Can be
+    cached under the modsBash folder (see for_mod), in which case it is
+    rebuilt when the plugin's size or modification time changes, so
+    header-only scans of unchanged plugins don't have to walk the file
+    again."""
+    # Bump this when the format of the cached data changes
+    _index_version = 2
+
+    def __init__(self, mod_info):
+        self.mod_info = mod_info
+        # One row per record in file order, see RecordHeaderTable
+        self.headers = RecordHeaderTable()
+        # Parallel to the rows of headers, indices into group_paths
+        self.rec_group_indices = array(str(u'I')) # PY3: drop str
+        # Deduplicated tuples of (groupType, label) pairs, outermost first
+        self.group_paths = []
+
+    # What reading a cached index that is corrupt or was written by another
+    # version may raise - pickle.load can fail in many ways on garbage
+    _cache_read_errors = (OSError, IOError, EOFError, pickle.UnpicklingError,
+                          AttributeError, ImportError, IndexError, KeyError,
+                          TypeError, ValueError)
+
+    @classmethod
+    def for_mod(cls, mod_info, save_cache=False):
+        """Return the index for the specified mod, reading it from the cache
+        if it is up to date and rebuilding it otherwise. Rebuilt indices are
+        only written to the cache if save_cache is True, so that callers
+        which merely read headers once don't leave cache files behind.
+
+        :rtype: ModRecordIndex"""
+        rec_index = cls(mod_info)
+        size_mtime = mod_info.abs_path.size_mtime()
+        cache_path = cls._cache_path(mod_info)
+        if cache_path.exists():
+            try:
+                with cache_path.open(u'rb') as ins:
+                    cached = pickle.load(ins)
+                if (cached[u'version'] == cls._index_version and
+                        cached[u'size_mtime'] == size_mtime):
+                    rec_index.headers = cached[u'headers']
+                    rec_index.rec_group_indices.fromstring( # PY3: frombytes
+                        cached[u'rec_group_indices'])
+                    rec_index.group_paths = cached[u'group_paths']
+                    return rec_index
+            except cls._cache_read_errors:
+                # An unreadable cache is just a cache miss
+                deprint(u'Failed to read record index %s, rebuilding it' %
+                        cache_path, traceback=True)
+        rec_index._build_index()
+        if not save_cache: return rec_index
+        try:
+            cache_path.head.makedirs()
+            with cache_path.temp.open(u'wb') as out:
+                pickle.dump({u'version': cls._index_version,
+                             u'size_mtime': size_mtime,
+                             u'headers': rec_index.headers,
+                             u'rec_group_indices': # PY3: tobytes
+                                 rec_index.rec_group_indices.tostring(),
+                             u'group_paths': rec_index.group_paths}, out, -1)
+            cache_path.untemp()
+        except (OSError, IOError):
+            deprint(u'Failed to write record index %s' % cache_path,
+                    traceback=True)
+        return rec_index
+
+    @staticmethod
+    def _cache_path(mod_info):
+        return bass.dirs[u'modsBash'].join(u'Record Index',
+                                           mod_info.name.s + u'.idx')
+
+    @staticmethod
+    def prune_cache(mod_names):
+        """Delete the cached indices of plugins that are not in mod_names,
+        i.e. that have been deleted or renamed."""
+        cache_dir = bass.dirs[u'modsBash'].join(u'Record Index')
+        for cache_file in cache_dir.list():
+            if cache_file.cext != u'.idx' or cache_file.root in mod_names:
+                continue
+            try:
+                cache_dir.join(cache_file).remove()
+            except (OSError, IOError):
+                deprint(u'Failed to delete record index %s' % cache_file,
+                        traceback=True)
+
+    def _build_index(self):
+        """Walk the headers of the plugin, filling in the index."""
+        mod_info = self.mod_info
+        grup_header_size = RecordHeader.rec_header_size
+        headers_append = self.headers.append
+        group_indices_append = self.rec_group_indices.append
+        path_indices = {(): 0}
+        self.group_paths.append(())
+        # Stack of (end position, group path) for the GRUPs we're in
+        grup_stack = [(-1, ())]
+        with MmapModReader(mod_info.name,
+                           mod_info.abs_path.open(u'rb')) as ins:
+            ins_at_end = ins.atEnd
+            ins_tell = ins.tell
+            ins_unpack = ins.unpack
+            ins_seek = ins.seek
+            header_unpack = RecordHeader.header_unpack
+            try:
+                while not ins_at_end():
+                    rec_pos = ins_tell()
+                    while rec_pos == grup_stack[-1][0]:
+                        grup_stack.pop()
+                    header_args = ins_unpack(header_unpack, grup_header_size,
+                                             u'REC_HEADER')
+                    header = header_from_args(ins, header_args)
+                    if header.recType == b'GRUP':
+                        grup_path = grup_stack[-1][1] + (
+                            (header.groupType, header.label),)
+                        if grup_path not in path_indices:
+                            path_indices[grup_path] = len(self.group_paths)
+                            self.group_paths.append(grup_path)
+                        grup_stack.append((rec_pos + header.size, grup_path))
+                    else:
+                        headers_append(header_args, rec_pos)
+                        group_indices_append(
+                            path_indices[grup_stack[-1][1]])
+                        ins_seek(header.size, 1)
+            except (OSError, struct.error) as e:
+                raise ModError(ins.inName, u'Error scanning %s, file read '
+                                           u"pos: %i\nCaused by: '%r'" % (
+                    mod_info.name.s, ins.tell(), e))
+
+    def iter_records(self):
+        """Yield a (header args, offset, group path) tuple for each record in
+        the plugin, in file order."""
+        group_paths = self.group_paths
+        for header_args, rec_offset, group_index in zip(
+                self.headers.iter_header_args(), self.headers.offsets,
+                self.rec_group_indices):
+            yield header_args, rec_offset, group_paths[group_index]
+
+    def top_sig_counts(self):
+        """Return a dict mapping the signatures of the top groups in the
+        plugin to the number of records in each of them, including nested
+        ones (e.g. the children of CELLs)."""
+        top_sigs = [grup_path[0][1] if grup_path else None
+                    for grup_path in self.group_paths]
+        sig_counts = Counter(top_sigs[g] for g in self.rec_group_indices)
+        sig_counts.pop(None, None) # the plugin header is in no group
+        return dict(sig_counts)
+
+    def find_records(self, wanted_fids):
+        """Return a dict mapping each of the specified (short) FormIDs to the
+        file offset of the header of the record with that FormID. FormIDs
+        not in this plugin are skipped."""
+        return {fid: rec_offset for fid, rec_offset in
+                zip(self.headers.fids, self.headers.offsets)
+                if fid in wanted_fids}
+
+class ConflictIndex(object):
+    """Index of which active plugins contain a record with each long FormID,
+    built from the cached record indices of the plugins (see
+    ModRecordIndex), so counting the records a plugin overrides does not
+    require loading any of them. Indexing many plugins takes a while, so it
+    only happens when sync is called - until then, the index reports no
+    data. Load order positions are not stored, they are looked up when
+    syncing, so only changes to the set of active plugins or their contents
+    require reindexing."""
+
+    def __init__(self, mod_infos):
+        self._mod_infos = mod_infos
+        # long fid -> names of the active plugins that have a record with it
+        self._fid_plugins = {}
+        # plugin name -> (size, mtime) of the plugin when it got indexed
+        self._plugin_stats = {}
+        # plugin name -> long fids of its records, in file order
+        self._plugin_fids = {}
+        # plugin name -> number of its records that override a record from
+        # an earlier active plugin - None until the next sync
+        self._override_counts = None
+
+    @property
+    def is_synced(self):
+        """True if the index is up to date, i.e. count_overrides has data."""
+        return self._override_counts is not None
+
+    def invalidate(self, changed_plugins=()):
+        """Mark the index as out of date, e.g. because the active plugins or
+        the load order changed. The specified plugins changed on disk, so
+        they are dropped and will get reindexed if still active."""
+        for plugin_name in changed_plugins:
+            self._drop_plugin(plugin_name)
+        self._override_counts = None
+
+    def plugins_to_index(self):
+        """Return the names of the active plugins that the next sync will
+        (re)index, in load order."""
+        mod_infos = self._mod_infos
+        plugin_stats = self._plugin_stats
+        return [p for p in load_order.cached_active_tuple() if p in mod_infos
+                and plugin_stats.get(p) != (mod_infos[p].size,
+                                            mod_infos[p].mtime)]
+
+    def sync(self, progress=None):
+        """Bring the index up to date with the currently active plugins. The
+        progress, if given, is advanced once per plugin that needs
+        indexing."""
+        if self.is_synced: return
+        progress = progress or bolt.Progress()
+        mod_infos = self._mod_infos
+        active_plugins = {p for p in load_order.cached_active_tuple()
+                          if p in mod_infos}
+        for plugin_name in list(self._plugin_stats):
+            if plugin_name not in active_plugins:
+                self._drop_plugin(plugin_name)
+        to_index = self.plugins_to_index()
+        progress.setFull(max(len(to_index), 1))
+        for i, plugin_name in enumerate(to_index):
+            progress(i, plugin_name.s)
+            self._drop_plugin(plugin_name)
+            mod_info = mod_infos[plugin_name]
+            try:
+                self._add_plugin(mod_info)
+            except (ModError, OSError, IOError):
+                deprint(u'Failed to index records of %s' % plugin_name,
+                        traceback=True)
+                # Don't retry on every sync, only once the plugin changes
+                self._plugin_fids[plugin_name] = []
+                self._plugin_stats[plugin_name] = (mod_info.size,
+                                                   mod_info.mtime)
+        # Every plugin but the first one to have a record overrides it
+        override_counts = Counter()
+        lo_index = {p: load_order.cached_lo_index(p)
+                    for p in self._plugin_stats}
+        for fid_owners in self._fid_plugins.itervalues():
+            if len(fid_owners) > 1:
+                first_owner = min(fid_owners, key=lo_index.__getitem__)
+                override_counts.update(
+                    p for p in fid_owners if p != first_owner)
+        self._override_counts = override_counts
+
+    def _add_plugin(self, mod_info):
+        rec_index = ModRecordIndex.for_mod(mod_info, save_cache=True)
+        plugin_name = mod_info.name
+        masters = tuple(mod_info.masterNames) + (plugin_name,)
+        max_master = len(masters) - 1
+        fid_plugins = self._fid_plugins
+        plugin_fids = []
+        fids_append = plugin_fids.append
+        # The first record is the plugin header, skip it
+        for short_fid in islice(rec_index.headers.fids, 1, None):
+            # clamp HITMEs, same as ModFile.getLongMapper
+            long_fid = (masters[min(int(short_fid >> 24), max_master)],
+                        int(short_fid & 0xFFFFFF))
+            fids_append(long_fid)
+            try:
+                fid_plugins[long_fid].append(plugin_name)
+            except KeyError:
+                fid_plugins[long_fid] = [plugin_name]
+        self._plugin_fids[plugin_name] = plugin_fids
+        self._plugin_stats[plugin_name] = (mod_info.size, mod_info.mtime)
+        self._override_counts = None
+
+    def _drop_plugin(self, plugin_name):
+        if self._plugin_stats.pop(plugin_name, None) is None: return
+        fid_plugins = self._fid_plugins
+        for long_fid in self._plugin_fids.pop(plugin_name):
+            fid_owners = fid_plugins[long_fid]
+            if len(fid_owners) == 1:
+                del fid_plugins[long_fid]
+            else:
+                fid_owners.remove(plugin_name)
+        self._override_counts = None
+
+    def count_overrides(self, plugin_name):
+        """Return the number of records in the specified active plugin that
+        override a record from an active plugin loading before it, or None
+        if the plugin is not active or the index is not synced."""
+        if self._override_counts is None or (
+                plugin_name not in self._plugin_stats): return None
+        return self._override_counts[plugin_name]
+
 # TODO(inf) Use this for a bunch of stuff in mods_metadata.py (e.g. UDRs)
 class ModHeaderReader(object):
     """Allows very fast reading of a plugin's headers, skipping reading and
@@ -432,22 +799,10 @@ def read_mod_headers(mod_info):
 
         :rtype: defaultdict[str, list[RecordHeader]]"""
         ret_headers = defaultdict(list)
-        with ModReader(mod_info.name, mod_info.abs_path.open(u'rb')) as ins:
-            ins_at_end = ins.atEnd
-            ins_unpack_rec_header = ins.unpackRecHeader
-            ins_seek = ins.seek
-            try:
-                while not ins_at_end():
-                    header = ins_unpack_rec_header()
-                    # Skip GRUPs themselves, only process their records
-                    header_rec_sig = header.recType
-                    if header_rec_sig != b'GRUP':
-                        ret_headers[header_rec_sig].append(header)
-                        ins_seek(header.size, 1)
-            except (OSError, struct.error) as e:
-                raise ModError(ins.inName, u'Error scanning %s, file read '
-                                           u"pos: %i\nCaused by: '%r'" % (
-                    mod_info.name.s, ins.tell(), e))
+        # GRUPs themselves are not part of the index, only their records
+        for header_args in ModRecordIndex.for_mod(
+                mod_info).headers.iter_header_args():
+            ret_headers[header_args[0]].append(RecHeader(*header_args))
         return ret_headers
 
     ##: The method above has to be very fast, but this one can afford to be
@@ -463,7 +818,8 @@ def read_temp_child_headers(mod_info):
         interested_sigs = {b'CELL', b'WRLD'}
         tops_to_skip = interested_sigs | {bush.game.Esp.plugin_header_sig}
         grup_header_size = RecordHeader.rec_header_size
-        with ModReader(mod_info.name, mod_info.abs_path.open(u'rb')) as ins:
+        with MmapModReader(mod_info.name,
+                           mod_info.abs_path.open(u'rb')) as ins:
             ins_at_end = ins.atEnd
             ins_unpack_rec_header = ins.unpackRecHeader
             ins_seek = ins.seek
@@ -67,6 +67,20 @@ def getWriteClasses(self):
         """Returns load factory classes needed for writing."""
         return self.__class__._read_write_records if self.isActive else ()
 
+    def get_source_mod_loads(self):
+        """Returns the record classes and the (ordered) names of the plugins
+        this patcher will load via PatchFile.load_source_mod in initData, so
+        that the patch file can load each plugin only once for all
+        patchers."""
+        return (), []
+
+    def get_scan_fids(self):
+        """Returns a dict mapping the signatures of those of the record types
+        this patcher reads of which scanModFile only needs to see some records
+        to the long fids of those records. Called once initData has run -
+        records of the other types this patcher reads are all loaded."""
+        return {}
+
     def initData(self,progress):
         """Compiles material, i.e. reads source text, esp's, etc. as
         necessary."""
@@ -83,6 +97,21 @@ def scanModFile(self,modFile,progress):
         mod, but won't alter it. If adds record, should first convert it to
         long fids."""
 
+    def get_record_scan_sigs(self):
+        """Returns the signatures of the top groups whose records this
+        patcher scans one at a time via scan_record, or None if it scans
+        plugins via scanModFile instead. The patch file iterates over the
+        records of each scanned plugin once for all patchers that scan
+        records, instead of once per patcher."""
+        return None
+
+    def scan_record(self, record, patch_block):
+        """Scans a single record of the plugin being scanned, from one of the
+        top groups returned by get_record_scan_sigs. Only gets passed records
+        of the types in getReadClasses that are neither ignored nor deleted,
+        and only those in get_scan_fids, if it has an entry for the record's
+        type. patch_block is the patch's block for the record's top group."""
+
     def buildPatch(self,log,progress):
         """Edits patch file as desired. Should write to log."""
 
@@ -21,8 +21,12 @@
 #
 # =============================================================================
 from __future__ import print_function
+import cPickle as pickle  # PY3
+import json
+import os
 import time
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
+from multiprocessing.pool import ThreadPool
 from operator import attrgetter
 from .. import bush # for game etc
 from .. import bosh # for modInfos
@@ -30,11 +34,12 @@
 from ..balt import readme_url
 from .. import load_order
 from .. import bass
-from ..brec import MreRecord, RecHeader
+from .. import env
+from ..brec import MobObjects, MreRecord, RecHeader
 from ..bolt import GPath, SubProgress, deprint, Progress
-from ..exception import BoltError, CancelError, ModError
+from ..exception import BoltError, CancelError, ModError, StateError
 from ..localize import format_date
-from ..mod_files import ModFile, LoadFactory
+from ..mod_files import ModFile, LoadFactory, ModRecordIndex
 
 # the currently executing patch set in _Mod_Patch_Update before showing the
 # dialog - used in getAutoItems, to get mods loading before the patch
@@ -56,6 +61,7 @@ def __init__(self, patch_path):
         self.unFilteredMods = []
         self.compiledAllMods = []
         self.patcher_mod_skipcount = defaultdict(Counter)
+        self._source_mods = None # type: _SourceModCache
         #--Config
         self.bodyTags = bush.game.body_tags
         #--Mods
@@ -155,19 +161,360 @@ def _link(link_id):
                 log(u'* %s >> %s' % (alias_target.s, alias_repl.s))
 
     def init_patchers_data(self, patchers, progress):
-        """Gives each patcher a chance to get its source data."""
+        """Gives each patcher a chance to get its source data. The source
+        plugins the patchers load are shared between them."""
         self._patcher_instances = [p for p in patchers if p.isActive]
         if not self._patcher_instances: return
         progress = progress.setFull(len(self._patcher_instances))
-        for index, patcher in self._enumerate_patchers():
-            progress(index, _(u'Preparing') + u'\n' + patcher.getName())
-            patcher.initData(SubProgress(progress, index))
+        with _SourceModCache(self.p_file_minfos,
+                             self._patcher_instances) as self._source_mods:
+            for index, patcher in self._enumerate_patchers():
+                progress(index, _(u'Preparing') + u'\n' + patcher.getName())
+                init_start = self.build_stats.snapshot()
+                self._source_mods.init_patcher_data(
+                    patcher, SubProgress(progress, index))
+                self.build_stats.add_patcher(patcher.getName(), u'init',
+                                             init_start)
+        self._source_mods = None
         progress(progress.full, _(u'Patchers prepared.'))
         # initData may set isActive to zero - TODO(ut) track down
         self._patcher_instances = [p for p in patchers if p.isActive]
 
     def _enumerate_patchers(self): return enumerate(self._patcher_instances)
 
+    def load_source_mod(self, mod_name):
+        """Returns the specified source plugin, loaded for the patcher that is
+        currently running initData - see Patcher.get_source_mod_loads."""
+        return self._source_mods.load_mod(mod_name)
+
+class _SourceModView(object):
+    """A source plugin loaded by _SourceModCache, restricted to the top groups
+    of the record types requested by the patcher it was handed to."""
+
+    def __init__(self, mod_file, rec_sigs):
+        self.fileInfo = mod_file.fileInfo
+        self.tops = {top_sig: top_block for top_sig, top_block
+                     in mod_file.tops.iteritems() if top_sig in rec_sigs}
+
+    def __getattr__(self, top_sig):
+        try:
+            return self.tops[top_sig]
+        except KeyError:
+            raise AttributeError(top_sig)
+
+class _SourceModCache(object):
+    """Build-scoped cache of the source plugins the patchers load during
+    initData - see Patcher.get_source_mod_loads. Each plugin is loaded once,
+    with the union of the record types requested by all patchers, and each
+    patcher gets a view of it restricted to the record types it asked for.
+    Patchers requesting different cell children get separate loads, so that
+    cell blocks are only unpacked for the patchers that need them. The
+    records are shared, so patchers must copy any mutable values they keep.
+    Plugins are dropped once no patcher is going to request them anymore and,
+    least recently used first, when the cached plugins get too big."""
+    # Upper limit for the total size of the plugin files kept loaded
+    _max_cached_size = 512 * 1024 * 1024
+    # Signatures of the records found in the children groups of cells
+    _cell_child_sigs = frozenset([b'REFR', b'ACHR', b'ACRE', b'PGRD', b'LAND'])
+
+    def __init__(self, minfs, patchers):
+        self._minfs = minfs
+        # patcher -> (requested record sigs, requested cell children sigs,
+        # Counter of plugin loads left)
+        self._patcher_loads = {}
+        # (cell children sigs, plugin) -> number of loads left
+        self._loads_left = Counter()
+        child_sigs_classes = defaultdict(set)
+        for patcher in patchers:
+            rec_classes, patcher_mods = patcher.get_source_mod_loads()
+            if not rec_classes: continue
+            rec_sigs = {c.rec_sig for c in rec_classes}
+            child_sigs = frozenset(rec_sigs & self._cell_child_sigs)
+            child_sigs_classes[child_sigs].update(rec_classes)
+            patcher_counts = Counter(patcher_mods)
+            self._patcher_loads[patcher] = (rec_sigs, child_sigs,
+                                            patcher_counts)
+            self._loads_left.update({(child_sigs, m): c for m, c
+                                     in patcher_counts.iteritems()})
+        self._load_factories = {
+            child_sigs: LoadFactory(False, *rec_classes) for
+            child_sigs, rec_classes in child_sigs_classes.iteritems()}
+        # (cell children sigs, plugin) -> ModFile, least recently used first
+        self._loaded = OrderedDict()
+        self._loaded_size = 0
+        self._current_patcher = None
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._loaded.clear()
+
+    def init_patcher_data(self, patcher, progress):
+        """Runs initData on the specified patcher, serving its source plugin
+        loads. Drops its outstanding loads once it's done."""
+        self._current_patcher = patcher
+        try:
+            patcher.initData(progress)
+        finally:
+            self._current_patcher = None
+            patcher_loads = self._patcher_loads.pop(patcher, None)
+            if patcher_loads:
+                child_sigs, patcher_counts = patcher_loads[1:]
+                for mod_name, load_count in patcher_counts.iteritems():
+                    self._drop_loads((child_sigs, mod_name), load_count)
+
+    def load_mod(self, mod_name):
+        """Returns a view of the loaded ModFile for the specified plugin for
+        the patcher currently initializing, loading it if needed. Records are
+        decoded lazily."""
+        try:
+            rec_sigs, child_sigs, patcher_counts = self._patcher_loads[
+                self._current_patcher]
+        except KeyError:
+            raise StateError(u'%r did not declare its source plugin loads' %
+                             self._current_patcher)
+        load_key = (child_sigs, mod_name)
+        try:
+            mod_file = self._loaded.pop(load_key)
+        except KeyError:
+            mod_file = ModFile(self._minfs[mod_name],
+                               self._load_factories[child_sigs])
+            mod_file.load(True, lazy_unpack=True)
+            self._loaded_size += self._minfs[mod_name].size
+        self._loaded[load_key] = mod_file # most recently used now
+        if patcher_counts[mod_name] > 0:
+            patcher_counts[mod_name] -= 1
+            self._drop_loads(load_key, 1)
+        while (self._loaded_size > self._max_cached_size and
+               len(self._loaded) > 1):
+            self._evict(next(iter(self._loaded)))
+        return _SourceModView(mod_file, rec_sigs)
+
+    def _drop_loads(self, load_key, load_count):
+        self._loads_left[load_key] -= load_count
+        if self._loads_left[load_key] <= 0 and load_key in self._loaded:
+            self._evict(load_key)
+
+    def _evict(self, load_key):
+        del self._loaded[load_key]
+        self._loaded_size -= self._minfs[load_key[1]].size
+
+class _ScanFids(object):
+    """The long fids of the records of one type the scanned plugins need to
+    load - those that some patcher needs to scan and those the patch already
+    has, which update_patch_records_from_mod needs to update. The latter are
+    looked up live, as the patch gains records while scanning."""
+    __slots__ = (u'_fid_colls',)
+
+    def __init__(self, patch_block, patcher_fids):
+        self._fid_colls = [patch_block.id_records] + patcher_fids
+
+    def __contains__(self, fid):
+        for fid_coll in self._fid_colls:
+            if fid in fid_coll: return True
+        return False
+
+    def num_patch_fids(self):
+        """Returns the number of records the patch has of this type - changes
+        to it change which records this contains."""
+        return len(self._fid_colls[0])
+
+def _load_plugin(mod_info, load_factory, lazy_unpack, load_fids):
+    """Loads the specified plugin the way scanLoadMods does, returning the
+    ModFile."""
+    mod_file = ModFile(mod_info, load_factory)
+    mod_file.load(True, lazy_unpack=lazy_unpack, load_fids=load_fids)
+    return mod_file
+
+class _PluginPrefetcher(object):
+    """Loads the next plugin of scanLoadMods on a worker thread while the
+    patchers scan the current one. Which records get loaded depends on the
+    load factories and on the records the patch has (see _ScanFids), so a
+    prefetched plugin is only handed out if neither changed since the load
+    was started - otherwise it gets loaded again. Merging a plugin changes
+    both, so loads must only be started once the previous plugin has been
+    merged into the patch. Use as a context manager."""
+
+    def __init__(self, scan_fids):
+        self._scan_fids = scan_fids
+        self._pool = None
+        # (plugin name, load state, AsyncResult) of the load in progress
+        self._pending = None
+
+    def __enter__(self):
+        self._pool = ThreadPool(1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._pending = None
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+    def _load_state(self, load_factory, load_fids):
+        """Returns what decides which records a load with the specified
+        parameters reads."""
+        return frozenset(load_factory.recTypes), load_fids is not None and {
+            rec_sig: sig_fids.num_patch_fids()
+            for rec_sig, sig_fids in self._scan_fids.iteritems()}
+
+    def prefetch(self, mod_info, load_factory, lazy_unpack, load_fids):
+        """Starts loading the specified plugin in the background, with the
+        same parameters as _load_plugin."""
+        self._pending = (mod_info.name,
+                         self._load_state(load_factory, load_fids),
+                         self._pool.apply_async(_load_plugin, (
+                             mod_info, load_factory, lazy_unpack, load_fids)))
+
+    def get_loaded(self, mod_name, load_factory, load_fids):
+        """Returns the ModFile of the specified plugin if it was prefetched
+        and is still valid, waiting for its load to finish if needed. Returns
+        None if the plugin has to be loaded normally. Re-raises any error
+        raised while loading it."""
+        if self._pending is None: return None
+        pending_name, load_state, load_result = self._pending
+        self._pending = None
+        load_result.wait()
+        if (pending_name != mod_name or
+                load_state != self._load_state(load_factory, load_fids)):
+            return None
+        return load_result.get()
+
+class _RecordScanBatch(object):
+    """Runs the scan of consecutive (in scanOrder) patchers that scan records
+    one at a time - see Patcher.get_record_scan_sigs. Iterates over the
+    records of each top group of a plugin once, passing each record to all
+    of those patchers that are interested in it, instead of each patcher
+    iterating over the plugin on its own. Quacks like a patcher as far as
+    scanLoadMods is concerned."""
+
+    def __init__(self, patch_file, patchers):
+        self._patch_file = patch_file
+        self._patcher_names = [p.getName() for p in patchers]
+        self._read_sigs = set()
+        # top group sig -> list of (patcher, read sigs, scan fids,
+        # scan_record) for each patcher scanning records in that top group
+        self._top_scanners = defaultdict(list)
+        for patcher in patchers:
+            read_sigs = set(patcher.getReadClasses())
+            self._read_sigs |= read_sigs
+            scanner = (patcher, read_sigs, patcher.get_scan_fids(),
+                       patcher.scan_record)
+            for top_sig in patcher.get_record_scan_sigs():
+                self._top_scanners[top_sig].append(scanner)
+
+    def getName(self):
+        return u', '.join(self._patcher_names)
+
+    def getReadClasses(self):
+        return self._read_sigs
+
+    def scan_mod_file(self, modFile, progress):
+        """Passes the records of the specified plugin to the patchers."""
+        patch_file = self._patch_file
+        for top_sig, top_scanners in self._top_scanners.iteritems():
+            if top_sig not in modFile.tops: continue
+            # Same as Patcher.scan_mod_file, skip inactive patchers
+            scanners = [s[1:] for s in top_scanners if s[0].isActive]
+            if not scanners: continue
+            patch_block = getattr(patch_file, top_sig.decode(u'ascii'))
+            for record in modFile.tops[top_sig].iter_records():
+                rec_flags = record.flags1
+                if rec_flags.ignored or rec_flags.deleted: continue
+                rec_sig = record.recType
+                rec_fid = record.fid
+                for read_sigs, scan_fids, scan_record in scanners:
+                    if rec_sig not in read_sigs or (
+                            rec_sig in scan_fids and
+                            rec_fid not in scan_fids[rec_sig]): continue
+                    scan_record(record, patch_block)
+
+class _BuildStats(object):
+    """Wall time, CPU time, peak memory growth and number of records handled
+    by each patcher in each stage of a Bashed Patch build, and by each plugin
+    while loading and scanning it. Take a snapshot before doing the work,
+    then pass it to add_patcher/add_plugin once it's done."""
+    _stages = (u'init', u'scan', u'build')
+    # How many of the slowest plugins to list in the patch log
+    _max_logged_plugins = 10
+
+    def __init__(self):
+        # (patcher name, stage) -> [wall, cpu, peak memory growth, records]
+        self.patcher_stats = defaultdict(lambda: [0.0, 0.0, 0, 0])
+        self.patcher_names = []
+        # plugin name -> [wall, cpu, peak memory growth, records]
+        self.plugin_stats = OrderedDict()
+
+    @staticmethod
+    def snapshot():
+        """Return the current wall time, CPU time and peak memory use."""
+        return (time.time(), sum(os.times()[:2]),
+                env.get_peak_memory_usage() or 0)
+
+    @classmethod
+    def _add(cls, stats, start, records):
+        end = cls.snapshot()
+        for i in xrange(3):
+            stats[i] += end[i] - start[i]
+        stats[3] += records
+
+    def add_patcher(self, patcher_name, stage, start, records=0):
+        """Add the work the specified patcher did in stage (one of init, scan
+        and build) since start was taken."""
+        if patcher_name not in self.patcher_names:
+            self.patcher_names.append(patcher_name)
+        self._add(self.patcher_stats[(patcher_name, stage)], start, records)
+
+    def add_plugin(self, plugin_name, start, records=0):
+        """Add the time spent loading and scanning the specified plugin since
+        start was taken."""
+        self._add(self.plugin_stats.setdefault(plugin_name, [0.0, 0.0, 0, 0]),
+                  start, records)
+
+    @staticmethod
+    def _format_stats(stats, with_records=True):
+        stats_msg = _(u'%.2fs (CPU %.2fs), peak memory +%.1f MB') % (
+            stats[0], stats[1], stats[2] / 1048576.0)
+        if with_records:
+            stats_msg += u', ' + _(u'%d records') % stats[3]
+        return stats_msg
+
+    def log_stats(self, log):
+        """Write the statistics to the specified patch log."""
+        log.setHeader(u'= ' + _(u'Build Statistics'), True)
+        log.setHeader(u'=== ' + _(u'Patchers'))
+        for patcher_name in self.patcher_names:
+            log(u'* __%s__' % patcher_name)
+            for stage in self._stages:
+                stats = self.patcher_stats.get((patcher_name, stage))
+                if stats: # initData does not report records
+                    log(u'  * %s: %s' % (stage, self._format_stats(
+                        stats, with_records=stage != u'init')))
+        if self.plugin_stats:
+            log.setHeader(u'=== ' + _(u'Slowest Plugins'))
+            slowest = sorted(self.plugin_stats.iteritems(),
+                             key=lambda x: x[1][0], reverse=True)
+            for plugin_name, stats in slowest[:self._max_logged_plugins]:
+                log(u'* %s: %s' % (plugin_name.s, self._format_stats(stats)))
+
+    def save_json(self, json_path):
+        """Write all statistics to the specified JSON file."""
+        def _stats_dict(stats):
+            return {u'wall': stats[0], u'cpu': stats[1],
+                    u'peak_memory_growth': stats[2], u'records': stats[3]}
+        json_path.head.makedirs()
+        with json_path.open(u'wb') as out:
+            json.dump({
+                u'patchers': [{u'name': n, u'stages': {
+                    stage: _stats_dict(self.patcher_stats[(n, stage)])
+                    for stage in self._stages
+                    if (n, stage) in self.patcher_stats}}
+                    for n in self.patcher_names],
+                u'plugins': [dict(_stats_dict(stats), name=plugin_name.s)
+                             for plugin_name, stats
+                             in self.plugin_stats.iteritems()],
+            }, out, indent=2)
+
 class PatchFile(_PFile, ModFile):
     """Defines and executes patcher configuration."""
 
@@ -179,6 +526,7 @@ def __init__(self, modInfo):
         self.tes4.masters = [bosh.modInfos.masterName]
         self.longFids = True
         self.keepIds = set()
+        self.build_stats = _BuildStats()
         _PFile.__init__(self, modInfo.name)
 
     def getKeeper(self):
@@ -214,52 +562,161 @@ def scanLoadMods(self,progress):
         """Scans load+merge mods."""
         nullProgress = Progress()
         progress = progress.setFull(len(self.allMods))
-        for index,modName in enumerate(self.allMods):
-            modInfo = bosh.modInfos[modName]
-            bashTags = modInfo.getBashTags()
-            if modName in self.loadSet and u'Filter' in bashTags:
-                self.unFilteredMods.append(modName)
-            try:
-                loadFactory = (self.readFactory,self.mergeFactory)[modName in self.mergeSet]
-                progress(index,modName.s+u'\n'+_(u'Loading...'))
-                modFile = ModFile(modInfo,loadFactory)
-                modFile.load(True,SubProgress(progress,index,index+0.5))
-            except ModError as e:
-                deprint('load error:', traceback=True)
-                self.loadErrorMods.append((modName,e))
+        scan_fids = self._get_scan_fids()
+        skipped_mods = self._get_skipped_mods()
+        build_stats = self.build_stats
+        scan_steps = self._get_scan_steps(ii_mode=False)
+        ii_scan_steps = self._get_scan_steps(ii_mode=True)
+        loaded_mods = [m for m in self.allMods if m not in skipped_mods]
+        next_mods = dict(zip(loaded_mods, loaded_mods[1:]))
+        def _load_args(mod_name):
+            """Returns the load factory, lazy_unpack and load_fids to load the
+            specified plugin with."""
+            # Merged plugins get copied in whole, so only decode the records
+            # of scanned ones that are actually accessed and skip those that
+            # no one is going to look at
+            if mod_name in self.mergeSet:
+                return self.mergeFactory, False, None
+            return self.readFactory, True, scan_fids
+        with _PluginPrefetcher(scan_fids) as prefetcher:
+            for index,modName in enumerate(self.allMods):
+                modInfo = bosh.modInfos[modName]
+                bashTags = modInfo.getBashTags()
+                if modName in self.loadSet and u'Filter' in bashTags:
+                    self.unFilteredMods.append(modName)
+                if modName in skipped_mods: continue
+                plugin_start = build_stats.snapshot()
+                try:
+                    isMerged = modName in self.mergeSet
+                    loadFactory, lazy_unpack, load_fids = _load_args(modName)
+                    progress(index,modName.s+u'\n'+_(u'Loading...'))
+                    modFile = prefetcher.get_loaded(modName, loadFactory,
+                                                    load_fids)
+                    if modFile is None:
+                        modFile = ModFile(modInfo,loadFactory)
+                        modFile.load(True,
+                                     SubProgress(progress, index, index + 0.5),
+                                     lazy_unpack=lazy_unpack,
+                                     load_fids=load_fids)
+                except ModError as e:
+                    deprint('load error:', traceback=True)
+                    self.loadErrorMods.append((modName,e))
+                    continue
+                try:
+                    #--Error checks
+                    if 'WRLD' in modFile.tops and modFile.WRLD.orphansSkipped:
+                        self.worldOrphanMods.append(modName)
+                    # TODO adapt for other games
+                    if bush.game.fsName == u'Oblivion' and 'SCPT' in \
+                            modFile.tops and \
+                            modName != GPath(bush.game.master_file):
+                        gls = modFile.SCPT.getRecord(0x00025811)
+                        if gls and gls.compiled_size == 4 and gls.last_index == 0:
+                            self.compiledAllMods.append(modName)
+                    pstate = index+0.5
+                    doFilter = isMerged and u'Filter' in bashTags
+                    #--iiMode is a hack to support Item Interchange. Actual key used is IIM.
+                    iiMode = isMerged and u'IIM' in bashTags
+                    if isMerged:
+                        progress(pstate,modName.s+u'\n'+_(u'Merging...'))
+                        self.mergeModFile(modFile, doFilter, iiMode)
+                    else:
+                        progress(pstate,modName.s+u'\n'+_(u'Scanning...'))
+                        self.update_patch_records_from_mod(modFile)
+                    # The load factories only change when merging, so start
+                    # loading the next plugin while the patchers scan this one
+                    next_mod = next_mods.get(modName)
+                    if next_mod is not None:
+                        prefetcher.prefetch(bosh.modInfos[next_mod],
+                                            *_load_args(next_mod))
+                    rec_counts = {top_sig: top_block.getNumRecords(False)
+                                  for top_sig, top_block
+                                  in modFile.tops.iteritems()}
+                    for patcher in (ii_scan_steps if iiMode else scan_steps):
+                        progress(pstate,u'%s\n%s' % (modName.s,patcher.getName()))
+                        scan_start = build_stats.snapshot()
+                        patcher.scan_mod_file(modFile,nullProgress)
+                        build_stats.add_patcher(
+                            patcher.getName(), u'scan', scan_start,
+                            sum(rec_counts.get(s, 0)
+                                for s in patcher.getReadClasses()))
+                    build_stats.add_plugin(modName, plugin_start,
+                                           sum(rec_counts.itervalues()))
+                except CancelError:
+                    raise
+                except:
+                    print(_(u"MERGE/SCAN ERROR:"),modName.s)
+                    raise
+        progress(progress.full,_(u'Load mods scanned.'))
+
+    def _get_scan_steps(self, ii_mode):
+        """Returns the active patchers in scanOrder - only those supporting
+        Item Interchange if ii_mode is True - with each run of consecutive
+        patchers that scan records one at a time batched together into a
+        _RecordScanBatch."""
+        scan_steps = []
+        record_scanners = []
+        for patcher in sorted(self._patcher_instances,
+                              key=attrgetter(u'scanOrder')):
+            if ii_mode and not patcher.iiMode: continue
+            if patcher.get_record_scan_sigs() is not None:
+                record_scanners.append(patcher)
                 continue
+            if record_scanners:
+                scan_steps.append(_RecordScanBatch(self, record_scanners))
+                record_scanners = []
+            scan_steps.append(patcher)
+        if record_scanners:
+            scan_steps.append(_RecordScanBatch(self, record_scanners))
+        return scan_steps
+
+    def _get_skipped_mods(self):
+        """Returns the set of scanned (i.e. not merged) plugins that don't
+        have any of the top groups the read factory loads. Loading them would
+        produce an empty ModFile that neither the patch nor any patcher has
+        any use for, so scanLoadMods skips them."""
+        read_sigs = self.readFactory.topTypes
+        skipped_mods = set()
+        for modName in self.allMods:
+            if modName in self.mergeSet: continue
             try:
-                #--Error checks
-                if 'WRLD' in modFile.tops and modFile.WRLD.orphansSkipped:
-                    self.worldOrphanMods.append(modName)
-                # TODO adapt for other games
-                if bush.game.fsName == u'Oblivion' and 'SCPT' in \
-                        modFile.tops and \
-                        modName != GPath(bush.game.master_file):
-                    gls = modFile.SCPT.getRecord(0x00025811)
-                    if gls and gls.compiled_size == 4 and gls.last_index == 0:
-                        self.compiledAllMods.append(modName)
-                pstate = index+0.5
-                isMerged = modName in self.mergeSet
-                doFilter = isMerged and u'Filter' in bashTags
-                #--iiMode is a hack to support Item Interchange. Actual key used is IIM.
-                iiMode = isMerged and u'IIM' in bashTags
-                if isMerged:
-                    progress(pstate,modName.s+u'\n'+_(u'Merging...'))
-                    self.mergeModFile(modFile, doFilter, iiMode)
+                top_sigs = ModRecordIndex.for_mod(
+                    self.p_file_minfos[modName],
+                    save_cache=True).top_sig_counts()
+            except (ModError, OSError, IOError):
+                continue # ModFile.load will report the problem
+            if read_sigs.isdisjoint(top_sigs):
+                skipped_mods.add(modName)
+        if skipped_mods:
+            deprint(u'Skipping %d plugins without any record types the '
+                    u'patch reads' % len(skipped_mods))
+        return skipped_mods
+
+    def _get_scan_fids(self):
+        """Returns a dict mapping the signatures of the record types of which
+        the scanned (i.e. not merged) plugins only need to load some records
+        to the fids of those records - see Patcher.get_scan_fids."""
+        # update_patch_records_from_mod keeps all MGEFs
+        full_sigs = {b'MGEF'}
+        full_sigs.update(c.rec_sig for c in bush.game.readClasses)
+        patcher_fids = defaultdict(list)
+        for patcher in self._patcher_instances:
+            patcher_scan_fids = patcher.get_scan_fids()
+            for rec_sig in patcher.getReadClasses():
+                if rec_sig in patcher_scan_fids:
+                    patcher_fids[rec_sig].append(patcher_scan_fids[rec_sig])
                 else:
-                    progress(pstate,modName.s+u'\n'+_(u'Scanning...'))
-                    self.update_patch_records_from_mod(modFile)
-                for patcher in sorted(self._patcher_instances, key=attrgetter('scanOrder')):
-                    if iiMode and not patcher.iiMode: continue
-                    progress(pstate,u'%s\n%s' % (modName.s,patcher.getName()))
-                    patcher.scan_mod_file(modFile,nullProgress)
-            except CancelError:
-                raise
-            except:
-                print(_(u"MERGE/SCAN ERROR:"),modName.s)
-                raise
-        progress(progress.full,_(u'Load mods scanned.'))
+                    full_sigs.add(rec_sig)
+        scan_fids = {}
+        for rec_sig, fid_colls in patcher_fids.iteritems():
+            if (rec_sig in full_sigs or
+                    MreRecord.type_class[rec_sig].isKeyedByEid): continue
+            patch_block = getattr(self, rec_sig)
+            if type(patch_block) is not MobObjects: continue
+            if patch_block.records and not patch_block.id_records:
+                patch_block.indexRecords()
+            scan_fids[rec_sig] = _ScanFids(patch_block, fid_colls)
+        return scan_fids
 
     def mergeModFile(self, modFile, doFilter, iiMode):
         """Copies contents of modFile into self."""
@@ -297,9 +754,14 @@ def buildPatch(self,log,progress):
         # Run buildPatch on each patcher
         self.keepIds |= self.mergeIds
         subProgress = SubProgress(progress, 0, 0.9, len(self._patcher_instances))
+        build_stats = self.build_stats
         for index,patcher in enumerate(sorted(self._patcher_instances, key=attrgetter('editOrder'))):
             subProgress(index,_(u'Completing')+u'\n%s...' % patcher.getName())
+            build_start = build_stats.snapshot()
+            kept_before = len(self.keepIds)
             patcher.buildPatch(log,SubProgress(subProgress,index))
+            build_stats.add_patcher(patcher.getName(), u'build', build_start,
+                                    len(self.keepIds) - kept_before)
         # Trim records to only keep ones we actually changed
         progress(0.9,_(u'Completing')+u'\n'+_(u'Trimming records...'))
         for block in self.tops.values():
@@ -325,3 +787,86 @@ def buildPatch(self,log,progress):
             self.tes4.description += u'\n' + _(
                 u'This patch has been automatically ESL-flagged to save a '
                 u'load order slot.')
+        build_stats.log_stats(log)
+        if bass.inisettings[u'SaveBashedPatchStats']:
+            build_stats.save_json(bass.dirs[u'modsBash'].join(
+                u'Patch Statistics', self.fileInfo.name.sroot + u'.json'))
+
+class PatchManifest(object):
+    """Records everything that goes into building a Bashed Patch: the
+    patcher configuration, the CRCs, active state and bash tags of all
+    plugins loading before the patch and the state of the files in the Bash
+    Patches folders.
+    It is saved after each successful build, together with the size and
+    modification time of the resulting patch. If none of that has changed
+    by the next rebuild, the patch on disk is still what a full build would
+    produce and the rebuild can be skipped. This only skips rebuilds of
+    unchanged patches - if anything changed, the patch is built from scratch,
+    nothing of the previous build is reused."""
+    # Bump this when the format of the saved data changes
+    _manifest_version = 1
+    # What reading a manifest that is corrupt or was written by another
+    # version may raise - pickle.load can fail in many ways on garbage
+    _read_errors = (OSError, IOError, EOFError, pickle.UnpicklingError,
+                    AttributeError, ImportError, IndexError, KeyError,
+                    TypeError, ValueError)
+
+    def __init__(self, patch_info):
+        """:type patch_info: bosh.ModInfo"""
+        self.patch_info = patch_info
+        patch_name = patch_info.name
+        minfs = bosh.modInfos
+        from . import getPatchesList, getPatchesPath # avoid circular import
+        self.build_inputs = {
+            u'app_version': bass.AppVersion,
+            u'game': bush.game.fsName,
+            u'auto_flag_esl': bass.settings[u'bash.mods.auto_flag_esl'],
+            u'configs': minfs.table.getItem(patch_name, u'bash.patch.configs',
+                                            {}),
+            u'plugins': [(p.s, load_order.cached_is_active(p),
+                          minfs[p].calculate_crc()[0],
+                          sorted(minfs[p].getBashTags())) for p in
+                         load_order.cached_lower_loading(patch_name)],
+            u'patches_dir': sorted(
+                (f.s, getPatchesPath(f).size_mtime())
+                for f in getPatchesList()),
+        }
+
+    @staticmethod
+    def _manifest_path(patch_name):
+        return bass.dirs[u'modsBash'].join(u'Patch Manifests',
+                                           patch_name.s + u'.manifest')
+
+    def matches_last_build(self):
+        """Return True if the last build of the patch had exactly the same
+        inputs as the current state and the patch itself hasn't changed since
+        then. A manifest that can't be read counts as a mismatch."""
+        manifest_path = self._manifest_path(self.patch_info.name)
+        if not manifest_path.exists(): return False
+        try:
+            with manifest_path.open(u'rb') as ins:
+                last_build = pickle.load(ins)
+            return (last_build[u'version'] == self._manifest_version and
+                    last_build[u'patch_state'] ==
+                    self.patch_info.abs_path.size_mtime() and
+                    last_build[u'build_inputs'] == self.build_inputs)
+        except self._read_errors:
+            deprint(u'Failed to read patch manifest %s' % manifest_path,
+                    traceback=True)
+            return False
+
+    def save(self):
+        """Save this manifest as the one of the last build. Must be called
+        once the built patch has been saved."""
+        manifest_path = self._manifest_path(self.patch_info.name)
+        try:
+            manifest_path.head.makedirs()
+            with manifest_path.temp.open(u'wb') as out:
+                pickle.dump({u'version': self._manifest_version,
+                             u'patch_state':
+                                 self.patch_info.abs_path.size_mtime(),
+                             u'build_inputs': self.build_inputs}, out, -1)
+            manifest_path.untemp()
+        except (OSError, IOError):
+            deprint(u'Failed to write patch manifest %s' % manifest_path,
+                    traceback=True)
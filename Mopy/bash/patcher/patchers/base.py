@@ -391,6 +391,19 @@ class ImportPatcher(ListPatcher):
     # Override in subclasses as needed
     logMsg = u'\n=== ' + _(u'Modified Records')
 
+    def _srcs_and_masters(self):
+        """Returns the source plugins of this patcher that are present, each
+        followed by its masters that are present, in the order initData
+        usually loads them - see get_source_mod_loads."""
+        minfs = self.patchFile.p_file_minfos
+        source_mods = []
+        for srcMod in self.srcs:
+            if srcMod not in minfs: continue
+            source_mods.append(srcMod)
+            source_mods.extend(m for m in minfs[srcMod].masterNames
+                               if m in minfs)
+        return source_mods
+
     def _patchLog(self,log,type_count):
         log.setHeader(u'= ' + self._patcher_name)
         self._srcMods(log)
@@ -31,7 +31,6 @@
 from ... import bush
 from ...brec import MreRecord
 from ...exception import ModSigMismatchError
-from ...mod_files import ModFile, LoadFactory
 
 #------------------------------------------------------------------------------
 ##: currently relies on the merged subrecord being sorted - fix that
@@ -90,16 +89,17 @@ def getReadClasses(self):
     def getWriteClasses(self):
         return self.getReadClasses()
 
+    def get_source_mod_loads(self):
+        if not self.isActive or not self.srcs: return (), []
+        return [MreRecord.type_class[x] for x in self._wanted_subrecord], list(
+            self.srcs)
+
     def initData(self,progress):
         if not self.isActive or not self.srcs: return
         wanted_sigs = list(self._wanted_subrecord)
-        loadFactory = LoadFactory(False, *[MreRecord.type_class[x]
-                                           for x in wanted_sigs])
         progress.setFull(len(self.srcs))
         for index,srcMod in enumerate(self.srcs):
-            srcInfo = self.patchFile.p_file_minfos[srcMod]
-            srcFile = ModFile(srcInfo,loadFactory)
-            srcFile.load(True)
+            srcFile = self.patchFile.load_source_mod(srcMod)
             for block in wanted_sigs:
                 if block not in srcFile.tops: continue
                 self._present_sigs.add(block)
@@ -281,36 +281,33 @@ def __init__(self, p_name, p_file, p_sources):
         self.id_merged_deleted = {}
         self._read_write_records = bush.game.actor_types
 
+    def get_source_mod_loads(self):
+        if not self.isActive: return (), []
+        return [MreRecord.type_class[x] for x in self._read_write_records], \
+            self._srcs_and_masters()
+
     def initData(self,progress):
         """Get data from source files."""
         if not self.isActive: return
         target_rec_types = self._read_write_records
-        loadFactory = LoadFactory(False, *[MreRecord.type_class[x] for x
-                                           in target_rec_types])
         progress.setFull(len(self.srcs))
-        cachedMasters = {}
         mer_del = self.id_merged_deleted
         minfs = self.patchFile.p_file_minfos
         for index,srcMod in enumerate(self.srcs):
             tempData = {}
             if srcMod not in minfs: continue
             srcInfo = minfs[srcMod]
-            srcFile = ModFile(srcInfo,loadFactory)
+            srcFile = self.patchFile.load_source_mod(srcMod)
             bashTags = srcInfo.getBashTags()
-            srcFile.load(True)
             for recClass in (MreRecord.type_class[x] for x in target_rec_types):
                 if recClass.rec_sig not in srcFile.tops: continue
                 for record in srcFile.tops[recClass.rec_sig].getActiveRecords():
-                    tempData[record.fid] = record.spells
+                    # Copy, the merged list is modified below and the
+                    # record is shared with other patchers
+                    tempData[record.fid] = list(record.spells)
             for master in reversed(srcInfo.masterNames):
                 if master not in minfs: continue # or break filter mods
-                if master in cachedMasters:
-                    masterFile = cachedMasters[master]
-                else:
-                    masterInfo = minfs[master]
-                    masterFile = ModFile(masterInfo,loadFactory)
-                    masterFile.load(True)
-                    cachedMasters[master] = masterFile
+                masterFile = self.patchFile.load_source_mod(master)
                 for block in (MreRecord.type_class[x] for x in target_rec_types):
                     if block.rec_sig not in srcFile.tops: continue
                     if block.rec_sig not in masterFile.tops: continue
@@ -458,37 +455,34 @@ def _insertPackage(self, id_merged_deleted, fi, index, pkg, recordData):
                         break
                     i += 1
 
+    def get_source_mod_loads(self):
+        if not self.isActive: return (), []
+        return [MreRecord.type_class[x] for x in self.target_rec_types], \
+            self._srcs_and_masters()
+
     def initData(self,progress):
         """Get data from source files."""
         if not self.isActive: return
         target_rec_types = self.target_rec_types
-        loadFactory = LoadFactory(False, *[MreRecord.type_class[x] for x
-                                           in target_rec_types])
         progress.setFull(len(self.srcs))
-        cachedMasters = {}
         mer_del = self.id_merged_deleted
         minfs = self.patchFile.p_file_minfos
         for index,srcMod in enumerate(self.srcs):
             tempData = {}
             if srcMod not in minfs: continue
             srcInfo = minfs[srcMod]
-            srcFile = ModFile(srcInfo,loadFactory)
+            srcFile = self.patchFile.load_source_mod(srcMod)
             bashTags = srcInfo.getBashTags()
-            srcFile.load(True)
             for recClass in (MreRecord.type_class[x] for x in target_rec_types):
                 if recClass.rec_sig not in srcFile.tops: continue
                 for record in srcFile.tops[
                     recClass.rec_sig].getActiveRecords():
-                    tempData[record.fid] = record.aiPackages
+                    # Copy, the merged list is modified below and the
+                    # record is shared with other patchers
+                    tempData[record.fid] = list(record.aiPackages)
             for master in reversed(srcInfo.masterNames):
                 if master not in minfs: continue # or break filter mods
-                if master in cachedMasters:
-                    masterFile = cachedMasters[master]
-                else:
-                    masterInfo = minfs[master]
-                    masterFile = ModFile(masterInfo,loadFactory)
-                    masterFile.load(True)
-                    cachedMasters[master] = masterFile
+                masterFile = self.patchFile.load_source_mod(master)
                 blocks = (MreRecord.type_class[x] for x in target_rec_types)
                 for block in blocks:
                     if block.rec_sig not in srcFile.tops: continue
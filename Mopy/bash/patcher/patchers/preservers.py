@@ -24,15 +24,30 @@
 carries forward changes from the last tagged plugin. The goal is to eventually
 absorb all of them under the _APreserver base class."""
 from collections import defaultdict, Counter
+from copy import deepcopy
 from itertools import chain
 # Internal
 from .base import ImportPatcher
 from .. import getPatchesPath
 from ... import bush, load_order, parsers
-from ...bolt import attrgetter_cache, deprint, floats_equal, setattr_deep
+from ...bolt import attrs_getter_cache, deprint, floats_equal, \
+    setattr_deep, Path
 from ...brec import MreRecord
 from ...exception import ModSigMismatchError
-from ...mod_files import ModFile, LoadFactory
+
+# Types of record attribute values that can be kept without copying them
+_immutable_types = (type(None), bool, int, long, float, bytes, unicode, Path)
+
+def _copy_value(rec_value, __deepcopy=deepcopy):
+    """Returns a copy of the specified value of a source record attribute,
+    or the value itself if it is immutable. The records of source plugins are
+    shared between patchers (see PatchFile.load_source_mod), so the values
+    patchers keep must not be the objects the records hold."""
+    if isinstance(rec_value, _immutable_types) or (
+            type(rec_value) is tuple and all(
+            isinstance(v, _immutable_types) for v in rec_value)):
+        return rec_value
+    return __deepcopy(rec_value)
 
 #------------------------------------------------------------------------------
 class _APreserver(ImportPatcher):
@@ -60,6 +75,9 @@ def __init__(self, p_name, p_file, p_sources):
         super(_APreserver, self).__init__(p_name, p_file, p_sources)
         #--(attribute-> value) dicts keyed by long fid.
         self.id_data = defaultdict(dict)
+        # The same data as a tuple of the attributes and a tuple of their
+        # values, keyed by long fid - built at the end of initData
+        self._id_attr_values = {}
         self.srcClasses = set() #--Record classes actually provided by src
         # mods/files.
         self.classestemp = set()
@@ -130,7 +148,10 @@ def getWriteClasses(self):
 
     # noinspection PyDefaultArgument
     def _init_data_loop(self, recClass, srcFile, srcMod, temp_id_data,
-                        __attrgetters=attrgetter_cache):
+                        __attrs_getters=attrs_getter_cache):
+        """Store the values of the attributes recClass records in srcFile
+        carry in temp_id_data, as a tuple of the attributes and a tuple of
+        their values."""
         recAttrs = self.recAttrs_class[recClass]
         fid_attrs = self._fid_rec_attrs_class[recClass]
         loaded_mods = self.patchFile.loadSet
@@ -138,27 +159,31 @@ def _init_data_loop(self, recClass, srcFile, srcMod, temp_id_data,
             # For multi-tag importers, we need to look up the applied bash tags
             # and use those to find all applicable attributes
             mod_tags = srcFile.fileInfo.getBashTags()
-            recAttrs = set(chain.from_iterable(
-                attrs for t, attrs in recAttrs.iteritems() if t in mod_tags))
-            fid_attrs = set(chain.from_iterable(
-                attrs for t, attrs in fid_attrs.iteritems() if t in mod_tags))
+            recAttrs = tuple(set(chain.from_iterable(
+                attrs for t, attrs in recAttrs.iteritems() if t in mod_tags)))
+            fid_attrs = tuple(set(chain.from_iterable(
+                attrs for t, attrs in fid_attrs.iteritems() if t in mod_tags)))
+        get_attrs = __attrs_getters[recAttrs]
+        get_fid_attrs = __attrs_getters[fid_attrs]
         for record in srcFile.tops[recClass.rec_sig].iter_filtered_records(
                 self.getReadClasses()):
             # If we have FormID attributes, check those before importing
             if fid_attrs:
-                fid_attr_values = [__attrgetters[a](record) for a in fid_attrs]
                 if any(f and (f[0] is None or f[0] not in loaded_mods) for f
-                       in fid_attr_values):
+                       in get_fid_attrs(record)):
                     # Ignore the record. Another option would be to just ignore
                     # the attr_fidvalue result
                     self.patchFile.patcher_mod_skipcount[
                         self._patcher_name][srcMod] += 1
                     continue
-            temp_id_data[record.fid] = {attr: __attrgetters[attr](record)
-                                        for attr in recAttrs}
+            temp_id_data[record.fid] = (recAttrs, get_attrs(record))
+
+    def get_source_mod_loads(self):
+        if not self.isActive: return (), []
+        return self.recAttrs_class.keys(), self._srcs_and_masters()
 
     # noinspection PyDefaultArgument
-    def initData(self, progress, __attrgetters=attrgetter_cache):
+    def initData(self, progress, __attrs_getters=attrs_getter_cache):
         """Common initData pattern.
         Used in KFFZPatcher, DeathItemPatcher, SoundPatcher, ImportScripts,
         WeaponModsPatcher, ActorImporter.
@@ -166,16 +191,15 @@ def initData(self, progress, __attrgetters=attrgetter_cache):
         """
         if not self.isActive: return
         id_data = self.id_data
-        loadFactory = LoadFactory(False, *self.recAttrs_class.keys())
         progress.setFull(len(self.srcs) + len(self.csv_srcs))
-        cachedMasters = {}
+        # Sources and their masters are shared with the other preservers
+        load_source_mod = self.patchFile.load_source_mod
         minfs = self.patchFile.p_file_minfos
         for index,srcMod in enumerate(self.srcs):
             temp_id_data = {}
             if srcMod not in minfs: continue
             srcInfo = minfs[srcMod]
-            srcFile = ModFile(srcInfo,loadFactory)
-            srcFile.load(do_unpack=True)
+            srcFile = load_source_mod(srcMod)
             for recClass in self.recAttrs_class:
                 if recClass.rec_sig not in srcFile.tops: continue
                 self.srcClasses.add(recClass)
@@ -185,16 +209,13 @@ def initData(self, progress, __attrgetters=attrgetter_cache):
                     self._force_full_import_tag in srcInfo.getBashTags()):
                 # We want to force-import - copy the temp data without
                 # filtering by masters, then move on to the next mod
-                id_data.update(temp_id_data)
+                for fid, (attrs, values) in temp_id_data.iteritems():
+                    id_data[fid] = {a: _copy_value(v) for a, v
+                                    in zip(attrs, values)}
                 continue
             for master in srcInfo.masterNames:
                 if master not in minfs: continue # or break filter mods
-                if master in cachedMasters:
-                    masterFile = cachedMasters[master]
-                else:
-                    masterFile = ModFile(minfs[master], loadFactory)
-                    masterFile.load(True)
-                    cachedMasters[master] = masterFile
+                masterFile = load_source_mod(master)
                 for recClass in self.recAttrs_class:
                     if recClass.rec_sig not in masterFile.tops: continue
                     if recClass not in self.classestemp: continue
@@ -203,62 +224,83 @@ def initData(self, progress, __attrgetters=attrgetter_cache):
                         self.getReadClasses()): # ugh, looks hideous...
                         fid = record.fid
                         if fid not in temp_id_data: continue
-                        for attr, value in temp_id_data[fid].iteritems():
-                            try:
-                                if value == __attrgetters[attr](record):
-                                    continue
-                                else:
-                                    id_data[fid][attr] = value
-                            except AttributeError:
-                                raise ModSigMismatchError(master, record)
+                        attrs, values = temp_id_data[fid]
+                        try:
+                            master_values = __attrs_getters[attrs](record)
+                        except AttributeError:
+                            raise ModSigMismatchError(master, record)
+                        # Compare all attributes at once first - overrides
+                        # often don't touch any of the ones we import
+                        if values == master_values: continue
+                        for attr, value, master_value in zip(
+                                attrs, values, master_values):
+                            if value != master_value:
+                                id_data[fid][attr] = _copy_value(value)
             progress.plus()
         if self._csv_parser:
             self._parse_csv_sources(progress)
+        # A dict's keys and values are iterated in matching order
+        self._id_attr_values = {
+            fid: (tuple(fid_data), tuple(fid_data.itervalues()))
+            for fid, fid_data in id_data.iteritems()}
         self.isActive = bool(self.srcClasses)
 
-    # noinspection PyDefaultArgument
-    def scanModFile(self, modFile, progress, __attrgetters=attrgetter_cache):
+    def get_scan_fids(self):
+        # scanModFile skips the records we have no data for
+        return {x.rec_sig: self.id_data for x in self.srcClasses}
+
+    def scanModFile(self, modFile, progress):
         """Identical scanModFile() pattern of :
 
             GraphicsPatcher, KFFZPatcher, DeathItemPatcher, ImportScripts,
             SoundPatcher, DestructiblePatcher, ActorImporter, WeaponModsPatcher
         """
-        id_data = self.id_data
         for recClass in self.srcClasses:
             if recClass.rec_sig not in modFile.tops: continue
             patchBlock = getattr(self.patchFile,
                 recClass.rec_sig.decode(u'ascii'))
-            # Records that have been copied into the BP once will automatically
-            # be updated by update_patch_records_from_mod/mergeModFile
-            copied_records = patchBlock.id_records
             for record in modFile.tops[recClass.rec_sig].iter_filtered_records(
                 self.getReadClasses()):
-                fid = record.fid
-                # Skip if we've already copied this record or if we're not
-                # interested in it
-                if fid in copied_records or fid not in id_data: continue
-                for attr, value in id_data[fid].iteritems():
-                    if __attrgetters[attr](record) != value:
-                        patchBlock.setRecord(record.getTypeCopy())
-                        break
+                self.scan_record(record, patchBlock)
+
+    def get_record_scan_sigs(self):
+        # Subclasses that scan plugins their own way must get to do so
+        if (type(self).scanModFile.__func__ is not
+                _APreserver.scanModFile.__func__): return None
+        return [x.rec_sig for x in self.srcClasses]
+
+    # noinspection PyDefaultArgument
+    def scan_record(self, record, patch_block,
+                    __attrs_getters=attrs_getter_cache):
+        fid = record.fid
+        # Skip if we've already copied this record or if we're not
+        # interested in it. Records that have been copied into the BP once
+        # will automatically be updated by update_patch_records_from_mod and
+        # mergeModFile
+        if fid in patch_block.id_records: return
+        try:
+            attrs, values = self._id_attr_values[fid]
+        except KeyError:
+            return
+        if __attrs_getters[attrs](record) != values:
+            patch_block.setRecord(record.getTypeCopy())
 
     # noinspection PyDefaultArgument
     def _inner_loop(self, keep, records, top_mod_rec, type_count,
-                    __attrgetters=attrgetter_cache):
+                    __attrs_getters=attrs_getter_cache):
         """Most common pattern for the internal buildPatch() loop.
 
         In:
             KFFZPatcher, DeathItemPatcher, ImportScripts, SoundPatcher
         """
         loop_setattr = setattr_deep if self._deep_attrs else setattr
-        id_data = self.id_data
+        id_attr_values = self._id_attr_values
         for record in records:
             rec_fid = record.fid
-            if rec_fid not in id_data: continue
-            for attr, value in id_data[rec_fid].iteritems():
-                if __attrgetters[attr](record) != value: break
-            else: continue
-            for attr, value in id_data[rec_fid].iteritems():
+            if rec_fid not in id_attr_values: continue
+            attrs, values = id_attr_values[rec_fid]
+            if __attrs_getters[attrs](record) == values: continue
+            for attr, value in zip(attrs, values):
                 loop_setattr(record, attr, value)
             keep(rec_fid)
             type_count[top_mod_rec] += 1
@@ -284,6 +326,7 @@ def buildPatch(self, log, progress, types=None):
                 self.getReadClasses(), include_ignored=True)
             self._inner_loop(keep, records, top_mod_rec, type_count)
         self.id_data.clear() # cleanup to save memory
+        self._id_attr_values.clear()
         # Log
         self._patchLog(log, type_count)
 
@@ -474,6 +517,11 @@ def __init__(self, p_name, p_file, p_sources):
         self.recAttrs = bush.game.cellRecAttrs # dict[unicode, tuple[str]]
         self.recFlags = bush.game.cellRecFlags # dict[unicode, str]
 
+    def get_source_mod_loads(self):
+        if not self.isActive: return (), []
+        return [MreRecord.type_class[x] for x in self._read_write_records], \
+            self._srcs_and_masters()
+
     def initData(self,progress):
         """Get cells from source files."""
         if not self.isActive: return
@@ -513,16 +561,14 @@ def checkMasterCellBlockData(cellBlock):
                 for attr in actual_attrs:
                     master_attr = cellBlock.cell.__getattribute__(attr)
                     if tempCellData[rec_fid][attr] != master_attr:
-                        cellData[rec_fid][attr] = tempCellData[rec_fid][attr]
+                        cellData[rec_fid][attr] = _copy_value(
+                            tempCellData[rec_fid][attr])
                 for flg_ in flgs_:
                     master_flag = cellBlock.cell.flags.__getattr__(flg_)
                     if tempCellData[rec_fid + ('flags',)][flg_] != master_flag:
                         cellData[rec_fid + ('flags',)][flg_] = \
                             tempCellData[rec_fid + ('flags',)][flg_]
-        loadFactory = LoadFactory(False,MreRecord.type_class['CELL'],
-                                        MreRecord.type_class['WRLD'])
         progress.setFull(len(self.srcs))
-        cachedMasters = {}
         minfs = self.patchFile.p_file_minfos
         for srcMod in self.srcs:
             if srcMod not in minfs: continue
@@ -532,9 +578,7 @@ def checkMasterCellBlockData(cellBlock):
             # values from the value in any of srcMod's masters.
             tempCellData = defaultdict(dict)
             srcInfo = minfs[srcMod]
-            srcFile = ModFile(srcInfo,loadFactory)
-            srcFile.load(True)
-            cachedMasters[srcMod] = srcFile
+            srcFile = self.patchFile.load_source_mod(srcMod)
             bashTags = srcInfo.getBashTags()
             # print bashTags
             tags = bashTags & set(self.recAttrs)
@@ -554,13 +598,7 @@ def checkMasterCellBlockData(cellBlock):
                         importCellBlockData(worldBlock.worldCellBlock)
             for master in srcInfo.masterNames:
                 if master not in minfs: continue # or break filter mods
-                if master in cachedMasters:
-                    masterFile = cachedMasters[master]
-                else:
-                    masterInfo = minfs[master]
-                    masterFile = ModFile(masterInfo,loadFactory)
-                    masterFile.load(True)
-                    cachedMasters[master] = masterFile
+                masterFile = self.patchFile.load_source_mod(master)
                 if 'CELL' in masterFile.tops:
                     for cellBlock in masterFile.CELL.cellBlocks:
                         checkMasterCellBlockData(cellBlock)
@@ -673,19 +711,22 @@ class GraphicsPatcher(_APreserver):
     _fid_rec_attrs = bush.game.graphicsFidTypes
 
     def _inner_loop(self, keep, records, top_mod_rec, type_count,
-                    __attrgetters=attrgetter_cache):
-        id_data = self.id_data
+                    __attrs_getters=attrs_getter_cache):
+        id_attr_values = self._id_attr_values
+        model_attrs = bush.game.graphicsModelAttrs
         for record in records:
             fid = record.fid
-            if fid not in id_data: continue
-            for attr, value in id_data[fid].iteritems():
-                rec_attr = __attrgetters[attr](record)
+            if fid not in id_attr_values: continue
+            attrs, values = id_attr_values[fid]
+            rec_values = __attrs_getters[attrs](record)
+            if rec_values == values: continue
+            for attr, value, rec_attr in zip(attrs, values, rec_values):
                 if isinstance(rec_attr,
                               basestring) and isinstance(value, basestring):
                     if rec_attr.lower() != value.lower():
                         break
                     continue
-                elif attr in bush.game.graphicsModelAttrs:
+                elif attr in model_attrs:
                     try:
                         if rec_attr.modPath.lower() != value.modPath.lower():
                             break
@@ -694,7 +735,7 @@ def _inner_loop(self, keep, records, top_mod_rec, type_count,
                         # aren't __both__ NONE)
                 if rec_attr != value: break
             else: continue
-            for attr, value in id_data[fid].iteritems():
+            for attr, value in zip(attrs, values):
                 setattr(record, attr, value)
             keep(fid)
             type_count[top_mod_rec] += 1
@@ -159,9 +159,9 @@ def scanModFile(self, modFile, progress):
                     if is_delev:
                         id_master_items = self.masterItems.get(list_fid)
                         if id_master_items:
-                            for de_master in modFile.tes4.masters:
-                                if de_master in id_master_items:
-                                    delevs |= id_master_items[de_master]
+                            delevs.update(*[id_master_items[de_master] for
+                                            de_master in modFile.tes4.masters
+                                            if de_master in id_master_items])
                             # TODO(inf) Double-check that this works correctly,
                             #  this line (delevs -= items) seems a noop here
                             delevs -= items
@@ -170,13 +170,14 @@ def scanModFile(self, modFile, progress):
                 if is_list_owner:
                     de_list = copy.deepcopy(new_list)
                     de_list.mergeSources = []
-                    stored_lists[list_fid] = de_list
+                    self._store_list(stored_lists, de_list)
                 elif list_fid not in stored_lists:
                     de_list = copy.deepcopy(new_list)
                     de_list.mergeSources = [sc_name]
-                    stored_lists[list_fid] = de_list
+                    self._store_list(stored_lists, de_list)
                 else:
-                    stored_lists[list_fid].mergeWith(new_list, sc_name)
+                    self._merge_list(stored_lists[list_fid], new_list,
+                                     sc_name)
 
     def buildPatch(self, log, progress):
         keep = self.patchFile.getKeeper()
@@ -223,6 +224,8 @@ def buildPatch(self, log, progress):
             #--Clear empties
             removed_empty_sublists = set()
             cleaned_lists = set()
+            # Maps each list to the empty sublists that were removed from it
+            super_removed = defaultdict(set)
             while empty_lists:
                 empty_list = empty_lists.pop()
                 if empty_list not in sub_supers: continue
@@ -231,23 +234,27 @@ def buildPatch(self, log, progress):
                 for sub_super in sub_supers[empty_list]:
                     stored_list = stored_lists[sub_super]
                     # Remove the emtpy list from this sublist
-                    old_entries = stored_list.entries
-                    stored_list.entries = [x for x in stored_list.entries
-                                           if x.listId != empty_list]
                     stored_list.items.remove(empty_list)
-                    patch_block.setRecord(stored_list)
+                    super_removed[sub_super].add(empty_list)
                     # If removing the empty list made this list empty too, then
                     # we should investigate it as well - could clean up even
                     # more lists
                     if not stored_list.items:
                         empty_lists.append(sub_super)
                     removed_empty_sublists.add(stored_lists[empty_list].eid)
-                    # We don't need to write out records where another mod has
-                    # already removed the empty sublist - that would just make
-                    # an ITPO
-                    if old_entries != stored_list.entries:
-                        cleaned_lists.add(stored_list.eid)
-                        keep(sub_super)
+            # Now remove the entries of all removed sublists from each list in
+            # one go, instead of rebuilding the entries once per sublist
+            for sub_super, removed_lists in super_removed.iteritems():
+                stored_list = stored_lists[sub_super]
+                old_entries = self._get_entries(stored_list)
+                self._remove_entries(stored_list, removed_lists)
+                patch_block.setRecord(stored_list)
+                # We don't need to write out records where another mod has
+                # already removed the empty sublist - that would just make
+                # an ITPO
+                if old_entries != self._get_entries(stored_list):
+                    cleaned_lists.add(stored_list.eid)
+                    keep(sub_super)
             log.setHeader(u'=== ' + _(u'Empty %s Sublists') % list_label)
             for list_eid in sorted(removed_empty_sublists, key=unicode.lower):
                 log(u'* ' + list_eid)
@@ -266,6 +273,22 @@ def _get_entries(self, target_list):
         implementation, every patcher needs to override this."""
         raise AbstractError()
 
+    def _remove_entries(self, target_list, removed_items):
+        """Removes all entries for the specified set of items from the
+        specified list. No default implementation, every patcher needs to
+        override this."""
+        raise AbstractError()
+
+    def _store_list(self, stored_lists, de_list):
+        """Stores the specified list in stored_lists, replacing any list that
+        was stored for its FormID before."""
+        stored_lists[de_list.fid] = de_list
+
+    def _merge_list(self, stored_list, new_list, merge_source):
+        """Merges new_list, which comes from the plugin merge_source, into
+        the specified stored list."""
+        stored_list.mergeWith(new_list, merge_source)
+
 class ListsMerger(_AListsMerger):
     """Merges leveled lists."""
     _read_write_records = bush.game.listTypes # bush.game must be set!
@@ -285,6 +308,9 @@ def __init__(self, p_name, p_file, p_sources, remove_empty, tag_choices):
         self.empties = set()
         _skip_id = lambda x: (GPath(bush.game.master_file), x)
         self._overhaul_compat(self.srcs, _skip_id)
+        # Counts the entries of all stored lists per (list FormID, entry key),
+        # see MreLeveledListBase.mergeWith
+        self._entry_index = {}
 
     def _check_list(self, record, log):
         # Emit a warning for lists that may have exceeded 255 - note that
@@ -298,6 +324,20 @@ def _check_list(self, record, log):
     def _get_entries(self, target_list):
         return [list_entry.listId for list_entry in target_list.entries]
 
+    def _remove_entries(self, target_list, removed_items):
+        target_list.entries = [list_entry for list_entry in target_list.entries
+                               if list_entry.listId not in removed_items]
+
+    def _store_list(self, stored_lists, de_list):
+        old_list = stored_lists.get(de_list.fid)
+        if old_list is not None:
+            old_list.index_entries(self._entry_index, delta=-1)
+        de_list.index_entries(self._entry_index)
+        super(ListsMerger, self)._store_list(stored_lists, de_list)
+
+    def _merge_list(self, stored_list, new_list, merge_source):
+        stored_list.mergeWith(new_list, merge_source, self._entry_index)
+
 #------------------------------------------------------------------------------
 class FidListsMerger(_AListsMerger):
     """Merges FormID lists."""
@@ -311,6 +351,10 @@ class FidListsMerger(_AListsMerger):
     def _get_entries(self, target_list):
         return target_list.formIDInList
 
+    def _remove_entries(self, target_list, removed_items):
+        target_list.formIDInList = [fi for fi in target_list.formIDInList
+                                    if fi not in removed_items]
+
 #------------------------------------------------------------------------------
 class ContentsChecker(Patcher):
     """Checks contents of leveled lists, inventories and containers for
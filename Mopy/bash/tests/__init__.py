@@ -25,6 +25,7 @@
 what."""
 
 import os
+import struct
 import toml
 import traceback
 import wx
@@ -81,6 +82,74 @@ def iter_resources(resource_subfolder, filter_by_game=frozenset()):
         for resource_file in os.listdir(full_game_folder):
             yield os.path.join(full_game_folder, resource_file)
 
+# Plugin building -------------------------------------------------------------
+# Minimal helpers to build plugins in memory for the tests of the plugin
+# reading and writing code, for which we have no resources (yet)
+def pack_subrecord(sub_sig, sub_data):
+    """Returns a subrecord with the specified signature and data, packed in
+    the current game's format."""
+    from ..brec import RecordHeader
+    return struct.pack(RecordHeader.sub_header_fmt.encode(u'ascii'), sub_sig,
+                       len(sub_data)) + sub_data
+
+def pack_record(rec_sig, rec_fid, subrecords=(), flags1=0):
+    """Returns a record with the specified signature, FormID and flags,
+    containing the specified (packed) subrecords."""
+    from ..brec import RecHeader
+    rec_data = b''.join(subrecords)
+    return RecHeader(rec_sig, len(rec_data), flags1, rec_fid,
+                     0).pack_head() + rec_data
+
+def pack_top_group(grup_sig, records):
+    """Returns a top group with the specified signature, containing the
+    specified (packed) records."""
+    from ..brec import RecordHeader, TopGrupHeader
+    grup_data = b''.join(records)
+    return TopGrupHeader(RecordHeader.rec_header_size + len(grup_data),
+                         grup_sig).pack_head() + grup_data
+
+def pack_plugin(top_groups, masters=()):
+    """Returns a plugin with the specified masters, containing the specified
+    (packed) top groups. The plugin header carries no other information."""
+    header_subrecords = [pack_subrecord(b'HEDR', struct.pack(
+        u'=fIi', 1.0, 0, 0x800))]
+    for master_name in masters:
+        header_subrecords.append(pack_subrecord(b'MAST', master_name + b'\0'))
+        header_subrecords.append(pack_subrecord(b'DATA', b'\0' * 8))
+    return pack_record(b'TES4', 0, header_subrecords) + b''.join(top_groups)
+
+class MinimalModInfo(object):
+    """Just enough of bosh.ModInfo to load, index and save a plugin written by
+    a test."""
+    def __init__(self, plugin_path, masters=()):
+        from ..bolt import GPath
+        self.abs_path = GPath(u'%s' % plugin_path)
+        self.name = GPath(self.abs_path.stail)
+        self.masterNames = [GPath(m) for m in masters]
+
+    def getPath(self): return self.abs_path
+
+    @property
+    def size(self): return self.abs_path.size
+
+    @property
+    def mtime(self): return self.abs_path.mtime
+
+class MinimalModInfos(dict):
+    """Just enough of bosh.ModInfos for the record groups to work. Set it as
+    bosh.modInfos (e.g. via monkeypatch) in tests that need it."""
+    def __init__(self, *mod_infos):
+        from ..bolt import GPath
+        super(MinimalModInfos, self).__init__((m.name, m) for m in mod_infos)
+        self.masterName = GPath(u'Oblivion.esm')
+
+def write_plugin(tmpdir, plugin_name, plugin_data, masters=()):
+    """Writes a plugin built via pack_plugin to the specified pytest tmpdir
+    and returns a MinimalModInfo for it."""
+    plugin_path = tmpdir.join(plugin_name)
+    plugin_path.write_binary(plugin_data)
+    return MinimalModInfo(plugin_path, masters)
+
 # Here be hacks ---------------------------------------------------------------
 # Maps the resource subfolder game names back to displayNames
 resource_to_displayName = {
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the basic record elements in brec.basic_elements."""
+from ... import bush
+from ...bolt import GPath, sio
+from ...brec import MelSet, MelStruct, ModReader, common_records
+
+class _Record(object):
+    """Stand-in for a record, takes any attribute."""
+
+def _game_structs():
+    """Returns all MelStructs that the record classes of the current game
+    load subrecords with directly."""
+    game_structs = {}
+    for rec_module in (bush.game_mod.records, common_records):
+        for rec_class in vars(rec_module).itervalues():
+            mel_set = getattr(rec_class, u'melSet', None)
+            if not isinstance(mel_set, MelSet): continue
+            for loader in mel_set.loaders.itervalues():
+                if isinstance(loader, MelStruct):
+                    game_structs[id(loader)] = loader
+    return game_structs.values()
+
+def _load(load_data, sub_data):
+    """Loads sub_data via load_data, returning the resulting attributes or
+    the type of the exception it raised."""
+    record = _Record()
+    with ModReader(GPath(u'test.esp'), sio(sub_data)) as ins:
+        try:
+            load_data(record, ins, b'TEST', len(sub_data), u'TEST.TEST')
+        except Exception as e:
+            return type(e)
+    return vars(record)
+
+def _values_equal(a, b):
+    return a == b or (a != a and b != b) # NaNs
+
+class TestMelStruct(object):
+    def test_fast_loader_matches_load_data(self):
+        """Tests that the loader compiled by get_fast_loader sets the same
+        attributes to the same values as loadData for every struct format
+        the current game uses."""
+        game_structs = _game_structs()
+        assert game_structs
+        num_compiled = 0
+        for mel_struct in game_structs:
+            fast_loader = mel_struct.get_fast_loader()
+            num_compiled += fast_loader != mel_struct.loadData
+            struct_size = mel_struct._unpacker.__self__.size
+            for sub_data in (b'\x00' * struct_size, bytes(bytearray(
+                    (i * 37 + 11) % 256 for i in xrange(struct_size)))):
+                expected = _load(mel_struct.loadData, sub_data)
+                actual = _load(fast_loader, sub_data)
+                if isinstance(expected, dict):
+                    assert sorted(actual) == sorted(expected), \
+                        mel_struct.struct_format
+                    for attr, value in expected.iteritems():
+                        assert _values_equal(actual[attr], value), (
+                            mel_struct.struct_format, attr)
+                else:
+                    assert actual is expected, mel_struct.struct_format
+        assert num_compiled
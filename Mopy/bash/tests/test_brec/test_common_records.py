@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the record classes in brec.common_records."""
+import struct
+
+import pytest
+
+from .. import MinimalModInfos, pack_plugin, pack_record, pack_subrecord, \
+    pack_top_group, write_plugin
+from ... import bosh
+from ...bolt import GPath
+from ...brec import MreRecord
+from ...mod_files import LoadFactory, ModFile
+
+@pytest.fixture(autouse=True)
+def _mod_infos(monkeypatch):
+    monkeypatch.setattr(bosh, u'modInfos', MinimalModInfos())
+
+_ENTRY_A = 0x000100
+_ENTRY_B = 0x000101
+
+def _lvli(lvli_fid, entries):
+    """Packs an LVLI with the specified (entry FormID, count) entries, all at
+    level 1."""
+    return pack_record(b'LVLI', lvli_fid, [
+        pack_subrecord(b'EDID', b'TestList\x00'),
+        pack_subrecord(b'LVLD', b'\x00'),
+        pack_subrecord(b'LVLF', b'\x00')] + [
+        pack_subrecord(b'LVLO', struct.pack(u'=h2sIh2s', 1, b'\x00' * 2,
+                                            entry_fid, entry_count,
+                                            b'\x00' * 2))
+        for entry_fid, entry_count in entries])
+
+class TestMreLeveledListBase(object):
+    def _load_lists(self, tmpdir, self_entries, other_entries):
+        """Loads a stored list with self_entries and a list to merge into it
+        with other_entries, set up the way ListsMerger does it."""
+        mod_info = write_plugin(tmpdir, u'test.esp', pack_plugin(
+            [pack_top_group(b'LVLI', [_lvli(0x01000800, self_entries),
+                                      _lvli(0x01000801, other_entries)])],
+            masters=[b'Oblivion.esm']), masters=[u'Oblivion.esm'])
+        mod_file = ModFile(mod_info, LoadFactory(
+            True, MreRecord.type_class[b'LVLI']))
+        mod_file.load(True)
+        self_list, other_list = mod_file.LVLI.records
+        for lvl_list in (self_list, other_list):
+            lvl_list.items = {e.listId for e in lvl_list.entries}
+            lvl_list.de_records = set()
+            lvl_list.re_records = set()
+        self_list.mergeSources = []
+        entry_index = {}
+        # Another list with the same entries must not affect the merge
+        other_list.index_entries(entry_index)
+        self_list.index_entries(entry_index)
+        return self_list, other_list, entry_index
+
+    @staticmethod
+    def _entry_keys(lvl_list):
+        return [(e.listId[1], e.count) for e in lvl_list.entries]
+
+    def test_merge_duplicate_counts(self, tmpdir):
+        """Tests that merging duplicate entries that only differ in their
+        count marks the merged list as changed."""
+        self_list, other_list, entry_index = self._load_lists(
+            tmpdir, [(_ENTRY_A, 1), (_ENTRY_A, 1)],
+            [(_ENTRY_A, 1), (_ENTRY_A, 2)])
+        self_list.mergeWith(other_list, GPath(u'test.esp'), entry_index)
+        assert self._entry_keys(self_list) == [(_ENTRY_A, 1), (_ENTRY_A, 1)]
+        assert self_list.mergeOverLast
+
+    def test_merge_reordered(self, tmpdir):
+        """Tests that merging the same entries in a different order does not
+        mark the merged list as changed."""
+        self_list, other_list, entry_index = self._load_lists(
+            tmpdir, [(_ENTRY_A, 1), (_ENTRY_A, 2)],
+            [(_ENTRY_A, 2), (_ENTRY_A, 1)])
+        self_list.mergeWith(other_list, GPath(u'test.esp'), entry_index)
+        assert not self_list.mergeOverLast
+
+    def test_merge_relev(self, tmpdir):
+        """Tests that relevelled duplicate entries replace the stored ones and
+        that the entry index is kept up to date."""
+        self_list, other_list, entry_index = self._load_lists(
+            tmpdir, [(_ENTRY_A, 1), (_ENTRY_A, 1), (_ENTRY_B, 1)],
+            [(_ENTRY_A, 2), (_ENTRY_A, 3), (_ENTRY_B, 1)])
+        other_list.re_records = {e.listId for e in other_list.entries
+                                 if e.listId[1] == _ENTRY_A}
+        self_list.mergeWith(other_list, GPath(u'test.esp'), entry_index)
+        assert self._entry_keys(self_list) == [
+            (_ENTRY_A, 2), (_ENTRY_A, 3), (_ENTRY_B, 1)]
+        assert not self_list.mergeOverLast
+        expected_index = {}
+        other_list.index_entries(expected_index)
+        self_list.index_entries(expected_index)
+        assert entry_index == expected_index
+
+    def test_merge_no_index(self, tmpdir):
+        """Tests that merging without an entry index builds one for the
+        merge."""
+        self_list, other_list, _entry_index = self._load_lists(
+            tmpdir, [(_ENTRY_A, 1), (_ENTRY_A, 1)],
+            [(_ENTRY_A, 1), (_ENTRY_A, 2)])
+        self_list.mergeWith(other_list, GPath(u'test.esp'))
+        assert self._entry_keys(self_list) == [(_ENTRY_A, 1), (_ENTRY_A, 1)]
+        assert self_list.mergeOverLast
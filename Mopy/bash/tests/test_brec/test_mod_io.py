@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the plugin reading and writing primitives in brec.mod_io."""
+import struct
+
+from .. import pack_plugin, pack_record, pack_subrecord, pack_top_group
+from ...bolt import GPath, sio
+from ...brec import ModReader, MmapModReader, RecordHeader
+from ...brec.mod_io import RecordHeaderTable, compress_record_data
+
+def _header_fields(header):
+    """Returns the fields of a record or GRUP header as a tuple."""
+    if header.recType == b'GRUP':
+        return (header.recType, header.size, header.label, header.groupType,
+                header.stamp)
+    return (header.recType, header.size, header.flags1, header.fid,
+            header.flags2)
+
+def _read_all(reader):
+    """Walks the plugin in reader, returning the fields of all record, GRUP
+    and subrecord headers in the order they were read."""
+    read_headers = []
+    with reader as ins:
+        while not ins.atEnd():
+            header = ins.unpackRecHeader()
+            read_headers.append(_header_fields(header))
+            if header.recType == b'GRUP': continue
+            end_pos = ins.tell() + header.size
+            while not ins.atEnd(end_pos, header.recType):
+                sub_sig, sub_size = ins.unpackSubHeader(header.recType)
+                read_headers.append((sub_sig, sub_size, ins.read(sub_size)))
+    return read_headers
+
+_gmst_data = pack_top_group(b'GMST', [
+    pack_record(b'GMST', 0x01000800, [
+        pack_subrecord(b'EDID', b'fTest\x00'),
+        pack_subrecord(b'DATA', struct.pack(u'=f', 1.5))]),
+    pack_record(b'GMST', 0x00000801, [
+        pack_subrecord(b'EDID', b'iTest\x00'),
+        pack_subrecord(b'DATA', struct.pack(u'=i', 3))], flags1=0x20),
+])
+
+class TestMmapModReader(object):
+    def _check_same_headers(self, tmpdir, plugin_data):
+        plugin_path = tmpdir.join(u'test.esp')
+        plugin_path.write_binary(plugin_data)
+        mmap_headers = _read_all(MmapModReader(
+            GPath(u'test.esp'), open(str(plugin_path), u'rb')))
+        stream_headers = _read_all(ModReader(
+            GPath(u'test.esp'), sio(plugin_data)))
+        assert mmap_headers == stream_headers
+        return mmap_headers
+
+    def test_header_unpacking(self, tmpdir):
+        """Tests that the mmap reader unpacks the same record, GRUP and
+        subrecord headers as the regular reader."""
+        read_headers = self._check_same_headers(tmpdir, pack_plugin(
+            [_gmst_data], masters=[b'Oblivion.esm']))
+        assert read_headers[0][0] == b'TES4'
+        last_header = read_headers[-3]
+        assert (last_header[0], last_header[3]) == (b'GMST', 0x00000801)
+        assert last_header[2] == 0x20
+        assert read_headers[-1] == (b'DATA', 4, struct.pack(u'=i', 3))
+
+    def test_extended_subrecord(self, tmpdir):
+        """Tests that XXXX subrecords, which the mmap reader leaves to the
+        regular implementation, give the same results."""
+        big_data = b'\x01' * 8
+        self._check_same_headers(tmpdir, pack_plugin([pack_top_group(
+            b'GMST', [pack_record(b'GMST', 0x800, [
+                pack_subrecord(b'XXXX', struct.pack(u'=I', len(big_data))),
+                struct.pack(RecordHeader.sub_header_fmt.encode(u'ascii'),
+                            b'DATA', 0) + big_data])])]))
+
+    def test_read_past_end(self, tmpdir):
+        """Tests that the mmap reader refuses to read past the end of the
+        plugin, like the regular reader."""
+        from ...exception import ModSizeError
+        plugin_path = tmpdir.join(u'test.esp')
+        plugin_path.write_binary(pack_plugin([]))
+        with MmapModReader(GPath(u'test.esp'),
+                           open(str(plugin_path), u'rb')) as ins:
+            ins.seek(-2, 2)
+            try:
+                ins.read(4)
+            except ModSizeError:
+                pass
+            else:
+                assert False, u'Read past the end of the plugin'
+            assert ins.tell() == ins.size - 2
+
+    def test_batch_decompression(self, tmpdir):
+        """Tests that only the compressed records of the current group that
+        will be loaded are decompressed in a batch, and that they are
+        dropped once requested."""
+        def _compressed_gmst(gmst_fid):
+            return pack_record(b'GMST', gmst_fid, [compress_record_data(
+                pack_subrecord(b'EDID', b'%X\x00' % gmst_fid))],
+                               flags1=0x00040000)
+        plugin_path = tmpdir.join(u'test.esp')
+        plugin_path.write_binary(pack_plugin([
+            pack_top_group(b'GMST', [_compressed_gmst(rec_fid) for rec_fid
+                                     in (0x800, 0x801, 0x802, 0x803)]),
+            pack_top_group(b'GLOB', [_compressed_gmst(0x804)])]))
+        with MmapModReader(GPath(u'test.esp'),
+                           open(str(plugin_path), u'rb')) as ins:
+            ins.batch_decompress_sigs = frozenset([b'GMST'])
+            ins.load_fids = {b'GMST': {0x800, 0x802, 0x804}}
+            ins.long_fid_mapper = lambda short_fid: short_fid
+            data_positions = []
+            while not ins.atEnd():
+                header = ins.unpackRecHeader()
+                if header.recType == b'GRUP': continue
+                data_positions.append(ins.tell())
+                ins.seek(header.size, 1)
+            first_pos = data_positions[1]
+            assert ins.get_decompressed(first_pos) == pack_subrecord(
+                b'EDID', b'800\x00')
+            # 0x801 and 0x803 are skipped, 0x804 is in the next group
+            assert list(ins._decompressed) == [data_positions[3]]
+            assert ins.get_decompressed(data_positions[3]) == pack_subrecord(
+                b'EDID', b'802\x00')
+            assert not ins._decompressed
+
+class TestRecordHeaderTable(object):
+    @staticmethod
+    def _table(fids):
+        headers = RecordHeaderTable()
+        for rec_offset, rec_fid in enumerate(fids):
+            headers.append((b'GMST', 0, 0, rec_fid, 0), rec_offset)
+        return headers
+
+    def test_new_record_stats(self):
+        headers = self._table([0x00000800, 0x01000FFF, 0x02000801,
+                               0x01001000, 0x02000C00])
+        assert headers.new_record_stats(2) == (2, 0xC00)
+        assert headers.new_record_stats(1) == (4, 0x1000)
+        assert headers.new_record_stats(3) == (0, 0)
+
+    def test_new_record_stats_empty(self):
+        assert self._table([]).new_record_stats(0) == (0, 0)
+        assert self._table([0x00000801]).new_record_stats(0) == (1, 0x801)
+
+    def test_new_record_stats_out_of_range(self):
+        """Tests that FormIDs with mod indices above the plugin's own one
+        (HITMEs) count as new, using their object index only."""
+        headers = self._table([0x00000800, 0x01000900, 0x05000A00])
+        assert headers.new_record_stats(1) == (2, 0xA00)
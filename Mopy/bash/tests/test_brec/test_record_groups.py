@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the record group classes in brec.record_groups."""
+import struct
+
+import pytest
+
+from .. import MinimalModInfos, pack_plugin, pack_record, pack_subrecord, \
+    pack_top_group, write_plugin
+from ... import bosh
+from ...bolt import GPath
+from ...brec import MreRecord
+from ...mod_files import LoadFactory, ModFile
+
+@pytest.fixture(autouse=True)
+def _mod_infos(monkeypatch):
+    monkeypatch.setattr(bosh, u'modInfos', MinimalModInfos())
+
+def _load_gmsts(tmpdir, gmst_fids, load_fids=None):
+    """Writes a plugin with a GMST for each of the specified short fids and
+    returns it, loaded."""
+    mod_info = write_plugin(tmpdir, u'test.esp', pack_plugin([
+        pack_top_group(b'GMST', [pack_record(b'GMST', gmst_fid, [
+            pack_subrecord(b'EDID', b'iTest%X\x00' % gmst_fid),
+            pack_subrecord(b'DATA', struct.pack(u'=i', 1))])
+            for gmst_fid in gmst_fids]),
+    ], masters=[b'Oblivion.esm']), masters=[u'Oblivion.esm'])
+    mod_file = ModFile(mod_info, LoadFactory(
+        True, MreRecord.type_class[b'GMST']))
+    mod_file.load(True, load_fids=load_fids)
+    return mod_file
+
+class TestMobObjects(object):
+    def test_set_record_after_direct_edit(self, tmpdir):
+        """Tests that setRecord still replaces the right record after the
+        records list was edited directly, invalidating the cached index."""
+        gmsts = _load_gmsts(tmpdir, (0x800, 0x801, 0x802)).GMST
+        replaced = gmsts.records[2]
+        gmsts.setRecord(replaced.getTypeCopy()) # builds the index
+        del gmsts.records[0]
+        new_gmst = replaced.getTypeCopy()
+        gmsts.setRecord(new_gmst)
+        assert len(gmsts.records) == 2
+        assert gmsts.records[1] is new_gmst
+        assert gmsts.getRecord(replaced.fid) is new_gmst
+        # And once more, now that the index was fixed
+        newer_gmst = replaced.getTypeCopy()
+        gmsts.setRecord(newer_gmst)
+        assert gmsts.records[1] is newer_gmst
+
+    def test_load_fids(self, tmpdir):
+        """Tests that only the records in load_fids are loaded from a top
+        group, and that other top groups are not filtered."""
+        mod_info = write_plugin(tmpdir, u'test.esp', pack_plugin([
+            pack_top_group(b'GMST', [pack_record(b'GMST', gmst_fid, [
+                pack_subrecord(b'EDID', b'iTest%X\x00' % gmst_fid),
+                pack_subrecord(b'DATA', struct.pack(u'=i', 1))])
+                for gmst_fid in (0x800, 0x01000801, 0x01000802)]),
+            pack_top_group(b'GLOB', [pack_record(b'GLOB', 0x01000803, [
+                pack_subrecord(b'EDID', b'gTest\x00'),
+                pack_subrecord(b'FNAM', b's'),
+                pack_subrecord(b'FLTV', struct.pack(u'=f', 1.0))])]),
+        ], masters=[b'Oblivion.esm']), masters=[u'Oblivion.esm'])
+        mod_file = ModFile(mod_info, LoadFactory(
+            True, MreRecord.type_class[b'GMST'],
+            MreRecord.type_class[b'GLOB']))
+        master_fid = (GPath(u'Oblivion.esm'), 0x800)
+        own_fid = (GPath(u'test.esp'), 0x802)
+        mod_file.load(True, load_fids={b'GMST': {master_fid, own_fid}})
+        assert [r.fid for r in mod_file.GMST.records] == [master_fid, own_fid]
+        assert [r.eid for r in mod_file.GMST.records] == [u'iTest800',
+                                                          u'iTest1000802']
+        assert [r.fid for r in mod_file.GLOB.records] == [
+            (GPath(u'test.esp'), 0x803)]
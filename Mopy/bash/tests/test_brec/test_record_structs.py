@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the record classes in brec.record_structs."""
+import struct
+
+import pytest
+
+from .. import MinimalModInfos, pack_plugin, pack_record, pack_subrecord, \
+    pack_top_group, write_plugin
+from ... import bosh
+from ...bolt import GPath, sio
+from ...brec import MelSet, MelStruct, ModWriter, MreRecord
+from ...brec.record_structs import _lazy_real_classes
+from ...mod_files import LoadFactory, ModFile
+
+@pytest.fixture(autouse=True)
+def _mod_infos(monkeypatch):
+    monkeypatch.setattr(bosh, u'modInfos', MinimalModInfos())
+
+def _gmst(gmst_fid, gmst_eid, gmst_value):
+    return pack_record(b'GMST', gmst_fid, [
+        pack_subrecord(b'EDID', gmst_eid + b'\x00'),
+        pack_subrecord(b'DATA', struct.pack(u'=i', gmst_value))])
+
+def _load_gmsts(tmpdir, num_gmsts=3, lazy_unpack=True):
+    """Writes a plugin with num_gmsts integer GMSTs and returns it, loaded."""
+    mod_info = write_plugin(tmpdir, u'test.esp', pack_plugin([pack_top_group(
+        b'GMST', [_gmst(0x800 + i, b'iTest%u' % i, i)
+                  for i in xrange(num_gmsts)])], masters=[b'Oblivion.esm']),
+        masters=[u'Oblivion.esm'])
+    mod_file = ModFile(mod_info, LoadFactory(
+        True, MreRecord.type_class[b'GMST']))
+    mod_file.load(True, lazy_unpack=lazy_unpack)
+    return mod_file
+
+def _is_pending(record):
+    return type(record) in _lazy_real_classes
+
+class TestLazyRecords(object):
+    def test_decoded_on_read(self, tmpdir):
+        """Tests that a lazily loaded record is decoded the first time one of
+        its subrecord attributes is read and that it is an instance of its
+        real record class from then on."""
+        gmst = _load_gmsts(tmpdir).GMST.records[1]
+        assert _is_pending(gmst)
+        assert isinstance(gmst, MreRecord.type_class[b'GMST'])
+        assert gmst.value == 1
+        assert not _is_pending(gmst)
+        assert type(gmst) is MreRecord.type_class[b'GMST']
+        assert gmst.eid == u'iTest1'
+
+    def test_header_attrs_do_not_decode(self, tmpdir):
+        """Tests that reading the attributes set from the record header does
+        not decode the record."""
+        gmst = _load_gmsts(tmpdir).GMST.records[0]
+        assert gmst.fid == (bosh.modInfos.masterName, 0x800)
+        assert not gmst.flags1.deleted
+        assert _is_pending(gmst)
+
+    def test_write_before_read(self, tmpdir):
+        """Tests that writing a subrecord attribute of a lazily loaded record
+        before reading any decodes the record first, so the write is not
+        overwritten by the decoded data."""
+        gmst = _load_gmsts(tmpdir).GMST.records[2]
+        gmst.value = 42
+        assert not _is_pending(gmst)
+        assert gmst.value == 42
+        assert gmst.eid == u'iTest2'
+
+    def test_ensure_loaded(self, tmpdir):
+        """Tests that ensure_loaded decodes a pending record, applying the
+        deferred fid conversion, and is a noop for decoded records."""
+        gmst = _load_gmsts(tmpdir).GMST.records[0]
+        assert gmst.longFids
+        gmst.ensure_loaded()
+        assert not _is_pending(gmst)
+        assert (gmst.eid, gmst.value) == (u'iTest0', 0)
+        gmst.value = 7
+        gmst.ensure_loaded()
+        assert gmst.value == 7
+
+    def test_type_copy_of_pending(self, tmpdir):
+        """Tests that copies of a pending record stay pending and are decoded
+        independently of the original."""
+        gmst = _load_gmsts(tmpdir).GMST.records[1]
+        gmst_copy = gmst.getTypeCopy()
+        assert _is_pending(gmst) and _is_pending(gmst_copy)
+        gmst_copy.value = 5
+        assert gmst.value == 1
+        assert gmst_copy.value == 5
+        assert gmst_copy.eid == u'iTest1'
+
+    def test_only_accessed_records_decoded(self, tmpdir, monkeypatch):
+        """Tests that lazily loading a plugin and accessing one of its records
+        only decodes that record, while loading it eagerly decodes all of
+        them. The per-access hook of pending records is only paid until the
+        first access, after which the record is of its real class again."""
+        decoded = []
+        orig_load_data = MelSet.loadData
+        def _counting_load_data(mel_set, record, ins, endPos):
+            if record.recType == b'GMST': decoded.append(record.fid)
+            return orig_load_data(mel_set, record, ins, endPos)
+        monkeypatch.setattr(MelSet, u'loadData', _counting_load_data)
+        _load_gmsts(tmpdir, num_gmsts=50, lazy_unpack=False)
+        assert len(decoded) == 50
+        del decoded[:]
+        lazy_gmsts = _load_gmsts(tmpdir, num_gmsts=50).GMST.records
+        assert not decoded
+        for _i in xrange(10):
+            assert lazy_gmsts[3].value == 3
+        assert len(decoded) == 1
+        assert sum(_is_pending(g) for g in lazy_gmsts) == 49
+
+class TestMelSet(object):
+    def test_decoders_built_on_first_load(self, tmpdir):
+        """Tests that a MelSet only compiles its subrecord decoders once it
+        loads its first record."""
+        mel_set = MelSet(MelStruct(b'DATA', u'I', u'value'))
+        assert mel_set._decoders is None
+        gmst_class = MreRecord.type_class[b'GMST']
+        gmst_class.melSet._decoders = None
+        _load_gmsts(tmpdir, lazy_unpack=False)
+        assert b'DATA' in gmst_class.melSet._decoders
+
+class TestStreamDump(object):
+    def test_not_changed_after_dump(self, tmpdir):
+        """Tests that a streamed record keeps its packed data and is not
+        repacked by later saves."""
+        mod_file = _load_gmsts(tmpdir, lazy_unpack=False)
+        gmst = mod_file.GMST.records[1]
+        gmst.value = 42
+        gmst.setChanged()
+        mod_file._convert_fids(to_long=False)
+        first_out = ModWriter(sio())
+        first_size = gmst.stream_dump(first_out)
+        first_dump = first_out.out.getvalue()
+        assert not gmst.changed
+        assert len(first_dump) == first_size
+        assert first_dump.endswith(gmst.data)
+        second_out = ModWriter(sio())
+        assert gmst.stream_dump(second_out) == first_size
+        assert second_out.out.getvalue() == first_dump
+
+def _lvli(lvli_fid, entry_fid, entry_count=1):
+    return pack_record(b'LVLI', lvli_fid, [
+        pack_subrecord(b'EDID', b'TestList\x00'),
+        pack_subrecord(b'LVLD', b'\x00'),
+        pack_subrecord(b'LVLF', b'\x00'),
+        pack_subrecord(b'LVLO', struct.pack(u'=h2sIh2s', 1, b'\x00' * 2,
+                                            entry_fid, entry_count,
+                                            b'\x00' * 2))])
+
+class TestFidRoundTrip(object):
+    """Tests saving records whose fids were converted to long on load and
+    back to short on save."""
+    def _save_lvlis(self, tmpdir, lvlis, lazy_unpack=False, edit=None):
+        """Writes a plugin with the specified (packed) LVLIs, loads it, calls
+        edit on the loaded plugin if given, then saves it. Returns the saved
+        plugin's raw data and the loaded plugin."""
+        mod_info = write_plugin(tmpdir, u'test.esp', pack_plugin(
+            [pack_top_group(b'LVLI', lvlis)], masters=[b'Oblivion.esm']),
+            masters=[u'Oblivion.esm'])
+        mod_file = ModFile(mod_info, LoadFactory(
+            True, MreRecord.type_class[b'LVLI']))
+        mod_file.load(True, lazy_unpack=lazy_unpack)
+        if edit: edit(mod_file)
+        out_path = GPath(tmpdir.join(u'saved.esp').strpath)
+        mod_file.save(out_path)
+        return out_path.open(u'rb').read(), mod_file
+
+    @pytest.mark.parametrize(u'lazy_unpack', [False, True])
+    def test_in_place_edit_saved(self, tmpdir, lazy_unpack):
+        """Tests that editing a record in place without calling setChanged
+        still gets the edit saved."""
+        def _edit(mod_file):
+            mod_file.LVLI.records[0].entries[0].count = 5
+        saved_data, _mod_file = self._save_lvlis(
+            tmpdir, [_lvli(0x01000800, 0x00001234)], lazy_unpack, _edit)
+        assert _lvli(0x01000800, 0x00001234, entry_count=5) in saved_data
+
+    def test_hitme_clamped(self, tmpdir):
+        """Tests that a HITME is saved as it was loaded: clamped to the
+        plugin's own index."""
+        saved_data, _mod_file = self._save_lvlis(
+            tmpdir, [_lvli(0x01000800, 0x05000900)])
+        assert _lvli(0x01000800, 0x01000900) in saved_data
+
+    def test_low_object_id(self, tmpdir):
+        """Tests that an object ID below 0x800 is saved with the index of the
+        game master, as it would be if the plugin had been edited."""
+        saved_data, _mod_file = self._save_lvlis(
+            tmpdir, [_lvli(0x01000800, 0x01000005)])
+        assert _lvli(0x01000800, 0x00000005) in saved_data
+
+    def test_untouched_lazy_record(self, tmpdir):
+        """Tests that a lazily loaded record that was never accessed is saved
+        as is, without being decoded, unless its own fid is a HITME."""
+        raw_lvlis = [_lvli(0x01000800, 0x00001234),
+                     _lvli(0x05000801, 0x00001234)]
+        saved_data, mod_file = self._save_lvlis(tmpdir, raw_lvlis,
+                                                lazy_unpack=True)
+        untouched, hitme = mod_file.LVLI.records
+        assert _is_pending(untouched)
+        assert raw_lvlis[0] in saved_data
+        assert not _is_pending(hitme)
+        assert _lvli(0x01000801, 0x00001234) in saved_data
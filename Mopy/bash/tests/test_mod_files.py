@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the plugin-level classes in mod_files."""
+import struct
+
+import pytest
+
+from . import MinimalModInfos, pack_plugin, pack_record, pack_subrecord, \
+    pack_top_group, write_plugin
+from .. import bass, bosh, load_order
+from ..bolt import GPath
+from ..brec import MreRecord
+from ..mod_files import ConflictIndex, InternedLongFids, LoadFactory, \
+    ModFile, ModHeaderReader, ModRecordIndex
+
+@pytest.fixture(autouse=True)
+def _mod_infos(monkeypatch):
+    monkeypatch.setattr(bosh, u'modInfos', MinimalModInfos())
+
+@pytest.fixture
+def mods_bash(tmpdir, monkeypatch):
+    """Points the modsBash folder to a fresh subfolder of tmpdir."""
+    mods_bash_dir = GPath(tmpdir.mkdir(u'modsBash').strpath)
+    monkeypatch.setitem(bass.dirs, u'modsBash', mods_bash_dir)
+    return mods_bash_dir
+
+def _write_gmsts(tmpdir, plugin_name=u'test.esp', num_gmsts=3):
+    return write_plugin(tmpdir, plugin_name, pack_plugin([pack_top_group(
+        b'GMST', [pack_record(b'GMST', 0x800 + i, [
+            pack_subrecord(b'EDID', b'iTest%u\x00' % i),
+            pack_subrecord(b'DATA', struct.pack(u'=i', i))])
+                  for i in xrange(num_gmsts)])]))
+
+class TestModRecordIndex(object):
+    def test_index_cached(self, tmpdir, mods_bash):
+        mod_info = _write_gmsts(tmpdir)
+        cache_path = mods_bash.join(u'Record Index', u'test.esp.idx')
+        assert ModRecordIndex.for_mod(mod_info).top_sig_counts() == {
+            b'GMST': 3}
+        assert not cache_path.exists()
+        rec_index = ModRecordIndex.for_mod(mod_info, save_cache=True)
+        assert rec_index.top_sig_counts() == {b'GMST': 3}
+        assert cache_path.exists()
+        assert ModRecordIndex.for_mod(mod_info).top_sig_counts() == {
+            b'GMST': 3}
+
+    def test_unreadable_cache(self, tmpdir, mods_bash):
+        """Tests that any failure to read the cache makes us rebuild the
+        index instead of raising."""
+        mod_info = _write_gmsts(tmpdir)
+        ModRecordIndex.for_mod(mod_info, save_cache=True)
+        cache_path = mods_bash.join(u'Record Index', u'test.esp.idx')
+        # A pickle referencing a module that does not exist
+        with cache_path.open(u'wb') as out:
+            out.write(b'cno_such_module\nno_such_class\n.')
+        assert ModRecordIndex.for_mod(mod_info).top_sig_counts() == {
+            b'GMST': 3}
+        with cache_path.open(u'wb') as out:
+            out.write(b'garbage')
+        assert ModRecordIndex.for_mod(mod_info).top_sig_counts() == {
+            b'GMST': 3}
+
+    def test_build_error_raised(self, tmpdir, mods_bash, monkeypatch):
+        """Tests that errors raised while building the index are not
+        mistaken for an unreadable cache."""
+        mod_info = _write_gmsts(tmpdir)
+        ModRecordIndex.for_mod(mod_info, save_cache=True)
+        def _fail_build(rec_index): raise RuntimeError(u'build failed')
+        monkeypatch.setattr(ModRecordIndex, u'_build_index', _fail_build)
+        # Up to date cache, no need to build
+        assert ModRecordIndex.for_mod(mod_info).top_sig_counts() == {
+            b'GMST': 3}
+        cache_path = mods_bash.join(u'Record Index', u'test.esp.idx')
+        with cache_path.open(u'wb') as out:
+            out.write(b'garbage')
+        with pytest.raises(RuntimeError):
+            ModRecordIndex.for_mod(mod_info)
+
+    def test_read_mod_headers_no_cache(self, tmpdir, mods_bash):
+        """Tests that reading the headers of a plugin does not write a
+        record index."""
+        headers = ModHeaderReader.read_mod_headers(_write_gmsts(tmpdir))
+        assert len(headers[b'GMST']) == 3
+        assert not mods_bash.join(u'Record Index').exists()
+
+    def test_prune_cache(self, tmpdir, mods_bash):
+        for plugin_name in (u'kept.esp', u'deleted.esp'):
+            ModRecordIndex.for_mod(_write_gmsts(tmpdir, plugin_name),
+                                   save_cache=True)
+        index_dir = mods_bash.join(u'Record Index')
+        ModRecordIndex.prune_cache({GPath(u'kept.esp')})
+        assert index_dir.join(u'kept.esp.idx').exists()
+        assert not index_dir.join(u'deleted.esp.idx').exists()
+
+class TestFidTranslator(object):
+    def test_cleared_after_load(self, tmpdir):
+        """Tests that the long mapper kept by lazily loaded records forgets
+        the fids translated during the load, but still maps None to None
+        and translates fids again on demand."""
+        mod_file = ModFile(_write_gmsts(tmpdir), LoadFactory(
+            True, MreRecord.type_class[b'GMST']))
+        mod_file.load(True, lazy_unpack=True)
+        long_mapper = mod_file.GMST.records[0]._pending_unpack[1]
+        assert dict(long_mapper) == {None: None}
+        assert long_mapper(None) is None
+        assert long_mapper(0x801) == (GPath(u'test.esp'), 0x801)
+        assert mod_file.GMST.records[1].eid == u'iTest1'
+
+    def test_none_after_clear(self, tmpdir):
+        mod_file = ModFile(_write_gmsts(tmpdir), LoadFactory(
+            True, MreRecord.type_class[b'GMST']))
+        mod_file.load(True)
+        for fid_mapper, fid in ((mod_file.getLongMapper(), 0x800),
+                                (mod_file.getShortMapper(),
+                                 (GPath(u'test.esp'), 0x800))):
+            assert fid_mapper(None) is None
+            fid_mapper(fid)
+            fid_mapper.clear()
+            assert fid_mapper(None) is None
+            assert len(fid_mapper) == 1
+
+class TestInternedLongFids(object):
+    def _load_override(self, tmpdir, plugin_name):
+        """Loads a plugin overriding a STAT from Oblivion.esm and returns the
+        long fid of the STAT."""
+        mod_info = write_plugin(tmpdir, plugin_name, pack_plugin(
+            [pack_top_group(b'STAT', [pack_record(b'STAT', 0x800, [
+                pack_subrecord(b'EDID', b'TestStat\x00')])])],
+            masters=[b'Oblivion.esm']), masters=[u'Oblivion.esm'])
+        mod_file = ModFile(mod_info, LoadFactory(
+            True, MreRecord.type_class[b'STAT']))
+        mod_file.load(True)
+        return mod_file.STAT.records[0].fid
+
+    def test_shared_across_plugins(self, tmpdir):
+        """Tests that equal long fids from different plugins are the same
+        tuple within the block, and only there."""
+        with InternedLongFids():
+            fid_a = self._load_override(tmpdir, u'a.esp')
+            with InternedLongFids(): # nested blocks share the table
+                fid_b = self._load_override(tmpdir, u'b.esp')
+            fid_c = self._load_override(tmpdir, u'c.esp')
+        assert fid_a == (GPath(u'Oblivion.esm'), 0x800)
+        assert fid_a is fid_b
+        assert fid_a is fid_c
+        fid_d = self._load_override(tmpdir, u'd.esp')
+        assert fid_d == fid_a
+        assert fid_d is not fid_a
+
+class TestConflictIndex(object):
+    def test_sync(self, tmpdir, mods_bash, monkeypatch):
+        """Tests that the index has no data until it is synced, and that
+        plugins overriding records of earlier ones are counted."""
+        minfs = MinimalModInfos(*[_write_gmsts(tmpdir, p, num_gmsts=n)
+                                  for p, n in ((u'a.esp', 3), (u'b.esp', 2))])
+        lo = [GPath(u'a.esp'), GPath(u'b.esp')]
+        monkeypatch.setattr(load_order, u'cached_active_tuple',
+                            lambda: tuple(lo))
+        monkeypatch.setattr(load_order, u'cached_lo_index', lo.index)
+        conflict_index = ConflictIndex(minfs)
+        assert not conflict_index.is_synced
+        assert conflict_index.count_overrides(lo[1]) is None
+        # b.esp now overrides the first two GMSTs of a.esp
+        minfs[lo[1]].masterNames = [lo[0]]
+        assert conflict_index.plugins_to_index() == lo
+        conflict_index.sync()
+        assert conflict_index.is_synced
+        assert not conflict_index.plugins_to_index()
+        assert [conflict_index.count_overrides(p) for p in lo] == [0, 2]
+        lo.reverse()
+        conflict_index.invalidate()
+        assert conflict_index.count_overrides(lo[0]) is None
+        assert not conflict_index.plugins_to_index()
+        conflict_index.sync()
+        assert [conflict_index.count_overrides(p) for p in lo] == [0, 2]
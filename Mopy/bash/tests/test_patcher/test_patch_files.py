@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the patch file classes in patcher.patch_files."""
+import cPickle as pickle  # PY3
+import json
+from collections import defaultdict, Counter
+
+import pytest
+
+from .. import MinimalModInfos, pack_plugin, pack_record, pack_subrecord, \
+    pack_top_group, write_plugin
+from ... import bass, bosh
+from ...bolt import GPath, Progress
+from ...brec import MreRecord
+from ...exception import ModError
+from ...mod_files import LoadFactory, ModFile
+from ...patcher.patch_files import PatchManifest, _BuildStats, \
+    _PluginPrefetcher, _RecordScanBatch, _ScanFids, _SourceModCache
+from ...patcher.patchers.preservers import GraphicsPatcher
+
+@pytest.fixture
+def mod_infos(tmpdir, monkeypatch):
+    """A master with a STAT and a plugin overriding the STAT's model."""
+    def _stat(model_path):
+        return pack_plugin([pack_top_group(b'STAT', [pack_record(
+            b'STAT', 0x800, [pack_subrecord(b'EDID', b'TestStat\x00'),
+                             pack_subrecord(b'MODL', model_path + b'\x00')])])],
+            masters=[b'Oblivion.esm'] if model_path == b'b.nif' else [])
+    minfs = MinimalModInfos(
+        write_plugin(tmpdir, u'Oblivion.esm', _stat(b'a.nif')),
+        write_plugin(tmpdir, u'test.esp', _stat(b'b.nif'),
+                     masters=[u'Oblivion.esm']))
+    monkeypatch.setattr(bosh, u'modInfos', minfs)
+    return minfs
+
+class _SourceModsPatchFile(object):
+    """Just enough of a PatchFile to run the initData of patchers loading
+    source plugins via the specified _SourceModCache."""
+    def __init__(self, minfs):
+        self.p_file_minfos = minfs
+        self.loadSet = frozenset(minfs)
+        self.patcher_mod_skipcount = defaultdict(Counter)
+        self.aliases = {}
+        self.load_source_mod = None
+
+def _init_patchers_data(p_file, patchers):
+    with _SourceModCache(p_file.p_file_minfos, patchers) as source_mods:
+        p_file.load_source_mod = source_mods.load_mod
+        for patcher in patchers:
+            source_mods.init_patcher_data(patcher, Progress())
+
+class _ViewRecorder(object):
+    """Loads the source plugin test.esp and keeps the view it got."""
+    def __init__(self, rec_sigs):
+        self._rec_sigs = rec_sigs
+        self.source_view = None
+        self.load_source_mod = None
+
+    def get_source_mod_loads(self):
+        return [MreRecord.type_class[s] for s in self._rec_sigs], [
+            GPath(u'test.esp')]
+
+    def initData(self, progress):
+        self.source_view = self.load_source_mod(GPath(u'test.esp'))
+
+class TestSourceModCache(object):
+    def test_patchers_do_not_share_values(self, mod_infos):
+        """Tests that two patchers importing the same attribute from the same
+        source plugin keep their own copies of its value."""
+        p_file = _SourceModsPatchFile(mod_infos)
+        patchers = [GraphicsPatcher(u'Graphics', p_file, [GPath(u'test.esp')])
+                    for _x in xrange(2)]
+        _init_patchers_data(p_file, patchers)
+        stat_fid = (GPath(u'Oblivion.esm'), 0x800)
+        models = [p.id_data[stat_fid][u'model'] for p in patchers]
+        assert models[0].modPath == u'b.nif'
+        assert models[0] == models[1]
+        assert models[0] is not models[1]
+        models[0].modPath = u'c.nif'
+        assert models[1].modPath == u'b.nif'
+
+    def test_cell_children_loaded_separately(self, mod_infos):
+        """Tests that patchers requesting different cell children get
+        separate loads, while the others share one."""
+        recorders = [_ViewRecorder(s) for s in (
+            (b'STAT', b'CELL'), (b'STAT', b'REFR'), (b'STAT',))]
+        with _SourceModCache(mod_infos, recorders) as source_mods:
+            for recorder in recorders:
+                recorder.load_source_mod = source_mods.load_mod
+                source_mods.init_patcher_data(recorder, Progress())
+        stat_blocks = [r.source_view.STAT for r in recorders]
+        assert stat_blocks[0] is stat_blocks[2]
+        assert stat_blocks[0] is not stat_blocks[1]
+
+class TestBuildStats(object):
+    def test_save_json(self, tmpdir, monkeypatch):
+        """Tests that the saved statistics list the patchers in the order
+        they first reported, with only the stages they reported, and the
+        plugins in the order they were loaded."""
+        monkeypatch.setattr(_BuildStats, u'snapshot',
+                            staticmethod(lambda: (10.0, 4.0, 3 << 20)))
+        build_stats = _BuildStats()
+        build_stats.add_patcher(u'Merger', u'init', (9.0, 3.5, 1 << 20))
+        build_stats.add_patcher(u'Importer', u'scan', (7.5, 3.0, 3 << 20), 5)
+        build_stats.add_patcher(u'Merger', u'build', (9.5, 4.0, 2 << 20), 2)
+        build_stats.add_patcher(u'Merger', u'build', (9.5, 3.0, 3 << 20), 1)
+        build_stats.add_plugin(GPath(u'b.esp'), (8.0, 2.0, 3 << 20), 7)
+        build_stats.add_plugin(GPath(u'a.esp'), (9.0, 4.0, 3 << 20))
+        json_path = GPath(tmpdir.strpath).join(u'Patch Statistics',
+                                               u'Bashed Patch, 0.json')
+        build_stats.save_json(json_path)
+        with json_path.open(u'rb') as ins:
+            saved_stats = json.load(ins)
+        def _stats(wall, cpu, mem, records):
+            return {u'wall': wall, u'cpu': cpu, u'peak_memory_growth': mem,
+                    u'records': records}
+        assert saved_stats == {
+            u'patchers': [
+                {u'name': u'Merger', u'stages': {
+                    u'init': _stats(1.0, 0.5, 2 << 20, 0),
+                    u'build': _stats(1.0, 1.0, 1 << 20, 3)}},
+                {u'name': u'Importer', u'stages': {
+                    u'scan': _stats(2.5, 1.0, 0, 5)}},
+            ],
+            u'plugins': [dict(_stats(2.0, 2.0, 0, 7), name=u'b.esp'),
+                         dict(_stats(1.0, 0.0, 0, 0), name=u'a.esp')],
+        }
+
+class _RecordScanner(object):
+    """Patcher scanning GMSTs one at a time, recording what it was passed."""
+    def __init__(self, scanner_name, scanned, scan_fids, is_active=True):
+        self._scanner_name = scanner_name
+        self._scanned = scanned
+        self._scan_fids = scan_fids
+        self.isActive = is_active
+
+    def getName(self): return self._scanner_name
+    def getReadClasses(self): return (b'GMST',)
+    def get_record_scan_sigs(self): return [b'GMST']
+    def get_scan_fids(self): return self._scan_fids
+
+    def scan_record(self, record, patch_block):
+        self._scanned.append((self._scanner_name, record.fid[1], patch_block))
+
+class TestRecordScanBatch(object):
+    @pytest.fixture
+    def mod_file(self, tmpdir, monkeypatch):
+        """A plugin with five GMSTs, of which 0x801 is ignored and 0x803 is
+        deleted."""
+        monkeypatch.setattr(bosh, u'modInfos', MinimalModInfos())
+        gmst_flags = {0x801: 0x1000, 0x803: 0x20} # ignored, deleted
+        mod_info = write_plugin(tmpdir, u'test.esp', pack_plugin([
+            pack_top_group(b'GMST', [pack_record(b'GMST', gmst_fid, [
+                pack_subrecord(b'EDID', b'iTest%X\x00' % gmst_fid),
+                pack_subrecord(b'DATA', b'\x00' * 4)],
+                flags1=gmst_flags.get(gmst_fid, 0))
+                for gmst_fid in (0x804, 0x800, 0x801, 0x802, 0x803)])]))
+        mod_file = ModFile(mod_info, LoadFactory(
+            True, MreRecord.type_class[b'GMST']))
+        mod_file.load(True)
+        return mod_file
+
+    def test_scan_order(self, mod_file):
+        """Tests that each record is passed to all interested patchers in
+        turn, in the order of the plugin, skipping ignored and deleted
+        records and the ones a patcher has no data for."""
+        patch_file = _SourceModsPatchFile(MinimalModInfos())
+        patch_file.GMST = patch_block = object()
+        scanned = []
+        scan_batch = _RecordScanBatch(patch_file, [
+            _RecordScanner(u'All', scanned, {}),
+            _RecordScanner(u'Some', scanned, {b'GMST': {
+                (GPath(u'test.esp'), f) for f in (0x800, 0x801, 0x804)}})])
+        assert scan_batch.getName() == u'All, Some'
+        scan_batch.scan_mod_file(mod_file, Progress())
+        assert scanned == [
+            (u'All', 0x804, patch_block), (u'Some', 0x804, patch_block),
+            (u'All', 0x800, patch_block), (u'Some', 0x800, patch_block),
+            (u'All', 0x802, patch_block)]
+
+    def test_inactive_patcher(self, mod_file):
+        """Tests that patchers that are not active don't get passed any
+        records, same as with Patcher.scan_mod_file."""
+        patch_file = _SourceModsPatchFile(MinimalModInfos())
+        patch_file.GMST = object()
+        scanned = []
+        inactive_scanner = _RecordScanner(u'Inactive', scanned, {},
+                                          is_active=False)
+        scan_batch = _RecordScanBatch(patch_file, [
+            inactive_scanner, _RecordScanner(u'Active', scanned, {})])
+        scan_batch.scan_mod_file(mod_file, Progress())
+        assert [s[:2] for s in scanned] == [
+            (u'Active', 0x804), (u'Active', 0x800), (u'Active', 0x802)]
+        del scanned[:]
+        inactive_scanner.isActive = True
+        scan_batch.scan_mod_file(mod_file, Progress())
+        assert [s[0] for s in scanned].count(u'Inactive') == 3
+
+class _PatchBlock(object):
+    """Stand-in for a patch block, only has its records by fid."""
+    def __init__(self):
+        self.id_records = {}
+
+class TestPluginPrefetcher(object):
+    @pytest.fixture
+    def gmst_plugins(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(bosh, u'modInfos', MinimalModInfos())
+        return [write_plugin(tmpdir, plugin_name, pack_plugin([
+            pack_top_group(b'GMST', [pack_record(b'GMST', 0x800 + i, [
+                pack_subrecord(b'EDID', b'iTest%u\x00' % i),
+                pack_subrecord(b'DATA', b'\x00' * 4)]) for i in xrange(3)])]))
+                for plugin_name in (u'a.esp', u'b.esp')]
+
+    def test_prefetched(self, gmst_plugins):
+        """Tests that a prefetched plugin is loaded with only the records
+        the scan fids contain."""
+        load_factory = LoadFactory(False, MreRecord.type_class[b'GMST'])
+        scan_fids = {b'GMST': _ScanFids(_PatchBlock(), [
+            {(GPath(u'a.esp'), 0x801)}])}
+        with _PluginPrefetcher(scan_fids) as prefetcher:
+            prefetcher.prefetch(gmst_plugins[0], load_factory, True,
+                                scan_fids)
+            mod_file = prefetcher.get_loaded(GPath(u'a.esp'), load_factory,
+                                             scan_fids)
+            assert [r.fid for r in mod_file.GMST.records] == [
+                (GPath(u'a.esp'), 0x801)]
+            # Nothing pending anymore
+            assert prefetcher.get_loaded(GPath(u'a.esp'), load_factory,
+                                         scan_fids) is None
+
+    def test_stale(self, gmst_plugins):
+        """Tests that prefetched plugins are not handed out for another
+        plugin or once the patch or the load factory changed."""
+        patch_block = _PatchBlock()
+        scan_fids = {b'GMST': _ScanFids(patch_block, [])}
+        load_factory = LoadFactory(False, MreRecord.type_class[b'GMST'])
+        with _PluginPrefetcher(scan_fids) as prefetcher:
+            prefetcher.prefetch(gmst_plugins[0], load_factory, True,
+                                scan_fids)
+            assert prefetcher.get_loaded(GPath(u'b.esp'), load_factory,
+                                         scan_fids) is None
+            prefetcher.prefetch(gmst_plugins[1], load_factory, True,
+                                scan_fids)
+            patch_block.id_records[(GPath(u'b.esp'), 0x800)] = None
+            assert prefetcher.get_loaded(GPath(u'b.esp'), load_factory,
+                                         scan_fids) is None
+            prefetcher.prefetch(gmst_plugins[1], load_factory, True,
+                                scan_fids)
+            load_factory.addClass(MreRecord.type_class[b'STAT'])
+            assert prefetcher.get_loaded(GPath(u'b.esp'), load_factory,
+                                         scan_fids) is None
+
+    def test_load_error(self, tmpdir, monkeypatch):
+        """Tests that errors raised while prefetching a plugin are raised
+        when getting it."""
+        monkeypatch.setattr(bosh, u'modInfos', MinimalModInfos())
+        mod_info = write_plugin(tmpdir, u'broken.esp', b'\x00' * 10)
+        load_factory = LoadFactory(False, MreRecord.type_class[b'GMST'])
+        with _PluginPrefetcher({}) as prefetcher:
+            prefetcher.prefetch(mod_info, load_factory, False, None)
+            with pytest.raises(ModError):
+                prefetcher.get_loaded(GPath(u'broken.esp'), load_factory,
+                                      None)
+
+class TestPatchManifest(object):
+    @pytest.fixture
+    def manifest(self, tmpdir, monkeypatch):
+        """A manifest for a patch written to tmpdir, with made up inputs."""
+        monkeypatch.setitem(bass.dirs, u'modsBash',
+                            GPath(tmpdir.mkdir(u'modsBash').strpath))
+        # Skip __init__, which collects the inputs from the running app
+        build_manifest = PatchManifest.__new__(PatchManifest)
+        build_manifest.patch_info = write_plugin(
+            tmpdir, u'Bashed Patch, 0.esp', pack_plugin([]))
+        build_manifest.build_inputs = {u'configs': {u'Test': True}}
+        return build_manifest
+
+    def test_matches_last_build(self, manifest):
+        assert not manifest.matches_last_build()
+        manifest.save()
+        assert manifest.matches_last_build()
+        manifest.build_inputs = {u'configs': {u'Test': False}}
+        assert not manifest.matches_last_build()
+
+    @pytest.mark.parametrize(u'manifest_data', [
+        b'garbage',
+        b'cno_such_module\nno_such_class\n.',
+        pickle.dumps([1, 2, 3], -1),
+        pickle.dumps({u'version': 1}, -1),
+    ])
+    def test_unreadable_manifest(self, manifest, manifest_data):
+        """Tests that any manifest that can't be read or validated makes us
+        rebuild instead of raising."""
+        manifest.save()
+        manifest_path = PatchManifest._manifest_path(
+            manifest.patch_info.name)
+        with manifest_path.open(u'wb') as out:
+            out.write(manifest_data)
+        assert not manifest.matches_last_build()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation, either version 3
+#  of the License, or (at your option) any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Wrye Bash.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye, 2010-2020 Wrye Bash Team
+#  https://github.com/wrye-bash
+#
+# =============================================================================
+"""Tests for the preserver patchers in patcher.patchers.preservers."""
+from collections import Counter
+
+from ..test_patch_files import _init_patchers_data, _SourceModsPatchFile, \
+    mod_infos
+from ....bolt import GPath
+from ....brec import MreRecord
+from ....mod_files import LoadFactory, ModFile
+from ....patcher.patchers.preservers import GraphicsPatcher
+
+def _load_stats(mod_info):
+    mod_file = ModFile(mod_info, LoadFactory(
+        True, MreRecord.type_class[b'STAT']))
+    mod_file.load(True)
+    return mod_file.STAT.records
+
+class _PatchBlock(object):
+    """Records the records a patcher copies into the patch."""
+    def __init__(self):
+        self.id_records = {}
+
+    def setRecord(self, record):
+        self.id_records[record.fid] = record
+
+class TestGraphicsPatcher(object):
+    def _init_patcher(self, minfs):
+        p_file = _SourceModsPatchFile(minfs)
+        patcher = GraphicsPatcher(u'Graphics', p_file, [GPath(u'test.esp')])
+        _init_patchers_data(p_file, [patcher])
+        return patcher
+
+    def test_scan_record(self, mod_infos):
+        """Tests that only records differing from the imported data are
+        copied into the patch."""
+        patcher = self._init_patcher(mod_infos)
+        patch_block = _PatchBlock()
+        master_stat, = _load_stats(mod_infos[GPath(u'Oblivion.esm')])
+        source_stat, = _load_stats(mod_infos[GPath(u'test.esp')])
+        patcher.scan_record(source_stat, patch_block)
+        assert not patch_block.id_records
+        patcher.scan_record(master_stat, patch_block)
+        assert list(patch_block.id_records) == [master_stat.fid]
+
+    def test_inner_loop(self, mod_infos):
+        """Tests that the imported model is set on records with a different
+        one, ignoring case."""
+        patcher = self._init_patcher(mod_infos)
+        master_stat, = _load_stats(mod_infos[GPath(u'Oblivion.esm')])
+        upper_stat = master_stat.getTypeCopy()
+        upper_stat.model.modPath = u'B.NIF'
+        kept, type_count = [], Counter()
+        patcher._inner_loop(kept.append, [upper_stat], b'STAT', type_count)
+        assert not kept
+        assert upper_stat.model.modPath == u'B.NIF'
+        patcher._inner_loop(kept.append, [master_stat], b'STAT', type_count)
+        assert kept == [master_stat.fid]
+        assert type_count[b'STAT'] == 1
+        assert master_stat.model.modPath == u'b.nif'
+
+    def test_record_scan_sigs(self, mod_infos):
+        """Tests that only preservers scanning plugins the default way have
+        their records passed one at a time."""
+        class _CustomScanPatcher(GraphicsPatcher):
+            def scanModFile(self, modFile, progress): pass
+        p_file = _SourceModsPatchFile(mod_infos)
+        patchers = [patcher_class(u'Graphics', p_file, [GPath(u'test.esp')])
+                    for patcher_class in (GraphicsPatcher, _CustomScanPatcher)]
+        _init_patchers_data(p_file, patchers)
+        assert patchers[0].get_record_scan_sigs() == [b'STAT']
+        assert patchers[1].get_record_scan_sigs() is None